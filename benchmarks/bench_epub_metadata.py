@@ -0,0 +1,127 @@
+"""Benchmark reading EPUB metadata across synthetic EPUBs of increasing size.
+
+Run with `python benchmarks/bench_epub_metadata.py`. The bounded reader is compared to reading
+the whole container and package document with `zip.read` and `etree.fromstring`, as before.
+Large books grow by their chapters, hostile books by their package document or entries.
+"""
+
+import io
+import time
+import tracemalloc
+import zipfile
+
+from lxml import etree
+
+from booklink.metadata_formats import (
+    MetadataFormatError,
+    read_epub_metadata,
+)
+
+REPETITIONS = 5
+MIB = 1024 * 1024
+
+CONTAINER = b"""<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+NAMESPACES = {
+    "n": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "pkg": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+}
+
+
+def make_opf(padding: int = 0) -> bytes:
+    """Return a package document, padded with a comment"""
+    return (
+        b'<?xml version="1.0"?>\n<package xmlns="http://www.idpf.org/2007/opf" version="2.0">'
+        b'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Title</dc:title>'
+        b"<dc:creator>Author</dc:creator><dc:language>en</dc:language><dc:date>2024</dc:date>"
+        b"<dc:identifier>id</dc:identifier></metadata><!--" + b" " * padding + b"--></package>"
+    )
+
+
+def make_epub(opf: bytes, chapters: int = 1, chapter_bytes: int = 1024) -> bytes:
+    """Return an EPUB with the package document and incompressible chapters"""
+    buffer = io.BytesIO()
+    chapter = bytes(range(256)) * (chapter_bytes // 256)
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", CONTAINER)
+        archive.writestr("OEBPS/content.opf", opf)
+        for index in range(chapters):
+            archive.writestr(f"OEBPS/chapter{index}.xhtml", chapter, zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+def read_unbounded(data: bytes) -> dict[str, str]:
+    """Read the metadata without limits, as before the bounded reader"""
+    with zipfile.ZipFile(io.BytesIO(data), mode="r") as archive:
+        container = etree.fromstring(archive.read("META-INF/container.xml"))
+        path = container.xpath("n:rootfiles/n:rootfile/@full-path", namespaces=NAMESPACES)[0]
+        package = etree.fromstring(archive.read(path), etree.XMLParser(huge_tree=True))
+    return {
+        element: package.xpath(f"//dc:{element}/text()", namespaces=NAMESPACES)[0]
+        for element in ("title", "creator", "language", "date", "identifier")
+    }
+
+
+def bench(read, data: bytes) -> tuple[float, float, str]:
+    """Return the latency in ms, the peak of allocated memory in MiB and the outcome"""
+
+    def read_once() -> str:
+        try:
+            read(data)
+        except (MetadataFormatError, etree.XMLSyntaxError) as exc:
+            return type(exc).__name__
+        return "ok"
+
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        outcome = read_once()
+    latency = (time.perf_counter() - start) / REPETITIONS * 1e3
+
+    # Memory is traced in a separate run, tracing slows down allocations
+    tracemalloc.start()
+    read_once()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency, peak / MIB, outcome
+
+
+def corpus() -> list[tuple[str, bytes]]:
+    """Return synthetic EPUBs of increasing size"""
+    books = [
+        (f"{size} MiB book", make_epub(make_opf(), chapters=size, chapter_bytes=MIB))
+        for size in (1, 16, 128)
+    ]
+    books += [
+        (f"{size} MiB package", make_epub(make_opf(padding=size * MIB))) for size in (1, 16, 128)
+    ]
+    books += [
+        (f"{entries} entries", make_epub(make_opf(), chapters=entries, chapter_bytes=0))
+        for entries in (1_000, 20_000)
+    ]
+    return books
+
+
+def main():
+    """Print latency and memory of reading metadata per book"""
+    print(
+        f"{'book':>18} {'size [MiB]':>11} {'bounded [ms]':>13} {'peak [MiB]':>11} "
+        f"{'outcome':>20} {'unbounded [ms]':>15} {'peak [MiB]':>11}"
+    )
+    for name, data in corpus():
+        bounded = bench(read_epub_metadata, data)
+        unbounded = bench(read_unbounded, data)
+        print(
+            f"{name:>18} {len(data) / MIB:>11.1f} {bounded[0]:>13.2f} {bounded[1]:>11.1f} "
+            f"{bounded[2]:>20} {unbounded[0]:>15.2f} {unbounded[1]:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmark FileRegister operations against the number of active channels.
+
+Run with `python benchmarks/bench_file_register.py`. Latencies should stay flat as the number of
+channels grows.
+"""
+
+import time
+from dataclasses import dataclass
+
+from booklink.storage import (
+    FileRegister,
+    RegisteredFile,
+)
+from booklink.utils import now_unixutc
+
+CHANNEL_COUNTS = (1_000, 10_000, 50_000)
+FILES_PER_CHANNEL = 2
+REPETITIONS = 1_000
+
+
+@dataclass
+class BenchFile(RegisteredFile):
+    """Minimal file for benchmarking"""
+
+    def size_bytes(self) -> int:
+        """Return the size of the file in bytes"""
+        return 1
+
+
+def filled_register(n_channels: int) -> tuple[FileRegister, list[str]]:
+    """Return a register with files in the given number of channels and the file IDs"""
+    register = FileRegister(
+        max_files_in_channel=FILES_PER_CHANNEL,
+        file_expiration_seconds=3600,
+        max_total_file_size_bytes=10 * n_channels * FILES_PER_CHANNEL,
+    )
+    file_ids = [
+        register.add_file(f"channel-{i}", BenchFile(created_at_unixutc=now_unixutc()))
+        for i in range(n_channels)
+        for _ in range(FILES_PER_CHANNEL)
+    ]
+    return register, file_ids
+
+
+def bench_remove(register: FileRegister, file_ids: list[str]) -> float:
+    """Return the mean latency of removing a file in microseconds"""
+    to_remove = file_ids[-REPETITIONS:]
+    start = time.perf_counter()
+    for file_id in to_remove:
+        register.remove_file(file_id)
+    return (time.perf_counter() - start) / len(to_remove) * 1e6
+
+
+def bench_unique_file_id(register: FileRegister) -> float:
+    """Return the mean latency of drawing a unique file ID in microseconds"""
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        register._generate_unique_file_id()  # pylint: disable=protected-access
+    return (time.perf_counter() - start) / REPETITIONS * 1e6
+
+
+def main():
+    """Print the latencies per channel count"""
+    print(f"{'channels':>10} {'unique id [us]':>15} {'remove [us]':>12}")
+    for n_channels in CHANNEL_COUNTS:
+        register, file_ids = filled_register(n_channels)
+        unique_id_us = bench_unique_file_id(register)
+        remove_us = bench_remove(register, file_ids)
+        print(f"{n_channels:>10} {unique_id_us:>15.1f} {remove_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
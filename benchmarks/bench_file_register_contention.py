@@ -0,0 +1,88 @@
+"""Benchmark concurrent polling of a FileRegister with one shard against many shards.
+
+Run with `python benchmarks/bench_file_register_contention.py`. Each poller repeatedly lists
+the files of its own channel while a writer keeps uploading and removing files.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+
+from booklink.storage import (
+    FileRegister,
+    RegisteredFile,
+)
+from booklink.utils import now_unixutc
+
+SHARD_COUNTS = (1, 8, 32)
+POLLERS = 64
+FILES_PER_CHANNEL = 5
+DURATION_SECONDS = 2.0
+
+
+@dataclass
+class BenchFile(RegisteredFile):
+    """Minimal file for benchmarking"""
+
+    def size_bytes(self) -> int:
+        """Return the size of the file in bytes"""
+        return 1
+
+
+def filled_register(shards: int) -> FileRegister:
+    """Return a register with files in one channel per poller"""
+    register = FileRegister(
+        max_files_in_channel=FILES_PER_CHANNEL + 1,
+        file_expiration_seconds=3600,
+        max_total_file_size_bytes=10 * POLLERS * FILES_PER_CHANNEL,
+        shards=shards,
+    )
+    for i in range(POLLERS):
+        for _ in range(FILES_PER_CHANNEL):
+            register.add_file(f"channel-{i}", BenchFile(created_at_unixutc=now_unixutc()))
+    return register
+
+
+def bench_polls_per_second(register: FileRegister) -> float:
+    """Return the number of polls per second of all pollers together"""
+    start = threading.Event()
+    stop = threading.Event()
+    polls = [0] * POLLERS
+
+    def poll(index: int):
+        channel_id = f"channel-{index}"
+        start.wait()
+        while not stop.is_set():
+            register.get_files_for_channel(channel_id)
+            polls[index] += 1
+
+    def write():
+        start.wait()
+        while not stop.is_set():
+            file_id = register.add_file("channel-0", BenchFile(created_at_unixutc=now_unixutc()))
+            register.remove_file(file_id)
+
+    threads = [threading.Thread(target=poll, args=(i,)) for i in range(POLLERS)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    start.set()
+    time.sleep(DURATION_SECONDS)
+    stop.set()
+    polls_in_duration = sum(polls)
+    for thread in threads:
+        thread.join()
+
+    return polls_in_duration / DURATION_SECONDS
+
+
+def main():
+    """Print the poll throughput per shard count"""
+    print(f"{'shards':>8} {'polls/s':>12}")
+    for shards in SHARD_COUNTS:
+        polls_per_second = bench_polls_per_second(filled_register(shards))
+        print(f"{shards:>8} {polls_per_second:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
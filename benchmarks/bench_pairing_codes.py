@@ -0,0 +1,71 @@
+"""Benchmark allocating pairing codes with many live clients.
+
+Run with `python benchmarks/bench_pairing_codes.py`. Random draws of 4-character codes, as
+used before the allocator, are compared to the allocator at the same number of live codes.
+"""
+
+import random
+import time
+
+from booklink.pairing_codes import (
+    PAIRING_CODE_ALPHABET,
+    PairingCodeAllocator,
+)
+
+LIVE_CODES = (10_000, 100_000, 1_000_000)
+REPETITIONS = 10_000
+MAX_RANDOM_DRAWS = 10
+
+
+def random_code() -> str:
+    """Draw a 4-character code at random, as before the allocator"""
+    return "".join(random.choices(PAIRING_CODE_ALPHABET, k=4))
+
+
+def bench_random_draws(live_codes: set[str]) -> tuple[float, int]:
+    """Return the latency of drawing a free code in microseconds and the number of failures"""
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        for _ in range(MAX_RANDOM_DRAWS):
+            if random_code() not in live_codes:
+                break
+        else:
+            failures += 1
+    return (time.perf_counter() - start) / REPETITIONS * 1e6, failures
+
+
+def bench_allocator(allocator: PairingCodeAllocator) -> float:
+    """Return the latency of allocating and releasing a code in microseconds"""
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        allocator.release(allocator.allocate())
+    return (time.perf_counter() - start) / REPETITIONS * 1e6
+
+
+def main():
+    """Print the allocation latency per number of live codes"""
+    print(
+        f"{'live':>10} {'random draw [us]':>17} {'failures':>9} "
+        f"{'allocator [us]':>15} {'code length':>12}"
+    )
+    for n_live in LIVE_CODES:
+        # Before the allocator, all live codes had 4 characters
+        four_char_codes = PairingCodeAllocator(min_length=4, max_occupancy=1)
+        random_latency, failures = bench_random_draws(
+            {four_char_codes.allocate() for _ in range(n_live)}
+        )
+
+        allocator = PairingCodeAllocator()
+        for _ in range(n_live):
+            allocator.allocate()
+        allocator_latency = bench_allocator(allocator)
+        code_length = len(allocator.allocate())
+        print(
+            f"{n_live:>10} {random_latency:>17.2f} {failures:>9} "
+            f"{allocator_latency:>15.2f} {code_length:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
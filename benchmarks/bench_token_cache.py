@@ -0,0 +1,61 @@
+"""Benchmark polling the files of a channel with and without the validated-token cache.
+
+Run with `python benchmarks/bench_token_cache.py`. Each poll lists the files of a channel, which
+validates the channel token.
+"""
+
+import time
+
+from booklink.application_service import (
+    ApplicationService,
+    ApplicationServiceConfig,
+)
+
+FILES_PER_CHANNEL = (1, 5, 20)
+DURATION_SECONDS = 1.0
+
+
+def paired_service(token_cache_size: int, n_files: int):
+    """Return a service with a channel holding files and the channel's credentials"""
+    service = ApplicationService(
+        ApplicationServiceConfig(
+            client_jwt_secret="bench_secret_of_at_least_32_bytes",
+            channel_jwt_secret="bench_secret_of_at_least_32_bytes",
+            max_files_in_channel=n_files,
+            token_cache_size=token_cache_size,
+        )
+    )
+    ereader = service.new_client("E-Reader")
+    sender = service.new_client("Sender")
+    channel = service.new_channel_using_code(sender.id, sender.token, ereader.pairing_code)
+    for i in range(n_files):
+        service.store_file_for_channel(
+            channel.id, sender.id, channel.token, f"book-{i}.epub", b"content"
+        )
+    return service, channel.id, sender.id, channel.token
+
+
+def bench_polls_per_second(token_cache_size: int, n_files: int) -> float:
+    """Return the number of polls per second"""
+    service, channel_id, client_id, token = paired_service(token_cache_size, n_files)
+
+    polls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION_SECONDS:
+        service.get_files_for_channel(channel_id, client_id, token)
+        polls += 1
+
+    return polls / (time.perf_counter() - start)
+
+
+def main():
+    """Print the poll throughput per number of files with and without cache"""
+    print(f"{'files':>8} {'uncached polls/s':>18} {'cached polls/s':>16}")
+    for n_files in FILES_PER_CHANNEL:
+        uncached = bench_polls_per_second(token_cache_size=0, n_files=n_files)
+        cached = bench_polls_per_second(token_cache_size=1024, n_files=n_files)
+        print(f"{n_files:>8} {uncached:>18.0f} {cached:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
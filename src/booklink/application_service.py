@@ -6,21 +6,50 @@ The service layer interfaces with code that makes the application service availa
 """
 
 import dataclasses
+import hashlib
 import io
+import threading
 from typing import (
-    Any,
+    Callable,
+    Iterator,
     List,
     Optional,
     TypeAlias,
 )
 
+from booklink.channel import Channel
+from booklink.channel_events import (
+    SubscriberLimit,
+    file_events,
+)
 from booklink.ebookfile import (
     BookMetadata,
+    ContentReader,
+    EbookFileListing,
     InMemoryEbookFile,
+    MetaDataFactory,
+)
+from booklink.metadata_extraction import (
+    ExecutorKind,
+    MetadataCache,
+    MetadataExtractionStats,
+    MetadataExtractor,
 )
 from booklink.pair_devices import PairingRegister
+from booklink.reaper import Reaper
 from booklink.security import Authenticator
-from booklink.storage import FileRegister
+from booklink.state_backend import (
+    LocalStateBackend,
+    SharedStateBackend,
+    StateBackend,
+    StateServer,
+)
+from booklink.storage import (
+    ChannelSnapshot,
+    FileRegister,
+    FileRegisterError,
+)
+from booklink.utils import now_unixutc
 
 
 @dataclasses.dataclass
@@ -42,16 +71,103 @@ class ChannelResponse:
 
 @dataclasses.dataclass
 class EbookFileResponse:
-    """File data"""
+    """File data, without content when listing files"""
 
     id: str
     name: str
-    data: io.BytesIO
+    data: Optional[ContentReader]
     size: int
     expires_at_unixutc: float
     title: str
     author: str
     book_identifier: str
+    content_hash: str
+    has_cover: bool
+
+
+@dataclasses.dataclass
+class CoverResponse:
+    """Cover image of a file"""
+
+    data: bytes
+    media_type: str
+    etag: str  # Derived from the content of the file, the cover never changes for an ETag
+
+
+@dataclasses.dataclass
+class ChannelsUpdateResponse:
+    """Channels of a client at a version"""
+
+    version: int
+    channels: List[ChannelResponse]
+
+
+@dataclasses.dataclass
+class FilesUpdateResponse:
+    """Files of a channel at a version"""
+
+    version: int
+    files: List[EbookFileResponse]
+
+
+@dataclasses.dataclass
+class ChannelEventResponse:
+    """Change of the files of a channel.
+
+    A "snapshot" event lists all files of the channel. The other kinds ("add", "remove",
+    "expire") list the one file that changed.
+    """
+
+    kind: str
+    version: int
+    files: List[EbookFileResponse]
+
+
+class ChannelEventStream:
+    """Events of a channel for one subscriber, who holds a subscriber slot until closing"""
+
+    def __init__(
+        self,
+        events: Iterator[Optional[ChannelEventResponse]],
+        on_close: Callable[[], None],
+    ):
+        self._events = events
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self) -> Iterator[Optional[ChannelEventResponse]]:
+        return self._events
+
+    def close(self):
+        """Stop the events and free the subscriber slot"""
+        if self._closed:
+            return
+        self._closed = True
+        self._on_close()
+
+
+@dataclasses.dataclass(frozen=True)
+class ChannelCredentials:
+    """Channel ID and channel token of a client"""
+
+    channel_id: str
+    token: str
+
+
+@dataclasses.dataclass
+class InboxFileResponse:
+    """File data with the channel the file was sent through"""
+
+    channel_id: str
+    file: EbookFileResponse
+
+
+@dataclasses.dataclass
+class InboxResponse:
+    """Files of several channels at a version"""
+
+    version: str
+    files: List[InboxFileResponse]
 
 
 FileID: TypeAlias = str  # pylint: disable=invalid-name
@@ -66,13 +182,41 @@ class ApplicationServiceConfig:
 
     max_clients_in_pairing: int = 100
     client_expiration: float = 60 * 60 * 24
-    max_draws_client_id: int = 10
+    channel_expiration: float = 60 * 60 * 24
+    max_channels_per_client: int = 10
 
     max_files_in_channel: int = 20
 
     total_file_capacity_bytes: int = 1024 * 1024 * 100
+    max_file_size_bytes: int = 1024 * 1024 * 20
     file_expiration: float = 60 * 2
     max_draws_file_id: int = 10
+    file_register_shards: int = 8
+
+    # Upper limit for waiting for changes of channels or files
+    max_long_poll_timeout: float = 30
+
+    # Subscribers of channel events per channel and process
+    max_subscribers_per_channel: int = 8
+
+    # Cache successful token validations, 0 disables the cache
+    token_cache_size: int = 1024
+    token_cache_ttl: float = 60
+
+    # Extract metadata in a pool of workers after upload, 0 extracts it during the upload
+    metadata_workers: int = 0
+    metadata_executor: ExecutorKind = "thread"
+    metadata_max_pending: int = 64
+
+    # Metadata remembered by content hash, 0 disables the cache
+    metadata_cache_size: int = 1024
+    metadata_cache_cover_bytes: int = 64 * 1024 * 1024  # Cover images take most of the cache
+
+    # Evict expired data in a background thread instead of on request threads, if set
+    reaper_interval: Optional[float] = None
+
+    # Share the registers with other processes through the state server at this Unix socket
+    state_server_address: Optional[str] = None
 
 
 class ApplicationService:
@@ -81,25 +225,115 @@ class ApplicationService:
     def __init__(
         self,
         config: ApplicationServiceConfig,
+        backend: Optional[StateBackend] = None,
     ):
-        """Inits the application service."""
+        """Inits the application service.
+
+        Without a backend, the registers live in this process, unless the configuration names
+        a state server to connect to.
+        """
         self.config = config
-        self.pairing_register = PairingRegister(
-            client_expiration_seconds=config.client_expiration,
-            max_clients_in_pairing=config.max_clients_in_pairing,
-            max_random_draws=config.max_draws_client_id,
-        )
-        self.file_register = FileRegister(
-            max_files_in_channel=config.max_files_in_channel,
-            file_expiration_seconds=config.file_expiration,
-            max_total_file_size_bytes=config.total_file_capacity_bytes,
-            max_random_draws=config.max_draws_file_id,
+        self.backend = backend or self._default_backend(config)
+        self.client_auth = Authenticator(
+            jwt_secret=config.client_jwt_secret,
+            id_factors={"id"},
+            cache_size=config.token_cache_size,
+            cache_ttl_seconds=config.token_cache_ttl,
         )
-        self.client_auth = Authenticator(jwt_secret=config.client_jwt_secret, id_factors={"id"})
         self.channel_auth = Authenticator(
-            jwt_secret=config.channel_jwt_secret, id_factors={"channel_id", "client_id"}
+            jwt_secret=config.channel_jwt_secret,
+            id_factors={"channel_id", "client_id"},
+            cache_size=config.token_cache_size,
+            cache_ttl_seconds=config.token_cache_ttl,
+        )
+
+        self.channel_subscribers = SubscriberLimit(config.max_subscribers_per_channel)
+
+        self.metadata_cache = MetadataCache(
+            config.metadata_cache_size, config.metadata_cache_cover_bytes
+        )
+        self._metadata_extractor: Optional[MetadataExtractor] = None
+        self.__extractor_lock = threading.Lock()
+
+        # Expired data is evicted where the registers live
+        self.reaper: Optional[Reaper] = None
+        if config.reaper_interval is not None and self.backend.is_local:
+            self.reaper = Reaper(
+                tasks=[self.file_register.prune_expired_files, self.pairing_register.prune_data],
+                interval_seconds=config.reaper_interval,
+            )
+            self.reaper.start()
+
+    @staticmethod
+    def _default_backend(config: ApplicationServiceConfig) -> StateBackend:
+        """Create the backend described by the configuration"""
+        if config.state_server_address is not None:
+            return SharedStateBackend(
+                config.state_server_address, authkey=state_server_authkey(config)
+            )
+
+        inline_pruning = config.reaper_interval is None
+        return LocalStateBackend(
+            pairing_register=PairingRegister(
+                client_expiration_seconds=config.client_expiration,
+                max_clients_in_pairing=config.max_clients_in_pairing,
+                inline_pruning=inline_pruning,
+                channel_expiration_seconds=config.channel_expiration,
+                max_channels_per_client=config.max_channels_per_client,
+            ),
+            file_register=FileRegister(
+                max_files_in_channel=config.max_files_in_channel,
+                file_expiration_seconds=config.file_expiration,
+                max_total_file_size_bytes=config.total_file_capacity_bytes,
+                max_random_draws=config.max_draws_file_id,
+                inline_pruning=inline_pruning,
+                shards=config.file_register_shards,
+                max_file_size_bytes=config.max_file_size_bytes,
+            ),
         )
 
+    @property
+    def metadata_extractor(self) -> Optional[MetadataExtractor]:
+        """Return the pool extracting metadata after upload, None if extraction is inline.
+
+        The pool is started on first use, so services that never store files have no workers.
+        """
+        if self.config.metadata_workers <= 0:
+            return None
+        with self.__extractor_lock:
+            if self._metadata_extractor is None:
+                self._metadata_extractor = MetadataExtractor(
+                    workers=self.config.metadata_workers,
+                    executor=self.config.metadata_executor,
+                    max_pending=self.config.metadata_max_pending,
+                )
+            return self._metadata_extractor
+
+    @property
+    def pairing_register(self) -> PairingRegister:
+        """Return the register of clients and channels"""
+        return self.backend.pairing_register
+
+    @property
+    def file_register(self) -> FileRegister:
+        """Return the register of files"""
+        return self.backend.file_register
+
+    def state_server(self, address: str) -> StateServer:
+        """Create a server sharing the registers of this service with other processes"""
+        if not isinstance(self.backend, LocalStateBackend):
+            raise ValueError("Only registers living in this process can be shared")
+        return StateServer(self.backend, address=address, authkey=state_server_authkey(self.config))
+
+    def close(self):
+        """Stop background work of the service"""
+        if self.reaper is not None:
+            self.reaper.stop()
+        with self.__extractor_lock:
+            if self._metadata_extractor is not None:
+                self._metadata_extractor.shutdown()
+        self.backend.close()
+
     def verify_channel_claim(self, channel_id: str, client_id: str, token: str):
         """Check if the client has access to the channel."""
         self.channel_auth.validate(token=token, channel_id=channel_id, client_id=client_id)
@@ -130,11 +364,16 @@ class ApplicationService:
     ) -> ChannelResponse:
         """Create a channel for the client and the e-reader.
 
+        The e-reader's token is minted once here and stored with the channel.
+
         Returns ID, token for client
         """
         self.verify_client_claim(client_id, token)
 
-        channel = self.pairing_register.new_channel(client_id, pairing_code_ereader.lower())
+        pairing_code_ereader = pairing_code_ereader.lower()
+        ereader = self.pairing_register.get_client_by_pairing_code(pairing_code_ereader)
+        channel = self.pairing_register.new_channel(client_id, pairing_code_ereader)
+        self._channel_token(channel, ereader.id)
         token = self.channel_auth.token(
             channel.created_at_unixutc, channel_id=channel.channel_id, client_id=client_id
         )
@@ -154,44 +393,280 @@ class ApplicationService:
 
         channels = self.pairing_register.channels_for(client_id)
 
+        return self._channel_responses(channels, client_id)
+
+    def channels_version_for_client(self, client_id: str, token: str) -> str:
+        """Get a tag that changes whenever the channels for a client change"""
+        self.verify_client_claim(client_id, token)
+
+        # Expired channels may not be pruned yet, they are told apart by the number of channels
+        version, channels = self.pairing_register.versioned_channels_for(client_id)
+        return f"{version}.{len(channels)}"
+
+    def wait_for_channels_for_client(
+        self,
+        client_id: str,
+        token: str,
+        version: int,
+        timeout: float,
+    ) -> ChannelsUpdateResponse:
+        """Wait until the channels for a client differ from the given version (long polling).
+
+        Returns the channels and their version after a change or the timeout. Passing the
+        returned version to the next call ensures that no change is missed.
+        """
+        self.verify_client_claim(client_id, token)
+
+        version, channels = self.pairing_register.wait_for_channels(
+            client_id, version, self._long_poll_timeout(timeout)
+        )
+
+        return ChannelsUpdateResponse(
+            version=version, channels=self._channel_responses(channels, client_id)
+        )
+
+    def _channel_responses(self, channels: List[Channel], client_id: str) -> List[ChannelResponse]:
+        """Build the responses for the channels of a client"""
         return [
-            ChannelResponse(
-                id=c.channel_id,
-                token=self.channel_auth.token(
-                    c.created_at_unixutc, channel_id=c.channel_id, client_id=client_id
-                ),
-            )
+            ChannelResponse(id=c.channel_id, token=self._channel_token(c, client_id))
             for c in channels
         ]
 
+    def _long_poll_timeout(self, timeout: float) -> float:
+        """Limit the time a request waits for changes"""
+        return max(0.0, min(timeout, self.config.max_long_poll_timeout))
+
+    def _channel_token(self, channel: Channel, client_id: str) -> str:
+        """Return the stored token of a client for a channel, mint and store it if missing"""
+        token = channel.tokens.get(client_id)
+        if token is None:
+            token = self.channel_auth.token(
+                channel.created_at_unixutc, channel_id=channel.channel_id, client_id=client_id
+            )
+            self.pairing_register.set_channel_token(client_id, channel.channel_id, token)
+        return token
+
     def store_file_for_channel(
         self,
         channel_id: str,
         client_id: str,
         token: str,
         filename: str,
-        file_content: Any,
+        file_content: bytes | io.BytesIO,
+        reserved_bytes: int = 0,
+        content_hash: str = "",
     ) -> FileID:
-        """Store a file for a channel"""
+        """Store a file for a channel.
+
+        Capacity reserved with `reserve_file_capacity` is consumed if the file is stored. The
+        content hash can be passed if it was computed while receiving the file. Metadata of
+        content seen before is taken from the cache. With metadata workers, the metadata of
+        new content is added to the stored file once it has been extracted.
+        """
         self.verify_channel_claim(channel_id, client_id, token)
 
-        file = InMemoryEbookFile.make(name=filename, data=file_content)
-        file_id = self.file_register.add_file(channel_id, file)
+        file = InMemoryEbookFile.make(
+            name=filename, data=file_content, extract_metadata=False, content_hash=content_hash
+        )
+        extract = MetaDataFactory.supports(filename)
+        if extract:
+            file.metadata = self.metadata_cache.get(file.content_hash)
+            extract = file.metadata is None
+        extractor = self.metadata_extractor if extract else None
+        if extract and extractor is None:
+            file.metadata = MetaDataFactory(filename, file.data).get_metadata()
+            self._cache_metadata(file.content_hash, file.metadata)
+
+        file_id = self.file_register.add_file(channel_id, file, reserved_bytes=reserved_bytes)
+        if extractor is not None:
+            extractor.extract(
+                filename,
+                file.data,
+                lambda metadata: self._set_file_metadata(file_id, file.content_hash, metadata),
+            )
         return file_id
 
+    def _cache_metadata(self, content_hash: str, metadata: Optional[BookMetadata]):
+        """Remember extracted metadata for files with the same content"""
+        if metadata is not None:
+            self.metadata_cache.put(content_hash, metadata)
+
+    def _set_file_metadata(
+        self, file_id: FileID, content_hash: str, metadata: Optional[BookMetadata]
+    ):
+        """Add extracted metadata to a stored file"""
+        if metadata is None:
+            return
+        self._cache_metadata(content_hash, metadata)
+        try:
+            self.file_register.update_file(file_id, metadata=metadata)
+        except FileRegisterError:
+            pass  # The file was removed or expired in the meantime
+
+    def metadata_stats(self) -> Optional[MetadataExtractionStats]:
+        """Return counters and timings of metadata extraction in workers, if enabled"""
+        extractor = self.metadata_extractor
+        if extractor is None:
+            return None
+        return extractor.stats()
+
+    def reserve_file_capacity(
+        self,
+        channel_id: str,
+        client_id: str,
+        token: str,
+        size_bytes: int,
+    ):
+        """Reserve capacity for a file before receiving it.
+
+        This rejects uploads that cannot be stored before their content is received.
+        """
+        self.verify_channel_claim(channel_id, client_id, token)
+
+        self.file_register.reserve_bytes(size_bytes)
+
+    def release_file_capacity(self, size_bytes: int):
+        """Release capacity that was reserved for a file that is not stored"""
+        self.file_register.release_bytes(size_bytes)
+
+    def remaining_file_capacity(self) -> int:
+        """Get the capacity in bytes available for new files"""
+        return self.file_register.remaining_capacity_bytes()
+
     def get_files_for_channel(
         self,
         channel_id: str,
         client_id: str,
         token: str,
     ) -> List[EbookFileResponse]:
-        """Get a list of files for a channel"""
+        """Get a list of files for a channel.
+
+        The token is verified once and all files are taken from one consistent snapshot of the
+        channel. The content of the files is not attached.
+        """
         self.verify_channel_claim(channel_id, client_id, token)
 
-        return [
-            self.get_file(channel_id, client_id, token, file_id)
-            for file_id in self.file_register.get_file_ids_for_channel(channel_id)
+        snapshot = self.file_register.listing_for_channel(channel_id)
+        return self._file_responses(snapshot)
+
+    def files_version_for_channel(self, channel_id: str, client_id: str, token: str) -> str:
+        """Get a tag that changes whenever the listing of the files of a channel changes"""
+        self.verify_channel_claim(channel_id, client_id, token)
+
+        return self._listing_version(*self.file_register.listing_version_for_channel(channel_id))
+
+    @staticmethod
+    def _listing_version(version: int, number_of_files: int) -> str:
+        """Return a tag that changes whenever the listing of a channel's valid files changes"""
+        # Expired files may not be pruned yet. Files of one version expire oldest first, so the
+        # number of valid files tells their listings apart.
+        return f"{version}.{number_of_files}"
+
+    def get_inbox(
+        self,
+        client_id: str,
+        credentials: List[ChannelCredentials],
+    ) -> InboxResponse:
+        """Get the files of several channels of a client in one pass.
+
+        All tokens are verified before the channels are snapshotted in one call. The files are
+        merged in order of expiry without content. The version changes whenever the listing of
+        one of the channels changes.
+        """
+        for channel in credentials:
+            self.verify_channel_claim(channel.channel_id, client_id, channel.token)
+
+        channel_ids = list(dict.fromkeys(channel.channel_id for channel in credentials))
+        snapshots = self.file_register.listings_for_channels(channel_ids)
+
+        files = [
+            InboxFileResponse(channel_id=channel_id, file=file)
+            for channel_id, snapshot in zip(channel_ids, snapshots)
+            for file in self._file_responses(snapshot)
         ]
+        files.sort(key=lambda inbox_file: inbox_file.file.expires_at_unixutc)
+
+        return InboxResponse(
+            version="-".join(
+                self._listing_version(snapshot.version, len(snapshot.files))
+                for snapshot in snapshots
+            ),
+            files=files,
+        )
+
+    def wait_for_files_for_channel(
+        self,
+        channel_id: str,
+        client_id: str,
+        token: str,
+        version: int,
+        timeout: float,
+    ) -> FilesUpdateResponse:
+        """Wait until the files of a channel differ from the given version (long polling).
+
+        Returns the files and their version after a change or the timeout. Passing the
+        returned version to the next call ensures that no change is missed.
+        """
+        self.verify_channel_claim(channel_id, client_id, token)
+
+        snapshot = self.file_register.wait_for_listing_change(
+            channel_id, version, self._long_poll_timeout(timeout)
+        )
+
+        return FilesUpdateResponse(version=snapshot.version, files=self._file_responses(snapshot))
+
+    def channel_events(
+        self,
+        channel_id: str,
+        client_id: str,
+        token: str,
+        heartbeat_seconds: float,
+    ) -> ChannelEventStream:
+        """Subscribe to the changes of the files of a channel.
+
+        The stream starts with a snapshot of all files, followed by an event for every added,
+        removed and expired file. It yields None whenever nothing changed for the heartbeat
+        interval. The number of subscribers per channel is limited, the stream must be closed
+        to free its slot.
+        """
+        self.verify_channel_claim(channel_id, client_id, token)
+
+        self.channel_subscribers.acquire(channel_id)
+        return ChannelEventStream(
+            events=self._channel_events(channel_id, heartbeat_seconds),
+            on_close=lambda: self.channel_subscribers.release(channel_id),
+        )
+
+    def _channel_events(
+        self, channel_id: str, heartbeat_seconds: float
+    ) -> Iterator[Optional[ChannelEventResponse]]:
+        """Generate the events of a channel, None for heartbeats"""
+        snapshot = self.file_register.listing_for_channel(channel_id)
+        yield ChannelEventResponse(
+            kind="snapshot", version=snapshot.version, files=self._file_responses(snapshot)
+        )
+
+        while True:
+            new_snapshot = self.file_register.wait_for_listing_change(
+                channel_id, snapshot.version, heartbeat_seconds
+            )
+            events = file_events(
+                snapshot, new_snapshot, expiry_threshold=now_unixutc() - self.config.file_expiration
+            )
+            if not events and new_snapshot.version == snapshot.version:
+                yield None  # Heartbeat
+
+            for event in events:
+                yield ChannelEventResponse(
+                    kind=event.kind,
+                    version=event.version,
+                    files=[self._file_response(event.file_id, event.file)],
+                )
+            snapshot = new_snapshot
+
+    def _file_responses(self, snapshot: ChannelSnapshot) -> List[EbookFileResponse]:
+        """Build the responses for the file listings of a snapshot"""
+        return [self._file_response(file_id, file) for file_id, file in snapshot.files]
 
     def get_file(
         self,
@@ -204,19 +679,43 @@ class ApplicationService:
         self.verify_channel_claim(channel_id, client_id, token)
 
         file = self.file_register.get_file_for_channel(channel_id, file_id)
+        return self._file_response(file_id, file.listing(), data=file.open())
+
+    def _file_response(
+        self, file_id: str, file: EbookFileListing, data: Optional[ContentReader] = None
+    ) -> EbookFileResponse:
+        """Build the response for the listing of a stored file, with content if given"""
         metadata = file.metadata or BookMetadata.empty()
 
         return EbookFileResponse(
             id=file_id,
             name=file.name,
-            data=file.data,
+            data=data,
             size=file.size_bytes(),
             expires_at_unixutc=file.created_at_unixutc + self.config.file_expiration,
             title=metadata.title,
             author=metadata.author,
             book_identifier=metadata.identifier,
+            content_hash=file.content_hash,
+            has_cover=file.has_cover,
         )
 
+    def get_cover(
+        self,
+        channel_id: str,
+        client_id: str,
+        token: str,
+        file_id: str,
+    ) -> CoverResponse:
+        """Get the cover image of a file, extracted once when its metadata was read.
+
+        Only the cover is taken from the register, not the content of the file.
+        """
+        self.verify_channel_claim(channel_id, client_id, token)
+
+        cover = self.file_register.get_attachment_for_channel(channel_id, file_id, "cover")
+        return CoverResponse(data=cover.data, media_type=cover.media_type, etag=cover.etag)
+
     def remove_file(
         self,
         channel_id: str,
@@ -228,3 +727,10 @@ class ApplicationService:
         self.verify_channel_claim(channel_id, client_id, token)
 
         self.file_register.remove_file(file_id)
+
+
+def state_server_authkey(config: ApplicationServiceConfig) -> bytes:
+    """Derive the key for connecting to the state server from the service secrets"""
+    return hashlib.sha256(
+        f"{config.client_jwt_secret}:{config.channel_jwt_secret}".encode()
+    ).digest()
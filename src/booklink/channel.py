@@ -13,6 +13,7 @@ class Channel:
     sender_name: str
     ereader_name: str
     created_at_unixutc: float
+    tokens: dict[str, str] = dataclasses.field(default_factory=dict)  # Access by client id
 
     @staticmethod
     def make(channel_id: str, establisher_name: str, accepter_name: str):
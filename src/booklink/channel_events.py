@@ -0,0 +1,86 @@
+"""Events about the files of a channel for subscribers of the channel"""
+
+import threading
+from dataclasses import dataclass
+from typing import Literal
+
+from booklink.storage import (
+    ChannelSnapshot,
+    RegisteredFile,
+)
+
+FileEventKind = Literal["add", "update", "remove", "expire"]
+
+
+class TooManySubscribersError(RuntimeError):
+    """Error for exceeding the maximum number of subscribers of a channel"""
+
+
+@dataclass(frozen=True)
+class FileEvent:
+    """Change of a file between two snapshots of a channel"""
+
+    kind: FileEventKind
+    version: int  # Version of the snapshot after the change
+    file_id: str
+    file: RegisteredFile
+
+
+def file_events(
+    old: ChannelSnapshot, new: ChannelSnapshot, expiry_threshold: float
+) -> list[FileEvent]:
+    """Return the events that turn the old snapshot into the new one.
+
+    Files that left the channel are reported as expired if they were created before the
+    expiry threshold and as removed otherwise. Files that stayed but differ are updated.
+    """
+    new_file_ids = {file_id for file_id, _ in new.files}
+    old_files = dict(old.files)
+
+    events = [
+        FileEvent(
+            kind="expire" if file.created_at_unixutc < expiry_threshold else "remove",
+            version=new.version,
+            file_id=file_id,
+            file=file,
+        )
+        for file_id, file in old.files
+        if file_id not in new_file_ids
+    ]
+    for file_id, file in new.files:
+        if file_id not in old_files:
+            events.append(FileEvent(kind="add", version=new.version, file_id=file_id, file=file))
+        elif old_files[file_id] != file:
+            events.append(FileEvent(kind="update", version=new.version, file_id=file_id, file=file))
+    return events
+
+
+class SubscriberLimit:
+    """Count subscribers per channel and reject subscribers beyond a maximum"""
+
+    def __init__(self, max_subscribers_per_channel: int):
+        self.max_subscribers_per_channel = max_subscribers_per_channel
+
+        self._subscribers: dict[str, int] = {}  # Access by channel id
+        self.__lock = threading.Lock()
+
+    def acquire(self, channel_id: str):
+        """Count a new subscriber of the channel. Raise if the channel has too many."""
+        with self.__lock:
+            subscribers = self._subscribers.get(channel_id, 0)
+            if subscribers >= self.max_subscribers_per_channel:
+                raise TooManySubscribersError(f"Too many subscribers of channel {channel_id}")
+            self._subscribers[channel_id] = subscribers + 1
+
+    def release(self, channel_id: str):
+        """Remove a subscriber of the channel"""
+        with self.__lock:
+            subscribers = self._subscribers.get(channel_id, 0) - 1
+            if subscribers > 0:
+                self._subscribers[channel_id] = subscribers
+            else:
+                self._subscribers.pop(channel_id, None)
+
+    def subscribers(self, channel_id: str) -> int:
+        """Get the number of subscribers of the channel"""
+        return self._subscribers.get(channel_id, 0)
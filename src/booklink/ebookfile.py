@@ -1,15 +1,23 @@
 """Module for ebook files"""
 
 import dataclasses
+import hashlib
 import io
-import zipfile
 from typing import Optional
 
-from lxml import etree
-
-from booklink.storage import RegisteredFile
+from booklink.metadata_formats import (
+    read_epub_metadata,
+    read_mobi_metadata,
+    read_pdf_metadata,
+)
+from booklink.storage import (
+    FileAttachment,
+    RegisteredFile,
+)
 from booklink.utils import now_unixutc
 
+METADATA_EXTENSIONS = (".epub", ".kepub", ".mobi", ".azw", ".pdf")
+
 
 @dataclasses.dataclass(frozen=True)
 class BookMetadata:
@@ -20,6 +28,8 @@ class BookMetadata:
     language: str
     date: str
     identifier: str
+    cover: bytes = dataclasses.field(default=b"", repr=False)  # Bounded slice of the image
+    cover_media_type: str = ""
 
     @classmethod
     def empty(cls):
@@ -33,17 +43,96 @@ class BookMetadata:
         )
 
 
+class ContentReader(io.RawIOBase):
+    """Seekable reader over stored content, reads copy only the bytes they return"""
+
+    def __init__(self, data: bytes | memoryview):
+        """Parameters:
+        data: content to read, it is referenced and never copied as a whole
+        """
+        super().__init__()
+        self._content = memoryview(data)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._content[self._position : self._position + len(buffer)]
+        buffer[: len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def readall(self) -> bytes:
+        chunk = bytes(self._content[self._position :])
+        self._position += len(chunk)
+        return chunk
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._content) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        return self._position
+
+
+@dataclasses.dataclass
+class EbookFileListing(RegisteredFile):
+    """Listing of an ebook file, without its content and cover image"""
+
+    name: str
+    size: int
+    metadata: Optional[BookMetadata]
+    content_hash: str
+    has_cover: bool
+
+    def size_bytes(self) -> int:
+        """Return the size of the listed file in bytes"""
+        return self.size
+
+
 @dataclasses.dataclass
 class InMemoryEbookFile(RegisteredFile):
-    """Class for ebook files"""
+    """Class for ebook files.
+
+    The content is kept as immutable bytes. Readers get their own cursor over the same memory,
+    so concurrent reads need neither copies nor shared seek state.
+    """
 
     name: str
-    data: io.BytesIO
+    data: bytes
     metadata: Optional[BookMetadata] = None
+    content_hash: str = ""  # SHA-256 hex digest of the data, computed if not given
+
+    def __post_init__(self):
+        if not self.content_hash:
+            self.content_hash = hashlib.sha256(self.data).hexdigest()
 
     @classmethod
-    def make(cls, name: str, data: io.BytesIO) -> "InMemoryEbookFile":
-        """Create an EbookFile instance from bytes"""
+    def make(
+        cls,
+        name: str,
+        data: bytes | io.BytesIO,
+        extract_metadata: bool = True,
+        content_hash: str = "",
+    ) -> "InMemoryEbookFile":
+        """Create an EbookFile instance from bytes, the metadata can be extracted later.
+
+        The content hash can be passed if it was computed while receiving the data.
+        """
 
         valid_extensions = (".epub", ".mobi", ".pdf", ".kepub", ".azw", ".txt")
         for extension in valid_extensions:
@@ -53,74 +142,100 @@ class InMemoryEbookFile(RegisteredFile):
         else:
             raise ValueError(f"File name must end with one of {valid_extensions}, got {name}")
 
-        metadata = MetaDataFactory(name, data).get_metadata()
+        if isinstance(data, io.BytesIO):
+            # Without exported views, the buffer is trimmed to its size in place and shared
+            data = data.getvalue()
+
+        metadata = MetaDataFactory(name, data).get_metadata() if extract_metadata else None
 
         return InMemoryEbookFile(
             name=name,
             data=data,
             metadata=metadata,
+            content_hash=content_hash,
             created_at_unixutc=now_unixutc(),
         )
 
     def size_bytes(self) -> int:
         """Return the size of the file in bytes"""
-        return self.data.getbuffer().nbytes
+        return len(self.data)
+
+    def content_key(self) -> Optional[str]:
+        """Return the content hash, files with equal hashes share their data"""
+        return self.content_hash
+
+    def with_content_of(self, other: RegisteredFile) -> "InMemoryEbookFile":
+        """Return this file using the data of another file with the same content hash"""
+        if not isinstance(other, InMemoryEbookFile) or other.content_hash != self.content_hash:
+            return self
+        return dataclasses.replace(self, data=other.data)
+
+    def listing(self) -> EbookFileListing:
+        """Return the file without its content and cover image, for listing it"""
+        metadata = self.metadata
+        if metadata is not None and metadata.cover:
+            metadata = dataclasses.replace(metadata, cover=b"")
+        return EbookFileListing(
+            created_at_unixutc=self.created_at_unixutc,
+            name=self.name,
+            size=len(self.data),
+            metadata=metadata,
+            content_hash=self.content_hash,
+            has_cover=bool(self.metadata and self.metadata.cover),
+        )
+
+    def attachment(self, name: str) -> Optional[FileAttachment]:
+        """Return the cover image as attachment "cover", it never changes for a content hash"""
+        if name != "cover" or self.metadata is None or not self.metadata.cover:
+            return None
+        return FileAttachment(
+            data=self.metadata.cover,
+            media_type=self.metadata.cover_media_type,
+            etag=f"{self.content_hash}-cover",
+        )
+
+    def open(self) -> ContentReader:
+        """Return a reader with its own cursor over the content (without copying it)"""
+        return ContentReader(self.data)
 
 
 class MetaDataFactory:
     """Factory for creating ebook files"""
 
-    def __init__(self, name: str, data: io.BytesIO):
+    def __init__(self, name: str, data: bytes):
         self.name = name
         self.data = data
 
+    @staticmethod
+    def supports(name: str) -> bool:
+        """Check if metadata can be extracted from files of this name"""
+        return name.lower().endswith(METADATA_EXTENSIONS)
+
     def get_metadata(self) -> Optional[BookMetadata]:
-        """Check if the file is an epub file"""
-        if self.name.lower().endswith(".epub"):
-            try:
-                return self.extract_epub_metadata()
-            except Exception:  # pylint: disable=broad-except
-                return None
+        """Return the metadata of the file, None for other formats or unreadable files"""
+        name = self.name.lower()
+        if name.endswith((".epub", ".kepub")):
+            extract = self.extract_epub_metadata
+        elif name.endswith((".mobi", ".azw")):
+            extract = self.extract_mobi_metadata
+        elif name.endswith(".pdf"):
+            extract = self.extract_pdf_metadata
         else:
             return None
 
-    def extract_epub_metadata(self) -> BookMetadata:
-        """Return the metadata from the file"""
-
-        def first_path_match(element, path):
-            """Return the first element matching the path"""
-            return element.xpath(
-                path,
-                namespaces={
-                    "n": "urn:oasis:names:tc:opendocument:xmlns:container",
-                    "pkg": "http://www.idpf.org/2007/opf",
-                    "dc": "http://purl.org/dc/elements/1.1/",
-                },
-            )[0]
-
         try:
-            zip_content = zipfile.ZipFile(self.data, mode="r")
-            contents_path = first_path_match(
-                etree.fromstring(zip_content.read("META-INF/container.xml")),
-                "n:rootfiles/n:rootfile/@full-path",
-            )
-            metadata = first_path_match(
-                etree.fromstring(zip_content.read(contents_path)), "/pkg:package/pkg:metadata"
-            )
-            scraped = {
-                s: first_path_match(metadata, f"dc:{s}/text()")
-                for s in ("title", "language", "creator", "date", "identifier")
-            }
-            self.data.seek(0)  # Reset file buffer after read
-            return BookMetadata(
-                title=scraped["title"],
-                author=scraped["creator"],
-                language=scraped["language"],
-                date=scraped["date"],
-                identifier=scraped["identifier"],
-            )
-
-        except Exception:
-            # Need to reset the data stream for the next read
-            self.data.seek(0)
-            raise
+            return extract()
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+    def extract_mobi_metadata(self) -> BookMetadata:
+        """Return the metadata from the MOBI and EXTH headers"""
+        return dataclasses.replace(BookMetadata.empty(), **read_mobi_metadata(self.data))
+
+    def extract_pdf_metadata(self) -> BookMetadata:
+        """Return the metadata from the Info dictionary"""
+        return dataclasses.replace(BookMetadata.empty(), **read_pdf_metadata(self.data))
+
+    def extract_epub_metadata(self) -> BookMetadata:
+        """Return the metadata from the package document"""
+        return dataclasses.replace(BookMetadata.empty(), **read_epub_metadata(self.data))
@@ -0,0 +1,41 @@
+"""Deadline-ordered expiry of register entries"""
+
+import heapq
+import itertools
+from typing import (
+    Callable,
+    Generic,
+    Iterator,
+    TypeAlias,
+    TypeVar,
+)
+
+Clock: TypeAlias = Callable[[], float]
+
+K = TypeVar("K")
+
+
+class ExpiryQueue(Generic[K]):
+    """Min-heap of keys ordered by their timestamp.
+
+    Pruning pops only the entries that are actually due instead of scanning all entries.
+    Entries removed early by their owner stay in the queue until they are due, so the owner
+    has to verify popped keys against its own state (lazy deletion).
+    The queue is not thread-safe and must be guarded by the owner's lock.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, K]] = []
+        self._counter = itertools.count()  # Tie breaker, keys need not be comparable
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, timestamp: float, key: K) -> None:
+        """Add a key with the timestamp it is ordered by"""
+        heapq.heappush(self._heap, (timestamp, next(self._counter), key))
+
+    def pop_older_than(self, threshold: float) -> Iterator[K]:
+        """Pop all keys with a timestamp strictly before the threshold"""
+        while self._heap and self._heap[0][0] < threshold:
+            yield heapq.heappop(self._heap)[2]
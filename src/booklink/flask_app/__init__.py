@@ -2,7 +2,10 @@
 Entry point of flask application
 """
 
+import atexit
+import dataclasses
 import os
+import weakref
 
 from flask import Flask
 
@@ -10,21 +13,33 @@ from booklink.application_service import (
     ApplicationService,
     ApplicationServiceConfig,
 )
+from booklink.flask_app.uploads import UploadRequest
 from booklink.flask_app.utils import (
     get_git_revision_short_hash,
     get_git_revisition_branch,
 )
 
+# Services of the apps created in this process, closed once when the interpreter exits
+_services: "weakref.WeakSet[ApplicationService]" = weakref.WeakSet()
+
+
+@atexit.register
+def _close_services():
+    for service in list(_services):
+        service.close()
+
 
 def create_app(TestConfig=None) -> Flask:  # pylint: disable=C0103
     """Create and configure the app"""
     app = Flask(__name__, instance_relative_config=True)
+    app.request_class = UploadRequest
 
     Config = TestConfig or get_config_from_env()  # pylint: disable=C0103
     app.config.from_object(Config)
     Config.init_app(app)
 
     attach_service(app)
+    register_commands(app)
 
     from . import api
 
@@ -46,10 +61,38 @@ def attach_service(app: Flask):
         max_clients_in_pairing=app.config["MAX_CLIENTS_IN_PAIRING"],
         max_files_in_channel=app.config["MAX_FILES_IN_CHANNEL"],
         client_expiration=app.config["CLIENT_EXPIRATION"],
+        channel_expiration=app.config["CHANNEL_EXPIRATION"],
+        max_channels_per_client=app.config["MAX_CHANNELS_PER_CLIENT"],
         file_expiration=app.config["FILE_EXPIRATION"],
+        max_file_size_bytes=app.config["MAX_FILE_SIZE"],
+        max_subscribers_per_channel=app.config["MAX_SUBSCRIBERS_PER_CHANNEL"],
+        metadata_workers=app.config["METADATA_WORKERS"],
+        metadata_executor=app.config["METADATA_EXECUTOR"],
+        metadata_cache_size=app.config["METADATA_CACHE_SIZE"],
+        metadata_cache_cover_bytes=app.config["METADATA_CACHE_COVER_BYTES"],
+        reaper_interval=app.config["REAPER_INTERVAL"],
+        state_server_address=app.config["STATE_SERVER_ADDRESS"],
     )
 
-    setattr(app, "service", ApplicationService(service_config))
+    service = ApplicationService(service_config)
+    _services.add(service)
+    setattr(app, "service", service)
+
+
+def register_commands(app: Flask):
+    """Register command line commands of the app"""
+
+    @app.cli.command("serve-state")
+    def serve_state():
+        """Serve the state shared by all worker processes (blocking)"""
+        address = app.config["STATE_SERVER_ADDRESS"]
+        if address is None:
+            raise ValueError("STATE_SERVER_ADDRESS must be set to serve shared state")
+        # The state server only holds registers, metadata is extracted by the web workers
+        local_config = dataclasses.replace(
+            app.service.config, state_server_address=None, metadata_workers=0
+        )
+        ApplicationService(local_config).state_server(address).serve_forever()
 
 
 class BaseConfig:
@@ -59,9 +102,22 @@ class BaseConfig:
     MAX_CLIENTS_IN_PAIRING: int = 100
     MAX_FILES_IN_CHANNEL: int = 20
     CLIENT_EXPIRATION: float = 60 * 60
+    CHANNEL_EXPIRATION: float = 60 * 60
+    MAX_CHANNELS_PER_CLIENT: int = 10
     FILE_EXPIRATION: float = 60 * 60
+    MAX_FILE_SIZE: int = 20 * 1024 * 1024
+    MAX_CONTENT_LENGTH: int | None = MAX_FILE_SIZE + 64 * 1024  # Room for multipart overhead
     POLL_PAIRING_STATUS_EVERY: float = 3
     POLL_FILE_STATUS_EVERY: float = 3
+    LONG_POLL_TIMEOUT: float = 25  # Time a long-poll request waits for changes
+    SSE_HEARTBEAT_INTERVAL: float = 15  # Time between heartbeats of idle event streams
+    MAX_SUBSCRIBERS_PER_CHANNEL: int = 8
+    METADATA_WORKERS: int = 2  # Extract metadata after upload, 0 extracts it during the upload
+    METADATA_EXECUTOR: str = "thread"  # Or "process" to extract outside the GIL
+    METADATA_CACHE_SIZE: int = 1024  # Metadata remembered by content hash
+    METADATA_CACHE_COVER_BYTES: int = 64 * 1024 * 1024
+    REAPER_INTERVAL: float | None = None  # Prune expired data on request threads if None
+    STATE_SERVER_ADDRESS: str | None = None  # Unix socket of `flask serve-state` for many workers
     GIT_REVISION_HASH: str = get_git_revision_short_hash()
     GIT_REVISION_BRANCH: str = get_git_revisition_branch()
 
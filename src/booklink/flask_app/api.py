@@ -4,17 +4,40 @@ Provides the API backend.
 This module translates the service layer to the flask routes.
 """
 
+import json
+import math
+from functools import wraps
 from io import BytesIO
+from typing import (
+    Any,
+    Callable,
+)
 
 from flask import (
     Blueprint,
+    Response,
+    abort,
     current_app,
+    jsonify,
     request,
     send_file,
 )
+from werkzeug.exceptions import (
+    RequestedRangeNotSatisfiable,
+    RequestEntityTooLarge,
+)
 from werkzeug.utils import secure_filename
 
-from booklink.application_service import ApplicationService
+from booklink.application_service import (
+    ApplicationService,
+    ChannelCredentials,
+    ChannelResponse,
+    EbookFileResponse,
+)
+from booklink.channel_events import TooManySubscribersError
+from booklink.flask_app.uploads import BoundedUploadBuffer
+from booklink.security import AuthenticationError
+from booklink.storage import FileRegisterError
 
 bp = Blueprint("api", __name__, url_prefix="")
 
@@ -27,14 +50,41 @@ def app_service() -> ApplicationService:
     return current_app.service  # type: ignore[attr-defined]
 
 
-def token_arg():
-    """Get token from request argument"""
+def conditional_json(etag: str, build_json: Callable[[], Any]) -> Response:
+    """Answer with 304 Not Modified if the client has the current version, JSON otherwise.
+
+    The JSON is only built if the client's `If-None-Match` header does not match the ETag.
+    """
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build_json())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # Revalidate on every poll
+    return response
+
+
+def token_arg() -> str:
+    """Get token from request argument, answer with 400 Bad Request if it is missing"""
     token = request.args.get("token")
     if not token:
-        return "No token provided", 400
+        abort(400, "No token provided")
     return token
 
 
+def unauthorized_on_invalid_token(f):
+    """Decorator to answer with 401 Unauthorized if a token of the request is not valid"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except AuthenticationError:
+            return {"error": "Invalid token"}, 401
+
+    return decorated_function
+
+
 @bp.route("/api/new_client")
 def new_client():
     """Generate a new client for pairing"""
@@ -54,6 +104,7 @@ def new_client():
 
 
 @bp.route("/api/pair/<client_id>/<pairing_code_ereader>")
+@unauthorized_on_invalid_token
 def pair_with_ereader(client_id, pairing_code_ereader):
     """Pair two clients"""
 
@@ -66,45 +117,123 @@ def pair_with_ereader(client_id, pairing_code_ereader):
 
 
 @bp.route("/api/channels_for/<client_id>")
+@unauthorized_on_invalid_token
 def channels_for_ereader(client_id):
     """Return the results of pairings for a client"""
 
-    channels = app_service().channels_for_client(client_id, token_arg())
+    service = app_service()
+    token = token_arg()
+
+    return conditional_json(
+        service.channels_version_for_client(client_id, token),
+        lambda: [channel_json(c) for c in service.channels_for_client(client_id, token)],
+    )
+
+
+@bp.route("/api/wait/channels_for/<client_id>")
+@unauthorized_on_invalid_token
+def wait_for_channels_for_ereader(client_id):
+    """Return the results of pairings for a client once they differ from the given version.
+
+    The request is held open until a channel is registered or the timeout passes (long polling).
+    """
+
+    update = app_service().wait_for_channels_for_client(
+        client_id, token_arg(), version_arg(), long_poll_timeout_arg()
+    )
+
+    return {
+        "version": update.version,
+        "channels": [channel_json(c) for c in update.channels],
+    }
+
+
+def channel_json(channel: ChannelResponse) -> dict:
+    """Serialize a channel for the API"""
+    return {
+        "channel_id": channel.id,
+        "token": channel.token,
+    }
+
+
+def version_arg() -> int:
+    """Get the version of the last seen state from request argument"""
+    try:
+        return int(request.args.get("version", 0))
+    except ValueError:
+        abort(400, "Version must be an integer")
 
-    return [
-        {
-            "channel_id": c.id,
-            "token": c.token,
-        }
-        for c in channels
-    ]
+
+def long_poll_timeout_arg() -> float:
+    """Get the time to wait for changes from request argument"""
+    try:
+        timeout = float(request.args.get("timeout", current_app.config["LONG_POLL_TIMEOUT"]))
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout):
+        abort(400, "Timeout must be a number")
+    return timeout
 
 
 @bp.route("/api/upload/<channel_id>/<client_id>", methods=["POST"])
 def upload_file(channel_id, client_id):
-    """Upload a file to the channel"""
+    """Upload a file to the channel.
 
-    if "file" not in request.files:
-        return {"error": "No file part"}, 400
+    Capacity for the request body is reserved before the body is received. The file is streamed
+    into its final buffer and the upload is aborted as soon as it exceeds the limits.
+    """
 
-    raw_file = request.files["file"]
-    if raw_file.filename == "":
-        return {"error": "No selected file"}, 400
+    service = app_service()
+    token = token_arg()
+    reserved_bytes = request.content_length or 0
+    try:
+        service.reserve_file_capacity(channel_id, client_id, token, reserved_bytes)
+    except FileRegisterError:
+        return {"error": "Not enough capacity for file"}, 413
+    except Exception:  # pylint: disable=broad-except
+        return {"error": "Cannot store file"}, 400
 
-    if raw_file:
-        filename = secure_filename(raw_file.filename)
-        data_buffer = BytesIO(raw_file.read())
+    stored = False
+    try:
+        # Without a reservation the file may use what is left of the total capacity
+        request.upload_size_limit = min(  # type: ignore[attr-defined]
+            service.config.max_file_size_bytes,
+            reserved_bytes or service.remaining_file_capacity(),
+        )
+        try:
+            files = request.files
+        except RequestEntityTooLarge:
+            return {"error": "File size exceeds limit"}, 413
+
+        if "file" not in files:
+            return {"error": "No file part"}, 400
+
+        raw_file = files["file"]
+        if not raw_file.filename:
+            return {"error": "No selected file"}, 400
 
+        filename = secure_filename(raw_file.filename)
+        content = raw_file.stream
         try:
-            file_id = app_service().store_file_for_channel(
-                channel_id, client_id, token_arg(), filename, data_buffer
+            file_id = service.store_file_for_channel(
+                channel_id,
+                client_id,
+                token,
+                filename,
+                content if isinstance(content, BytesIO) else content.read(),
+                reserved_bytes=reserved_bytes,
+                content_hash=(
+                    content.content_hash() if isinstance(content, BoundedUploadBuffer) else ""
+                ),
             )
         except Exception:  # pylint: disable=broad-except
             return {"error": "Cannot store file"}, 400
+        stored = True
+    finally:
+        if not stored:
+            service.release_file_capacity(reserved_bytes)
 
-        return {"message": "File uploaded successfully", "id": file_id}, 200
-
-    return {"error": "File type not allowed"}, 400
+    return {"message": "File uploaded successfully", "id": file_id}, 200
 
 
 @bp.route("/api/delete/<channel_id>/<client_id>/<file_id>", methods=["DELETE"])
@@ -120,22 +249,134 @@ def delete_file(channel_id, client_id, file_id):
 
 
 @bp.route("/api/files/<channel_id>/<client_id>")
+@unauthorized_on_invalid_token
 def get_files(channel_id, client_id):
     """Get all files for a channel"""
 
-    files = app_service().get_files_for_channel(channel_id, client_id, token_arg())
+    service = app_service()
+    token = token_arg()
+
+    return conditional_json(
+        service.files_version_for_channel(channel_id, client_id, token),
+        lambda: [file_json(f) for f in service.get_files_for_channel(channel_id, client_id, token)],
+    )
+
+
+@bp.route("/api/inbox/<client_id>")
+@unauthorized_on_invalid_token
+def get_inbox(client_id):
+    """Get the files of several channels of a client in one response.
+
+    Each channel is passed as `channel=<channel_id>:<token>`, repeated for every channel.
+    """
+
+    try:
+        credentials = [
+            ChannelCredentials(*channel.split(":", 1))
+            for channel in request.args.getlist("channel")
+        ]
+    except TypeError:
+        return {"error": "Channels must be given as <channel_id>:<token>"}, 400
+    if not credentials:
+        return {"error": "No channel provided"}, 400
+
+    inbox = app_service().get_inbox(client_id, credentials)
+
+    return conditional_json(
+        inbox.version,
+        lambda: [
+            {"channel_id": inbox_file.channel_id, **file_json(inbox_file.file)}
+            for inbox_file in inbox.files
+        ],
+    )
+
+
+@bp.route("/api/wait/files/<channel_id>/<client_id>")
+@unauthorized_on_invalid_token
+def wait_for_files(channel_id, client_id):
+    """Get all files for a channel once they differ from the given version.
+
+    The request is held open until a file is added or removed, or the timeout passes
+    (long polling).
+    """
+
+    update = app_service().wait_for_files_for_channel(
+        channel_id, client_id, token_arg(), version_arg(), long_poll_timeout_arg()
+    )
+
+    return {
+        "version": update.version,
+        "files": [file_json(f) for f in update.files],
+    }
+
+
+@bp.route("/api/events/<channel_id>/<client_id>")
+@unauthorized_on_invalid_token
+def channel_events(channel_id, client_id):
+    """Stream the changes of the files of a channel as Server-Sent Events.
+
+    The first event ("snapshot") lists all files. Then an event ("add", "remove", "expire")
+    follows for every changed file. Comment frames are sent as heartbeats while nothing changes.
+    """
+
+    try:
+        stream = app_service().channel_events(
+            channel_id, client_id, token_arg(), current_app.config["SSE_HEARTBEAT_INTERVAL"]
+        )
+    except TooManySubscribersError:
+        return {"error": "Too many subscribers of channel"}, 429
+
+    def generate():
+        for event in stream:
+            if event is None:
+                yield ": heartbeat\n\n"
+                continue
+            data = {"version": event.version, "files": [file_json(f) for f in event.files]}
+            yield f"id: {event.version}\nevent: {event.kind}\ndata: {json.dumps(data)}\n\n"
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Do not buffer events in reverse proxies
+    response.call_on_close(stream.close)
+    return response
+
+
+def file_json(file: EbookFileResponse) -> dict:
+    """Serialize the listing of a file for the API"""
+    return {
+        "name": file.name,
+        "size": file.size,
+        "title": file.title,
+        "author": file.author,
+        "id": file.id,
+        "expires_at_unixutc": file.expires_at_unixutc,
+        "has_cover": file.has_cover,
+    }
+
+
+@bp.route("/api/cover/<channel_id>/<client_id>/<file_id>")
+def get_cover(channel_id, client_id, file_id):
+    """Get the cover image of a file.
+
+    The cover was extracted when the file was uploaded, the book is not opened again. Covers
+    never change for their ETag, browsers may cache them for as long as the file lives.
+    """
 
-    return [
-        {
-            "name": f.name,
-            "size": f.size,
-            "title": f.title,
-            "author": f.author,
-            "id": f.id,
-            "expires_at_unixutc": f.expires_at_unixutc,
-        }
-        for f in files
-    ]
+    try:
+        cover = app_service().get_cover(channel_id, client_id, token_arg(), file_id)
+    except AuthenticationError:
+        return {"error": "Invalid token"}, 401
+    except FileRegisterError:
+        return "Cover not found", 404
+
+    if request.if_none_match.contains(cover.etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(cover.data, mimetype=cover.media_type)
+    response.set_etag(cover.etag)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
 
 
 @bp.route("/<file_name>")
@@ -144,6 +385,10 @@ def download_file(file_name):
 
     The kobo ereader needs the url to be at the root.
     Internally, the file is fetched with a unique ID passed as a query parameter.
+
+    Responses carry the content length and a strong ETag derived from the content. Range and
+    conditional requests (If-None-Match, If-Range) let e-readers resume interrupted downloads
+    and skip repeated ones.
     """
 
     try:
@@ -156,14 +401,18 @@ def download_file(file_name):
     except Exception:  # pylint: disable=broad-except
         return "File not found", 404
 
-    # Copy file since flask will close the file after sending
-    sending_buffer = BytesIO()
-    sending_buffer.write(file.data.read())
-    file.data.seek(0)  # Reset file buffer after read
-    sending_buffer.seek(0)  # Reset sending buffer after write
-
-    return send_file(
-        sending_buffer,
+    # The response data is a reader of its own over the stored content, flask may close it. The
+    # size is given explicitly, send_file would otherwise only know it for a copied buffer.
+    response = send_file(
+        file.data,
         as_attachment=True,
         download_name=file_name,
+        etag=file.content_hash,
+        conditional=False,
     )
+    response.content_length = file.size
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=file.size)
+    except RequestedRangeNotSatisfiable:
+        response.close()
+        raise
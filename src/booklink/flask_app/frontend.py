@@ -45,6 +45,7 @@ def pair_ereader():
         "simple_pair.html",
         client_expiration_seconds=current_app.config["CLIENT_EXPIRATION"],
         poll_pairing_status_every=current_app.config["POLL_PAIRING_STATUS_EVERY"],
+        long_poll_timeout=current_app.config["LONG_POLL_TIMEOUT"],
     )
 
 
@@ -73,6 +74,7 @@ def receive(channel_id, client_id):
         channel_id=channel_id,
         client_id=client_id,
         token=request.args.get("token"),
+        long_poll_timeout=current_app.config["LONG_POLL_TIMEOUT"],
     )
 
 
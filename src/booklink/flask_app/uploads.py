@@ -0,0 +1,64 @@
+"""Receive uploaded files in bounded in-memory buffers"""
+
+import hashlib
+import io
+from typing import (
+    IO,
+    Optional,
+)
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class BoundedUploadBuffer(io.BytesIO):
+    """Buffer for an uploaded file that rejects data beyond a size limit.
+
+    The multipart parser writes the upload chunk by chunk, so an upload is aborted as soon as it
+    exceeds the limit instead of after it has been received completely. The content is hashed
+    while it is written, so it does not have to be read again for hashing.
+    """
+
+    def __init__(self, max_size_bytes: Optional[int] = None):
+        super().__init__()
+        self.max_size_bytes = max_size_bytes
+        self._sha256: Optional["hashlib._Hash"] = hashlib.sha256()
+        self._hashed_bytes = 0
+
+    def write(self, data, /) -> int:  # type: ignore[override]
+        if self.max_size_bytes is not None and self.tell() + len(data) > self.max_size_bytes:
+            raise RequestEntityTooLarge("File size exceeds limit")
+        if self._sha256 is not None:
+            if self.tell() == self._hashed_bytes:
+                self._sha256.update(data)
+                self._hashed_bytes += len(data)
+            else:
+                self._sha256 = None  # Not written sequentially, the hash must be computed later
+        return super().write(data)
+
+    def content_hash(self) -> str:
+        """Return the SHA-256 hex digest of the content, or "" if it was not written in order"""
+        with self.getbuffer() as content:
+            if self._sha256 is None or self._hashed_bytes != content.nbytes:
+                return ""
+        return self._sha256.hexdigest()
+
+
+class UploadRequest(Request):
+    """Request that stores uploaded files in bounded in-memory buffers.
+
+    The buffer is the final storage of the file: no view of it outlives a call, so `getvalue()`
+    trims its spare capacity in place and returns it without a copy. Views set
+    `upload_size_limit` before accessing `files` to limit the size of each uploaded file.
+    """
+
+    upload_size_limit: Optional[int] = None
+
+    def _get_file_stream(
+        self,
+        total_content_length: Optional[int],
+        content_type: Optional[str],
+        filename: Optional[str] = None,
+        content_length: Optional[int] = None,
+    ) -> IO[bytes]:
+        return BoundedUploadBuffer(self.upload_size_limit)
@@ -0,0 +1,258 @@
+"""Extraction of ebook metadata in a pool of workers after upload"""
+
+import dataclasses
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import (
+    Callable,
+    Literal,
+    Optional,
+)
+
+from booklink.ebookfile import (
+    BookMetadata,
+    MetaDataFactory,
+)
+
+logger = logging.getLogger(__name__)
+
+ExecutorKind = Literal["thread", "process"]
+
+
+@dataclasses.dataclass(frozen=True)
+class MetadataExtractionStats:
+    """Counters and timings of the metadata extractor"""
+
+    submitted: int
+    completed: int
+    failed: int
+    inline: int  # Extracted on the calling thread because too many were pending
+    pending: int
+    total_queue_seconds: float  # Time between submission and start of the extraction
+    total_extraction_seconds: float
+    max_extraction_seconds: float
+
+
+def _timed_extraction(name: str, data: bytes) -> tuple[Optional[BookMetadata], float, float]:
+    """Extract metadata, return it with the start time and the duration of the extraction"""
+    started_at = time.time()
+    start = time.perf_counter()
+    metadata = MetaDataFactory(name, data).get_metadata()
+    return metadata, started_at, time.perf_counter() - start
+
+
+class MetadataCache:
+    """Remember extracted metadata by content hash, so identical uploads are parsed once.
+
+    The cache is bounded in entries and in the size of their cover images, the least recently
+    used metadata is evicted first.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_cover_bytes: int = 64 * 1024 * 1024):
+        """Inits the cache
+
+        Parameters:
+            max_entries: Maximum number of cached metadata, 0 disables the cache
+            max_cover_bytes: Maximum total size of the cached cover images
+        """
+        self.max_entries = max_entries
+        self.max_cover_bytes = max_cover_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._metadata: OrderedDict[str, BookMetadata] = OrderedDict()  # content hash key
+        self._cover_bytes = 0
+        self.__lock = threading.Lock()
+
+    def get(self, content_hash: str) -> Optional[BookMetadata]:
+        """Return the cached metadata of the content and count hits and misses"""
+        with self.__lock:
+            metadata = self._metadata.get(content_hash)
+            if metadata is None:
+                self.misses += 1
+                return None
+            self._metadata.move_to_end(content_hash)
+            self.hits += 1
+            return metadata
+
+    def put(self, content_hash: str, metadata: BookMetadata):
+        """Cache the metadata of the content, evict the least recently used if full"""
+        if self.max_entries <= 0:
+            return
+        with self.__lock:
+            replaced = self._metadata.pop(content_hash, None)
+            if replaced is not None:
+                self._cover_bytes -= len(replaced.cover)
+            self._metadata[content_hash] = metadata
+            self._cover_bytes += len(metadata.cover)
+            while len(self._metadata) > self.max_entries or (
+                self._cover_bytes > self.max_cover_bytes and len(self._metadata) > 1
+            ):
+                _, evicted = self._metadata.popitem(last=False)
+                self._cover_bytes -= len(evicted.cover)
+
+    @property
+    def cover_bytes(self) -> int:
+        """Return the total size of the cached cover images"""
+        return self._cover_bytes
+
+    def __len__(self) -> int:
+        """Return the number of cached metadata"""
+        return len(self._metadata)
+
+
+class MetadataExtractor:
+    """Extract metadata of ebook files in a pool of threads or processes.
+
+    The number of pending extractions is bounded. If the pool is saturated, the extraction runs
+    on the calling thread, which slows down uploads instead of queueing work without limit.
+    """
+
+    def __init__(self, workers: int, executor: ExecutorKind = "thread", max_pending: int = 64):
+        """Inits the extractor
+
+        Parameters:
+            workers: Number of threads or processes extracting metadata
+            executor: Extract in threads or in processes, which avoids contention on the GIL
+            max_pending: Extractions queued or running before extracting on the calling thread
+        """
+        if workers < 1:
+            raise ValueError("Metadata extraction needs at least one worker")
+        if max_pending < 1:
+            raise ValueError("Maximum of pending extractions must be positive")
+
+        self._executor: Executor
+        if executor == "thread":
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix="booklink-metadata")
+        elif executor == "process":
+            self._executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            raise ValueError(f"Unknown executor {executor}")
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.__lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._inline = 0
+        self._pending = 0
+        self._total_queue_seconds = 0.0
+        self._total_extraction_seconds = 0.0
+        self._max_extraction_seconds = 0.0
+
+    def extract(self, name: str, data: bytes, on_done: Callable[[Optional[BookMetadata]], None]):
+        """Extract the metadata and pass it to the callback.
+
+        The callback runs on a background thread of the extractor, or on the calling thread if
+        the pool is saturated, shut down or broken, or the extraction finished before. It is not
+        called if the extraction fails. Submitting never raises, the file is already stored.
+        """
+        submitted_at = time.time()
+        if not self._slots.acquire(blocking=False):
+            self._extract_inline(name, data, submitted_at, on_done)
+            return
+
+        with self.__lock:
+            self._submitted += 1
+            self._pending += 1
+        try:
+            future = self._executor.submit(_timed_extraction, name, data)
+        except Exception:  # pylint: disable=broad-except
+            # Shut down pools and process pools broken by a crashed worker reject all work
+            logger.exception("Submitting metadata extraction failed")
+            self._release_slot(failed=True)
+            self._extract_inline(name, data, submitted_at, on_done)
+            return
+        future.add_done_callback(lambda f: self._finish(f, submitted_at, on_done))
+
+    def _extract_inline(
+        self,
+        name: str,
+        data: bytes,
+        submitted_at: float,
+        on_done: Callable[[Optional[BookMetadata]], None],
+    ):
+        """Extract on the calling thread, failures are logged instead of raised"""
+        with self.__lock:
+            self._inline += 1
+        try:
+            result = _timed_extraction(name, data)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Metadata extraction failed")
+            with self.__lock:
+                self._failed += 1
+            return
+        self._done(result, submitted_at, on_done)
+
+    def _finish(
+        self,
+        future: Future,
+        submitted_at: float,
+        on_done: Callable[[Optional[BookMetadata]], None],
+    ):
+        """Hand the result of a pooled extraction to the callback"""
+        try:
+            result = future.result()
+        except BaseException:  # pylint: disable=broad-except
+            logger.exception("Metadata extraction failed")
+            self._release_slot(failed=True)
+            return
+        try:
+            self._done(result, submitted_at, on_done)
+        finally:
+            self._release_slot(failed=False)
+
+    def _release_slot(self, failed: bool):
+        """Count a finished pooled extraction and free its slot"""
+        with self.__lock:
+            self._pending -= 1
+            if failed:
+                self._failed += 1
+        self._slots.release()
+
+    def _done(
+        self,
+        result: tuple[Optional[BookMetadata], float, float],
+        submitted_at: float,
+        on_done: Callable[[Optional[BookMetadata]], None],
+    ):
+        """Record the timings of an extraction and call the callback"""
+        metadata, started_at, seconds = result
+        with self.__lock:
+            self._completed += 1
+            self._total_queue_seconds += max(0.0, started_at - submitted_at)
+            self._total_extraction_seconds += seconds
+            self._max_extraction_seconds = max(self._max_extraction_seconds, seconds)
+        try:
+            on_done(metadata)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Handling extracted metadata failed")
+
+    def stats(self) -> MetadataExtractionStats:
+        """Return the counters and timings of the extractor"""
+        with self.__lock:
+            return MetadataExtractionStats(
+                submitted=self._submitted,
+                completed=self._completed,
+                failed=self._failed,
+                inline=self._inline,
+                pending=self._pending,
+                total_queue_seconds=self._total_queue_seconds,
+                total_extraction_seconds=self._total_extraction_seconds,
+                max_extraction_seconds=self._max_extraction_seconds,
+            )
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers, wait for pending extractions if requested"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,703 @@
+"""Bounded readers for metadata in the headers of ebook formats.
+
+The readers only look at fixed-size regions of the file, never scan or decompress all of it, so
+the time to read the metadata does not grow with the size of the file. They return the fields
+of `BookMetadata` that were found and raise `MetadataFormatError` for malformed headers.
+"""
+
+import io
+import posixpath
+import re
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass
+from typing import (
+    Callable,
+    Iterator,
+    Optional,
+)
+from urllib.parse import unquote
+
+from lxml import etree
+
+
+class MetadataFormatError(ValueError):
+    """Error for headers that cannot be read"""
+
+
+# MOBI/AZW: Palm database header, record 0 with the MOBI header and the EXTH header
+
+MOBI_MAX_RECORD0_BYTES = 64 * 1024
+
+_PDB_HEADER_BYTES = 78
+_MOBI_TEXT_ENCODINGS = {1252: "cp1252", 65001: "utf-8"}
+_EXTH_FLAG = 0x40
+_EXTH_FIELDS = {100: "author", 104: "identifier", 106: "date", 503: "title", 524: "language"}
+
+
+def read_mobi_metadata(data: bytes) -> dict[str, str]:
+    """Read the metadata of a MOBI or AZW file from its MOBI and EXTH headers"""
+    if len(data) < _PDB_HEADER_BYTES + 8 or data[60:68] != b"BOOKMOBI":
+        raise MetadataFormatError("Not a MOBI file")
+    number_of_records = struct.unpack_from(">H", data, 76)[0]
+    if not number_of_records:
+        raise MetadataFormatError("MOBI file without records")
+    record0_start = struct.unpack_from(">I", data, _PDB_HEADER_BYTES)[0]
+    record0_end = len(data)
+    if number_of_records > 1:
+        record0_end = struct.unpack_from(">I", data, _PDB_HEADER_BYTES + 8)[0]
+    record0 = data[record0_start : min(record0_end, record0_start + MOBI_MAX_RECORD0_BYTES)]
+
+    # The MOBI header follows the 16 bytes of the PalmDOC header
+    if len(record0) < 132 or record0[16:20] != b"MOBI":
+        raise MetadataFormatError("MOBI header missing")
+    header_length, _, text_encoding = struct.unpack_from(">III", record0, 20)
+    encoding = _MOBI_TEXT_ENCODINGS.get(text_encoding, "cp1252")
+
+    fields = {}
+    name_offset, name_length = struct.unpack_from(">II", record0, 84)
+    if name_length:
+        fields["title"] = record0[name_offset : name_offset + name_length].decode(
+            encoding, errors="replace"
+        )
+    else:
+        fields["title"] = data[:32].split(b"\0", 1)[0].decode("latin-1")
+
+    exth_flags = struct.unpack_from(">I", record0, 128)[0]
+    if exth_flags & _EXTH_FLAG:
+        fields.update(_read_exth(record0, 16 + header_length, encoding))
+    return fields
+
+
+def _read_exth(record0: bytes, start: int, encoding: str) -> dict[str, str]:
+    """Read the metadata from the EXTH header in record 0"""
+    if record0[start : start + 4] != b"EXTH":
+        raise MetadataFormatError("EXTH header missing")
+    number_of_records = struct.unpack_from(">I", record0, start + 8)[0]
+
+    fields: dict[str, str] = {}
+    position = start + 12
+    for _ in range(number_of_records):
+        if position + 8 > len(record0):
+            break  # Truncated by the bound on record 0
+        record_type, record_length = struct.unpack_from(">II", record0, position)
+        if record_length < 8:
+            raise MetadataFormatError("Invalid EXTH record")
+        field_name = _EXTH_FIELDS.get(record_type)
+        if field_name is not None and field_name not in fields:
+            value = record0[position + 8 : position + record_length]
+            fields[field_name] = value.decode(encoding, errors="replace").strip()
+        position += record_length
+    return fields
+
+
+# PDF: cross-reference section referenced by `startxref`, its trailer and the Info dictionary
+
+PDF_TAIL_BYTES = 4 * 1024
+PDF_WINDOW_BYTES = 8 * 1024
+PDF_MAX_XREF_STREAM_BYTES = 1024 * 1024
+PDF_MAX_XREF_SECTIONS = 8
+PDF_MAX_XREF_SUBSECTIONS = 1024
+
+_PDF_INFO_FIELDS = {b"Title": "title", b"Author": "author", b"CreationDate": "date"}
+_PDF_WHITESPACE = b"\0\t\n\f\r "
+_PDF_STRING_ESCAPES = {
+    ord("n"): b"\n",
+    ord("r"): b"\r",
+    ord("t"): b"\t",
+    ord("b"): b"\b",
+    ord("f"): b"\f",
+}
+_PDF_REFERENCE = re.compile(rb"\s*(\d+)\s+(\d+)\s+R")
+_PDF_OBJECT = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj")
+_PDF_INTEGER = re.compile(rb"\s*(\d+)")
+_PDF_OCTAL = re.compile(rb"[0-7]{1,3}")
+_PDF_DATE = re.compile(r"^(?:D:)?(\d{4})(\d{2})?(\d{2})?")
+
+
+def read_pdf_metadata(data: bytes) -> dict[str, str]:
+    """Read the metadata of a PDF file from the Info dictionary named in its trailer"""
+    tail_start = max(0, len(data) - PDF_TAIL_BYTES)
+    startxref = data.rfind(b"startxref", tail_start)
+    if startxref < 0:
+        raise MetadataFormatError("PDF trailer missing")
+    match = _PDF_INTEGER.match(data, startxref + len(b"startxref"))
+    if match is None:
+        raise MetadataFormatError("PDF cross-reference offset missing")
+
+    sections = _PdfCrossReferences(data, int(match.group(1)))
+    info_reference = sections.info_reference()
+    if info_reference is None:
+        return {}
+    info = sections.object_window(info_reference)
+    if info is None:
+        return {}
+
+    fields = {}
+    for key, field_name in _PDF_INFO_FIELDS.items():
+        value = _pdf_dictionary_value(info, key, sections)
+        if value is not None:
+            fields[field_name] = value
+    if "date" in fields:
+        fields["date"] = _pdf_date(fields["date"])
+    return fields
+
+
+class _PdfCrossReferences:
+    """Cross-reference sections of a PDF file, from the newest to the oldest.
+
+    Classic cross-reference tables are looked up entry by entry. Cross-reference streams are
+    decompressed up to a bounded size. Objects in object streams are not resolved.
+    """
+
+    def __init__(self, data: bytes, offset: int):
+        self.data = data
+        self._sections: list[tuple[Callable[[int], Optional[int]], bytes]] = []  # Offset lookup
+        self._next_offset: Optional[int] = offset
+
+    def info_reference(self) -> Optional[int]:
+        """Return the object number of the Info dictionary"""
+        for _, trailer in self._iter_sections():
+            reference = _pdf_reference(trailer, b"Info")
+            if reference is not None:
+                return reference
+        return None
+
+    def object_window(self, number: int) -> Optional[bytes]:
+        """Return a bounded window of the data starting at the content of an object"""
+        for object_offset, _ in self._iter_sections():
+            start = object_offset(number)
+            if start is not None:
+                window = self.data[start : start + PDF_WINDOW_BYTES]
+                match = _PDF_OBJECT.match(window)
+                if match is None or int(match.group(1)) != number:
+                    raise MetadataFormatError("Invalid PDF object offset")
+                return window[match.end() :].split(b"endobj", 1)[0]
+        return None
+
+    def _iter_sections(self):
+        """Yield the sections, read older ones when needed"""
+        yield from self._sections
+        while self._next_offset is not None and len(self._sections) < PDF_MAX_XREF_SECTIONS:
+            offset, self._next_offset = self._next_offset, None
+            section = self._read_section(offset)
+            self._sections.append(section)
+            previous = _pdf_integer(section[1], b"Prev")
+            if previous is not None and previous != offset:
+                self._next_offset = previous
+            yield section
+
+    def _read_section(self, offset: int) -> tuple[Callable[[int], Optional[int]], bytes]:
+        """Read the cross-reference section at the offset"""
+        if offset < 0 or offset >= len(self.data):
+            raise MetadataFormatError("Invalid PDF cross-reference offset")
+        if self.data.startswith(b"xref", offset):
+            return self._read_table(offset + len(b"xref"))
+        return self._read_stream(offset)
+
+    def _read_table(self, position: int) -> tuple[Callable[[int], Optional[int]], bytes]:
+        """Read the subsection headers of a classic table, entries are read on lookup"""
+        subsection_header = re.compile(rb"\s*(\d+)\s+(\d+)\s*?\r?\n")
+        subsections = []  # (first object number, count, position of the first entry)
+        for _ in range(PDF_MAX_XREF_SUBSECTIONS):
+            match = subsection_header.match(self.data, position, position + 64)
+            if match is None:
+                break
+            first, count = int(match.group(1)), int(match.group(2))
+            subsections.append((first, count, match.end()))
+            position = match.end() + count * 20
+
+        trailer = self.data.find(b"trailer", position, position + 64)
+        if trailer < 0:
+            raise MetadataFormatError("PDF trailer missing")
+
+        def object_offset(number: int) -> Optional[int]:
+            """Return the offset of an object in use"""
+            for first, count, entries_position in subsections:
+                if first <= number < first + count:
+                    # Entries of 20 bytes: 10 digits offset, 5 digits generation, type n or f
+                    entry_position = entries_position + (number - first) * 20
+                    entry = self.data[entry_position : entry_position + 18]
+                    return int(entry[:10]) if entry[17:18] == b"n" else None
+            return None
+
+        trailer_window = self.data[trailer : trailer + PDF_WINDOW_BYTES]
+        return object_offset, trailer_window.split(b"startxref", 1)[0]
+
+    def _read_stream(self, offset: int) -> tuple[Callable[[int], Optional[int]], bytes]:
+        """Read a cross-reference stream, keep the offsets of objects that are not compressed"""
+        window = self.data[offset : offset + PDF_WINDOW_BYTES]
+        match = _PDF_OBJECT.match(window)
+        stream = window.find(b"stream")
+        if match is None or stream < 0 or b"/XRef" not in window[:stream]:
+            raise MetadataFormatError("Invalid PDF cross-reference stream")
+        dictionary = window[match.end() : stream]
+
+        length = None
+        if _pdf_reference(dictionary, b"Length") is None:
+            length = _pdf_integer(dictionary, b"Length")
+        widths = _pdf_integers(dictionary, b"W")
+        if length is None or length > PDF_MAX_XREF_STREAM_BYTES or len(widths) != 3:
+            raise MetadataFormatError("Unsupported PDF cross-reference stream")
+        size = _pdf_integer(dictionary, b"Size") or 0
+        index = _pdf_integers(dictionary, b"Index") or [0, size]
+
+        start = offset + stream + len(b"stream")
+        start += 2 if self.data.startswith(b"\r\n", start) else 1
+        content = self.data[start : start + length]
+        if b"/FlateDecode" in dictionary:
+            content = zlib.decompressobj().decompress(content, PDF_MAX_XREF_STREAM_BYTES)
+        columns = _pdf_integer(dictionary, b"Columns") or sum(widths)
+        if (_pdf_integer(dictionary, b"Predictor") or 1) >= 10:
+            content = _png_up_rows(content, columns)
+
+        offsets = {}
+        entry_size = sum(widths)
+        entries = (
+            content[position : position + entry_size]
+            for position in range(0, len(content) - entry_size + 1, entry_size)
+        )
+        for first, count in zip(index[::2], index[1::2]):
+            for number, entry in zip(range(first, first + count), entries):
+                fields = []
+                position = 0
+                for width in widths:
+                    fields.append(int.from_bytes(entry[position : position + width], "big"))
+                    position += width
+                entry_type = fields[0] if widths[0] else 1
+                if entry_type == 1:
+                    offsets[number] = fields[1]
+        return offsets.get, dictionary
+
+
+def _png_up_rows(content: bytes, columns: int) -> bytes:
+    """Undo the PNG Up predictor of rows with a leading filter byte"""
+    rows = []
+    previous = bytes(columns)
+    for position in range(0, len(content) - columns, columns + 1):
+        row = content[position + 1 : position + 1 + columns]
+        if content[position] == 2:
+            row = bytes((a + b) & 0xFF for a, b in zip(row, previous))
+        elif content[position] != 0:
+            raise MetadataFormatError("Unsupported PNG predictor in PDF")
+        rows.append(row)
+        previous = row
+    return b"".join(rows)
+
+
+def _pdf_key_position(dictionary: bytes, key: bytes) -> Optional[int]:
+    """Return the position after a key of a dictionary"""
+    match = re.search(rb"/" + key + rb"(?=[\s(<\[/])", dictionary)
+    return match.end() if match else None
+
+
+def _pdf_integer(dictionary: bytes, key: bytes) -> Optional[int]:
+    """Return the integer value of a key"""
+    position = _pdf_key_position(dictionary, key)
+    match = _PDF_INTEGER.match(dictionary, position) if position is not None else None
+    return int(match.group(1)) if match else None
+
+
+def _pdf_integers(dictionary: bytes, key: bytes) -> list[int]:
+    """Return the integers in the array value of a key"""
+    position = _pdf_key_position(dictionary, key)
+    if position is None:
+        return []
+    match = re.compile(rb"\s*\[([\d\s]*)\]").match(dictionary, position)
+    return [int(number) for number in match.group(1).split()] if match else []
+
+
+def _pdf_reference(dictionary: bytes, key: bytes) -> Optional[int]:
+    """Return the object number of the indirect reference value of a key"""
+    position = _pdf_key_position(dictionary, key)
+    match = _PDF_REFERENCE.match(dictionary, position) if position is not None else None
+    return int(match.group(1)) if match else None
+
+
+def _pdf_dictionary_value(
+    dictionary: bytes, key: bytes, sections: _PdfCrossReferences
+) -> Optional[str]:
+    """Return the text string value of a key, follow one indirect reference"""
+    position = _pdf_key_position(dictionary, key)
+    if position is None:
+        return None
+    reference = _PDF_REFERENCE.match(dictionary, position)
+    if reference is not None:
+        dictionary = sections.object_window(int(reference.group(1))) or b""
+        position = 0
+    return _pdf_string(dictionary, position)
+
+
+def _pdf_string(data: bytes, position: int) -> Optional[str]:
+    """Decode the literal or hexadecimal string at the position"""
+    while position < len(data) and data[position] in _PDF_WHITESPACE:
+        position += 1
+    if data.startswith(b"(", position):
+        raw = _pdf_literal_string(data, position + 1)
+    elif data.startswith(b"<", position) and not data.startswith(b"<<", position):
+        end = data.find(b">", position)
+        if end < 0:
+            return None
+        digits = re.sub(rb"\s", b"", data[position + 1 : end])
+        raw = bytes.fromhex((digits + b"0" * (len(digits) % 2)).decode("ascii"))
+    else:
+        return None
+
+    if raw.startswith(b"\xfe\xff"):
+        return raw[2:].decode("utf-16-be", errors="replace")
+    return raw.decode("latin-1")  # Close to PDFDocEncoding for text
+
+
+def _pdf_literal_string(data: bytes, position: int) -> bytes:
+    """Return the bytes of a literal string starting after its opening parenthesis"""
+    raw = bytearray()
+    depth = 0
+    while position < len(data):
+        char = data[position]
+        position += 1
+        if char == ord("\\"):
+            escaped = data[position : position + 1]
+            position += 1
+            if escaped and escaped[0] in _PDF_STRING_ESCAPES:
+                raw += _PDF_STRING_ESCAPES[escaped[0]]
+            elif octal := _PDF_OCTAL.match(data, position - 1):
+                raw.append(int(octal.group(), 8) & 0xFF)
+                position = octal.end()
+            elif escaped not in (b"\r", b"\n"):
+                raw += escaped
+        elif char == ord("("):
+            depth += 1
+            raw.append(char)
+        elif char == ord(")"):
+            if not depth:
+                return bytes(raw)
+            depth -= 1
+            raw.append(char)
+        else:
+            raw.append(char)
+    raise MetadataFormatError("Unterminated PDF string")
+
+
+def _pdf_date(value: str) -> str:
+    """Format a PDF date like D:20230102... as 2023-01-02"""
+    match = _PDF_DATE.match(value)
+    if match is None:
+        return value
+    return "-".join(part for part in match.groups() if part)
+
+
+# EPUB/KEPUB: central directory of the archive, container document and OPF package document
+
+
+@dataclass(frozen=True)
+class EpubLimits:
+    """Resource limits for reading the metadata of an EPUB file"""
+
+    max_entries: int = 10_000  # Entries in the central directory of the archive
+    max_directory_bytes: int = 4 * 1024 * 1024  # Size of the central directory
+    max_document_bytes: int = 1024 * 1024  # Decompressed size of container and package document
+    max_compression_ratio: float = 100  # Decompressed to compressed size of a document
+    max_cover_bytes: int = 1024 * 1024  # Larger cover images are left out
+    time_budget_seconds: float = 2  # Wall-clock time for reading one file
+    cpu_budget_seconds: float = 1  # CPU time of the reading thread for one file
+
+
+_EPUB_NAMESPACES = {
+    "n": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "pkg": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "xhtml": "http://www.w3.org/1999/xhtml",
+    "svg": "http://www.w3.org/2000/svg",
+    "xlink": "http://www.w3.org/1999/xlink",
+}
+_EPUB_METADATA_ELEMENTS = {
+    "title": "title",
+    "author": "creator",
+    "language": "language",
+    "date": "date",
+    "identifier": "identifier",
+}
+# Covers are served to browsers, scriptable SVG images are left out
+_EPUB_COVER_MEDIA_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+_EPUB_CHUNK_BYTES = 64 * 1024
+_EPUB_RATIO_MIN_BYTES = 64 * 1024  # Smaller documents are not checked for their compression
+_ZIP_END_OF_DIRECTORY = b"PK\x05\x06"
+_ZIP_END_OF_DIRECTORY_MAX_BYTES = 22 + 0xFFFF  # Record with the longest comment
+
+
+@dataclass
+class _EpubTools:
+    """XML parser and compiled XPath expressions, each thread uses its own"""
+
+    parser: etree.XMLParser
+    rootfile_paths: etree.XPath
+    metadata_fields: dict[str, etree.XPath]
+    cover_image_items: etree.XPath  # EPUB 3 manifest items with the cover-image property
+    cover_item_ids: etree.XPath  # EPUB 2 cover meta element
+    guide_cover_hrefs: etree.XPath
+    item_by_id: etree.XPath  # Takes the variable `id`
+    item_by_href: etree.XPath  # Takes the variable `href`
+    cover_like_items: etree.XPath  # Manifest items with "cover" in their ID or reference
+    page_image_sources: etree.XPath
+
+
+_epub_tools_per_thread = threading.local()
+
+
+def _epub_tools() -> _EpubTools:
+    """Return the tools of the current thread, create them on first use.
+
+    The parser neither expands entities nor loads DTDs or other resources from the network.
+    """
+    tools = getattr(_epub_tools_per_thread, "tools", None)
+    if tools is None:
+        tools = _EpubTools(
+            parser=etree.XMLParser(
+                resolve_entities=False,
+                load_dtd=False,
+                no_network=True,
+                huge_tree=False,
+                remove_pis=True,
+            ),
+            rootfile_paths=etree.XPath(
+                "n:rootfiles/n:rootfile/@full-path", namespaces=_EPUB_NAMESPACES
+            ),
+            metadata_fields={
+                field_name: etree.XPath(
+                    f"/pkg:package/pkg:metadata/dc:{element}[1]/text()",
+                    namespaces=_EPUB_NAMESPACES,
+                )
+                for field_name, element in _EPUB_METADATA_ELEMENTS.items()
+            },
+            cover_image_items=etree.XPath(
+                "/pkg:package/pkg:manifest/pkg:item"
+                "[contains(concat(' ', normalize-space(@properties), ' '), ' cover-image ')]",
+                namespaces=_EPUB_NAMESPACES,
+            ),
+            cover_item_ids=etree.XPath(
+                "/pkg:package/pkg:metadata/*[local-name()='meta'][@name='cover']/@content",
+                namespaces=_EPUB_NAMESPACES,
+            ),
+            guide_cover_hrefs=etree.XPath(
+                "/pkg:package/pkg:guide/pkg:reference"
+                "[translate(@type, 'COVER', 'cover')='cover']/@href",
+                namespaces=_EPUB_NAMESPACES,
+            ),
+            item_by_id=etree.XPath(
+                "/pkg:package/pkg:manifest/pkg:item[@id=$id]", namespaces=_EPUB_NAMESPACES
+            ),
+            item_by_href=etree.XPath(
+                "/pkg:package/pkg:manifest/pkg:item[@href=$href]", namespaces=_EPUB_NAMESPACES
+            ),
+            cover_like_items=etree.XPath(
+                "/pkg:package/pkg:manifest/pkg:item"
+                "[contains(translate(concat(@id, ' ', @href), 'COVER', 'cover'), 'cover')]",
+                namespaces=_EPUB_NAMESPACES,
+            ),
+            page_image_sources=etree.XPath(
+                "(//xhtml:img/@src | //svg:image/@xlink:href | //svg:image/@href)",
+                namespaces=_EPUB_NAMESPACES,
+            ),
+        )
+        _epub_tools_per_thread.tools = tools
+    return tools
+
+
+class _Budget:
+    """Wall-clock and CPU time budget for reading one file"""
+
+    def __init__(self, limits: EpubLimits):
+        self._deadline = time.perf_counter() + limits.time_budget_seconds
+        self._cpu_deadline = time.thread_time() + limits.cpu_budget_seconds
+
+    def check(self):
+        """Raise if the budget is exhausted"""
+        if time.perf_counter() > self._deadline or time.thread_time() > self._cpu_deadline:
+            raise MetadataFormatError("Time budget for reading metadata exceeded")
+
+
+def read_epub_metadata(data: bytes, limits: EpubLimits = EpubLimits()) -> dict[str, str | bytes]:
+    """Read the metadata of an EPUB or KEPUB file from its package document.
+
+    Only the central directory of the archive, the container document and the package
+    document are read, and the cover image if the package document names one. Documents are
+    decompressed and parsed in chunks within the limits. The cover is returned as `cover` with
+    its `cover_media_type`, a cover that cannot be read within the limits is left out.
+    """
+    budget = _Budget(limits)
+    _check_central_directory(data, limits)
+    tools = _epub_tools()
+
+    with zipfile.ZipFile(io.BytesIO(data), mode="r") as archive:
+        budget.check()
+        container = _parse_epub_document(
+            archive, "META-INF/container.xml", tools.parser, limits, budget
+        )
+        package_paths = tools.rootfile_paths(container)
+        if not package_paths:
+            raise MetadataFormatError("EPUB package document missing")
+        package_path = str(package_paths[0])
+        package = _parse_epub_document(archive, package_path, tools.parser, limits, budget)
+
+        fields: dict[str, str | bytes] = {}
+        for field_name, xpath in tools.metadata_fields.items():
+            values = xpath(package)
+            if values:
+                fields[field_name] = str(values[0]).strip()
+
+        try:
+            cover = _find_epub_cover(archive, package, package_path, tools, limits, budget)
+        except MetadataFormatError:
+            cover = None
+        if cover is not None:
+            cover_path, fields["cover_media_type"] = cover
+            try:
+                fields["cover"] = b"".join(
+                    _member_chunks(archive, cover_path, limits.max_cover_bytes, limits, budget)
+                )
+            except MetadataFormatError:
+                del fields["cover_media_type"]
+    return fields
+
+
+def _find_epub_cover(
+    archive: zipfile.ZipFile,
+    package: etree._Element,
+    package_path: str,
+    tools: _EpubTools,
+    limits: EpubLimits,
+    budget: _Budget,
+) -> Optional[tuple[str, str]]:
+    """Return path and media type of the cover image named by the package document.
+
+    The manifest item with the EPUB 3 cover-image property is preferred, then the item named
+    by the EPUB 2 cover meta element, then the image on the cover page of the guide, then an
+    image item called cover.
+    """
+    items = list(tools.cover_image_items(package))
+    for item_id in tools.cover_item_ids(package):
+        items.extend(tools.item_by_id(package, id=str(item_id)))
+    for item in items:
+        cover = _epub_image_item(item, package_path)
+        if cover is not None:
+            return cover
+
+    for href in tools.guide_cover_hrefs(package):
+        page_path = _epub_path(package_path, str(href))
+        items = tools.item_by_href(package, href=str(href).split("#", 1)[0])
+        if any(item.get("media-type", "").startswith("image/") for item in items):
+            images = items  # The guide references the image itself
+        else:
+            try:
+                page = _parse_epub_document(archive, page_path, tools.parser, limits, budget)
+            except MetadataFormatError:
+                continue
+            images = [
+                item
+                for source in tools.page_image_sources(page)
+                for item in tools.item_by_href(
+                    package, href=_epub_href(package_path, _epub_path(page_path, str(source)))
+                )
+            ]
+        for item in images:
+            cover = _epub_image_item(item, package_path)
+            if cover is not None:
+                return cover
+
+    for item in tools.cover_like_items(package):
+        cover = _epub_image_item(item, package_path)
+        if cover is not None:
+            return cover
+    return None
+
+
+def _epub_image_item(item: etree._Element, package_path: str) -> Optional[tuple[str, str]]:
+    """Return path and media type of a manifest item of a supported image type"""
+    media_type = item.get("media-type", "")
+    href = item.get("href")
+    if media_type not in _EPUB_COVER_MEDIA_TYPES or not href:
+        return None
+    return _epub_path(package_path, href), media_type
+
+
+def _epub_path(document_path: str, href: str) -> str:
+    """Return the path in the archive of a reference relative to a document"""
+    href = unquote(href.split("#", 1)[0])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(document_path), href))
+
+
+def _epub_href(package_path: str, path: str) -> str:
+    """Return the reference relative to the package document of a path in the archive"""
+    return posixpath.relpath(path, posixpath.dirname(package_path) or ".")
+
+
+def _check_central_directory(data: bytes, limits: EpubLimits):
+    """Reject archives with too many entries before the central directory is read"""
+    end_of_directory = data.rfind(
+        _ZIP_END_OF_DIRECTORY, max(0, len(data) - _ZIP_END_OF_DIRECTORY_MAX_BYTES)
+    )
+    if end_of_directory < 0 or end_of_directory + 22 > len(data):
+        raise MetadataFormatError("Not a ZIP archive")
+    entries, directory_bytes = struct.unpack_from("<HI", data, end_of_directory + 10)
+    if entries > limits.max_entries or directory_bytes > limits.max_directory_bytes:
+        raise MetadataFormatError("Too many entries in the archive")
+
+
+def _member_chunks(
+    archive: zipfile.ZipFile,
+    path: str,
+    max_bytes: int,
+    limits: EpubLimits,
+    budget: _Budget,
+) -> Iterator[bytes]:
+    """Decompress a member of the archive chunk by chunk within the limits"""
+    try:
+        info = archive.getinfo(path)
+    except KeyError as exc:
+        raise MetadataFormatError(f"{path} missing") from exc
+    max_bytes = min(
+        max_bytes,
+        max(_EPUB_RATIO_MIN_BYTES, int(info.compress_size * limits.max_compression_ratio)),
+    )
+    if info.file_size > max_bytes:
+        raise MetadataFormatError(f"{path} is too large or too highly compressed")
+
+    size_bytes = 0
+    with archive.open(info) as member:
+        while chunk := member.read(_EPUB_CHUNK_BYTES):
+            size_bytes += len(chunk)
+            if size_bytes > max_bytes:
+                raise MetadataFormatError(f"{path} is too large or too highly compressed")
+            yield chunk
+            budget.check()
+
+
+def _parse_epub_document(
+    archive: zipfile.ZipFile,
+    path: str,
+    parser: etree.XMLParser,
+    limits: EpubLimits,
+    budget: _Budget,
+) -> etree._Element:
+    """Decompress and parse a document of the archive chunk by chunk within the limits"""
+    try:
+        for chunk in _member_chunks(archive, path, limits.max_document_bytes, limits, budget):
+            parser.feed(chunk)
+        return parser.close()
+    except etree.XMLSyntaxError as exc:
+        _reset_parser(parser)
+        raise MetadataFormatError(f"{path} is not well-formed") from exc
+    except BaseException:
+        _reset_parser(parser)
+        raise
+
+
+def _reset_parser(parser: etree.XMLParser):
+    """Discard a partially fed document, so the parser can be used again"""
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        pass
@@ -1,12 +1,18 @@
 """Defines resources for pairing process"""
 
+import itertools
 import threading
+import time
 from typing import Optional
 
 from booklink.channel import Channel
 from booklink.client import Client
+from booklink.expiry import (
+    Clock,
+    ExpiryQueue,
+)
+from booklink.pairing_codes import PairingCodeAllocator
 from booklink.utils import (
-    human_friendly_pairing_code,
     now_unixutc,
     url_friendly_code,
 )
@@ -26,59 +32,121 @@ class ClientNotFoundError(RuntimeError):
     """Error for invalid client"""
 
 
+class ChannelNotFoundError(RuntimeError):
+    """Error for invalid channel"""
+
+
 class PairingRegister:
-    """Manage clients in pairing process"""
+    """Manage clients in pairing process
+
+    Expired clients are pruned inline when adding a client. Without inline pruning, a
+    background task must call `prune_data` and lookups only skip expired clients.
+
+    Pairing codes come from an allocator that always has a free code. The codes of pruned
+    clients are returned to it.
+
+    Channels expire on their own and each client keeps at most `max_channels_per_client`
+    channels, registering another one drops the oldest. Channels are pruned together with
+    expired clients.
+
+    The channels of each client carry a version that changes whenever a channel is registered
+    for the client or the client's channels are pruned. Readers can wait for the next version.
+    """
 
     def __init__(
         self,
         client_expiration_seconds: int = 300,
         max_clients_in_pairing: int = 100,
-        max_random_draws: int = 10,
+        clock: Clock = now_unixutc,
+        inline_pruning: bool = True,
+        channel_expiration_seconds: float = 300,
+        max_channels_per_client: int = 10,
     ):
+        if max_channels_per_client < 1:
+            raise ValueError("At least one channel per client is required")
         self.client_expiration_seconds = client_expiration_seconds
         self.max_clients_in_pairing = max_clients_in_pairing
-        self.max_random_draws = max_random_draws
+        self.channel_expiration_seconds = channel_expiration_seconds
+        self.max_channels_per_client = max_channels_per_client
+        self.inline_pruning = inline_pruning
 
         self._clients_in_pairing: dict[str, Client] = {}  # Access by pairing code
+        self._clients_by_id: dict[str, tuple[str, Client]] = {}  # Access by client id
         self._channels_for: dict[str, list[Channel]] = {}  # Access by client id
+        self._channels_by_id: dict[str, tuple[str, Channel]] = {}  # Access by channel id
+        self._channel_expiry_queue: ExpiryQueue[tuple[str, Channel]] = ExpiryQueue()
+        self._channels_version: dict[str, int] = {}  # Access by client id
+        self._pairing_codes = PairingCodeAllocator()
+        # Start from the current time, so versions are not reused after a restart
+        self._versions = itertools.count(time.time_ns() // 1000)
+        self._expiry_queue: ExpiryQueue[tuple[str, Client]] = ExpiryQueue()
+        self._clock = clock
 
         self.__clients_lock = threading.Lock()
         self.__channels_lock = threading.Lock()
+        self.__channels_changed = threading.Condition(self.__channels_lock)
 
     def new_client(self, friendly_name: Optional[str] = None) -> tuple[str, Client]:
         """Generate a new client in the register"""
-        pairing_code = self._unique_pairing_code()
-        client = Client.make(friendly_name=friendly_name or f"device-{pairing_code}")
-        self._clients_in_pairing.update({pairing_code: client})
-        self.prune_data()  # After adding the new client to avoid collisions
+        if self._is_full():
+            self.prune_data()  # Free capacity held by expired clients
+        with self.__clients_lock:
+            if self._is_full():
+                raise TooManyClientsError("Exceeding maximum number of clients in pairing process")
+            pairing_code = self._pairing_codes.allocate()
+            client = Client.make(friendly_name=friendly_name or f"device-{pairing_code}")
+            self._clients_in_pairing.update({pairing_code: client})
+            self._clients_by_id[client.id] = (pairing_code, client)
+            self._expiry_queue.push(client.created_at_unixutc, (pairing_code, client))
+        if self.inline_pruning:
+            self.prune_data()  # After adding the new client to avoid collisions
         return pairing_code, client
 
     def prune_data(self):
-        """Prune expired clients"""
-        with self.__clients_lock:
-            for pairing_code, client in self._clients_in_pairing.copy().items():
-                if now_unixutc() - client.created_at_unixutc > self.client_expiration_seconds:
-                    expired_client = self._clients_in_pairing.pop(pairing_code)
-                    with self.__channels_lock:
-                        self._channels_for.pop(expired_client.id, None)
-
-    def _unique_pairing_code(self):
-        """Generate a unique pairing code"""
-        if len(self._clients_in_pairing) >= self.max_clients_in_pairing:
-            raise TooManyClientsError("Exceeding maximum number of clients in pairing process")
+        """Prune expired clients and channels in order of expiry"""
         with self.__clients_lock:
-            for _ in range(MAX_RANDOM_DRAWS):
-                code = human_friendly_pairing_code()
-                if code in self._clients_in_pairing:
-                    continue
-                return code
-        raise RuntimeError("Failed to generate a unique pairing code")
+            for pairing_code, client in self._expiry_queue.pop_older_than(self._expiry_threshold()):
+                if self._clients_in_pairing.get(pairing_code) is not client:
+                    continue  # Pairing code already reused
+                expired_client = self._clients_in_pairing.pop(pairing_code)
+                self._pairing_codes.release(pairing_code)
+                self._clients_by_id.pop(expired_client.id, None)
+                with self.__channels_lock:
+                    for channel in self._channels_for.get(expired_client.id, [])[:]:
+                        self._remove_channel(channel.channel_id)
+
+        with self.__channels_lock:
+            threshold = self._channel_expiry_threshold()
+            for channel_id, channel in self._channel_expiry_queue.pop_older_than(threshold):
+                if self._channels_by_id.get(channel_id, (None, None))[1] is not channel:
+                    continue  # Removed before expiring
+                self._remove_channel(channel_id)
+
+    def _channel_expiry_threshold(self) -> float:
+        """Return the creation time before which channels are expired"""
+        return self._clock() - self.channel_expiration_seconds
+
+    def _is_channel_alive(self, channel: Channel) -> bool:
+        """Check if a channel is not expired"""
+        return channel.created_at_unixutc >= self._channel_expiry_threshold()
+
+    def _expiry_threshold(self) -> float:
+        """Return the creation time before which clients are expired"""
+        return self._clock() - self.client_expiration_seconds
+
+    def _is_alive(self, client: Client) -> bool:
+        """Check if a client is not expired"""
+        return client.created_at_unixutc >= self._expiry_threshold()
+
+    def _is_full(self) -> bool:
+        """Check if the maximum number of clients in pairing is reached"""
+        return len(self._clients_in_pairing) >= self.max_clients_in_pairing
 
     def get_client_by_pairing_code(self, pairing_code: str):
         """Get the client from the given pairing code"""
         with self.__clients_lock:
             client = self._clients_in_pairing.get(pairing_code)
-        if client is None:
+        if client is None or not self._is_alive(client):
             raise ClientNotFoundError(f"Client with pairing code {pairing_code} not found")
         return client
 
@@ -96,31 +164,97 @@ class PairingRegister:
     def get_client_by_id(self, client_id: str):
         """Get the client from the given id"""
         with self.__clients_lock:
-            for client in self._clients_in_pairing.values():
-                if client.id == client_id:
-                    return client
-        raise ClientNotFoundError(f"Client with id {client_id} not found")
+            _, client = self._clients_by_id.get(client_id, (None, None))
+        if client is None or not self._is_alive(client):
+            raise ClientNotFoundError(f"Client with id {client_id} not found")
+        return client
+
+    def register_channel_for_ereader(self, ereader_id: str, new_channel: Channel):
+        """Register a channel for the given e-reader, drop its oldest channel if at the limit"""
+        with self.__channels_lock:
+            existing_channels = self._channels_for.get(ereader_id, [])
+            while len(existing_channels) >= self.max_channels_per_client:
+                self._remove_channel(existing_channels[0].channel_id)
+
+            self._channels_for.setdefault(ereader_id, []).append(new_channel)
+            self._channels_by_id[new_channel.channel_id] = (ereader_id, new_channel)
+            self._channel_expiry_queue.push(
+                new_channel.created_at_unixutc, (new_channel.channel_id, new_channel)
+            )
+            self._publish_channels_change(ereader_id)
+
+    def _remove_channel(self, channel_id: str):
+        """Remove a channel known to the index (requires the channels lock)"""
+        client_id, channel = self._channels_by_id.pop(channel_id)
+        channels = self._channels_for[client_id]
+        channels.remove(channel)
+        if not channels:
+            self._channels_for.pop(client_id)
+        self._publish_channels_change(client_id)
+
+    def _publish_channels_change(self, client_id: str):
+        """Give the client's channels a new version and wake waiting readers"""
+        if client_id in self._channels_for:
+            self._channels_version[client_id] = next(self._versions)
+        else:
+            self._channels_version.pop(client_id, None)
+        self.__channels_changed.notify_all()
+
+    def get_channel(self, channel_id: str) -> Channel:
+        """Get the channel with the given id"""
+        with self.__channels_lock:
+            _, channel = self._channels_by_id.get(channel_id, (None, None))
+        if channel is None or not self._is_channel_alive(channel):
+            raise ChannelNotFoundError(f"Channel with id {channel_id} not found")
+        return channel
 
-    def register_channel_for_ereader(self, ereader_pairing_code: str, new_channel: Channel):
-        """Register a channel for the given e-reader"""
+    def set_channel_token(self, client_id: str, channel_id: str, token: str):
+        """Store the token of a client for a channel registered for that client"""
         with self.__channels_lock:
-            existing_channels = self._channels_for.get(ereader_pairing_code) or []
-            self._channels_for[ereader_pairing_code] = existing_channels + [new_channel]
+            owner_id, channel = self._channels_by_id.get(channel_id, (None, None))
+            if channel is not None and owner_id == client_id:
+                channel.tokens[client_id] = token
 
     def _unique_channel_id(self):
         """Generate a unique channel id"""
         with self.__channels_lock:
             for _ in range(MAX_RANDOM_DRAWS):
                 channel_id = url_friendly_code()
-                if channel_id in self._channels_for:
+                if channel_id in self._channels_by_id:
                     continue
                 return channel_id
         raise RuntimeError("Failed to generate a unique channel id")
 
-    def channels_for(self, client_id: str):
-        """Get the channel for the given pairing code"""
+    def channels_for(self, client_id: str) -> list[Channel]:
+        """Get the valid channels for the given client"""
+        with self.__channels_lock:
+            return self._alive_channels_for(client_id)
+
+    def _alive_channels_for(self, client_id: str) -> list[Channel]:
+        """Return a copy of the valid channels for the client (requires the channels lock)"""
+        return [c for c in self._channels_for.get(client_id, []) if self._is_channel_alive(c)]
+
+    def versioned_channels_for(self, client_id: str) -> tuple[int, list[Channel]]:
+        """Get the version and the valid channels for the given client at once"""
         with self.__channels_lock:
-            return self._channels_for.get(client_id, [])
+            return self._channels_version.get(client_id, 0), self._alive_channels_for(client_id)
+
+    def channels_version(self, client_id: str) -> int:
+        """Get the version of the channels for the given client, 0 if there are none"""
+        return self._channels_version.get(client_id, 0)
+
+    def wait_for_channels(
+        self, client_id: str, version: int, timeout_seconds: float
+    ) -> tuple[int, list[Channel]]:
+        """Wait until the channels' version differs from `version` or the timeout passes.
+
+        Return the version and the channels for the given client at that point.
+        """
+        with self.__channels_changed:
+            self.__channels_changed.wait_for(
+                lambda: self._channels_version.get(client_id, 0) != version, timeout_seconds
+            )
+            return self._channels_version.get(client_id, 0), self._alive_channels_for(client_id)
 
     @property
     def all_clients_in_pairing(self):
@@ -0,0 +1,105 @@
+"""Allocation of unique, human-friendly pairing codes"""
+
+import secrets
+import string
+
+PAIRING_CODE_ALPHABET = string.digits + string.ascii_lowercase
+
+
+class _CodePool:
+    """Free codes of one length, drawn at random without replacement.
+
+    The pool is a virtual array of all code indices that is shuffled lazily (sparse
+    Fisher–Yates). Only the positions that differ from the identity are stored, so drawing
+    and returning a code take constant time and memory grows with the codes in use.
+    """
+
+    def __init__(self, length: int):
+        self.length = length
+        self.size = len(PAIRING_CODE_ALPHABET) ** length
+        self.free = self.size  # Free indices are at positions [0, free)
+
+        self._moved: dict[int, int] = {}  # Position -> index where not the identity
+
+    def occupancy(self) -> float:
+        """Return the share of codes in use"""
+        return 1 - self.free / self.size
+
+    def draw(self) -> str:
+        """Draw a free code at random"""
+        if not self.free:
+            raise RuntimeError(f"No free pairing code of length {self.length}")
+        position = secrets.randbelow(self.free)
+        index = self._moved.get(position, position)
+
+        # Move the last free index into the drawn position
+        self.free -= 1
+        last_index = self._moved.pop(self.free, self.free)
+        if position != self.free:
+            self._set(position, last_index)
+        return self._encode(index)
+
+    def put_back(self, code: str):
+        """Return a code drawn from this pool"""
+        self._set(self.free, self._decode(code))
+        self.free += 1
+
+    def _set(self, position: int, index: int):
+        """Place an index at a position, store it only if it differs from the identity"""
+        if position == index:
+            self._moved.pop(position, None)
+        else:
+            self._moved[position] = index
+
+    def _encode(self, index: int) -> str:
+        """Return the code for an index"""
+        chars = []
+        for _ in range(self.length):
+            index, digit = divmod(index, len(PAIRING_CODE_ALPHABET))
+            chars.append(PAIRING_CODE_ALPHABET[digit])
+        return "".join(reversed(chars))
+
+    @staticmethod
+    def _decode(code: str) -> int:
+        """Return the index of a code"""
+        return int(code, len(PAIRING_CODE_ALPHABET))
+
+
+class PairingCodeAllocator:
+    """Allocate unique pairing codes in constant time.
+
+    Codes are drawn from the pool of the shortest length whose occupancy is below the threshold.
+    If all pools are that full, codes grow one character longer. Released codes return to their
+    pool, so short codes are handed out again once occupancy drops. The allocator is not
+    thread-safe, callers must serialize access.
+    """
+
+    def __init__(self, min_length: int = 4, max_occupancy: float = 0.5):
+        """Inits the allocator
+
+        Parameters:
+            min_length: Length of the shortest codes
+            max_occupancy: Share of codes of a length in use before longer codes are drawn
+        """
+        if not 0 < max_occupancy <= 1:
+            raise ValueError("Maximum occupancy must be in (0, 1]")
+        self.max_occupancy = max_occupancy
+        self._pools = [_CodePool(min_length)]
+
+    def allocate(self) -> str:
+        """Return a code that is not in use"""
+        for pool in self._pools:
+            if pool.occupancy() < self.max_occupancy:
+                return pool.draw()
+
+        pool = _CodePool(self._pools[-1].length + 1)
+        self._pools.append(pool)
+        return pool.draw()
+
+    def release(self, code: str):
+        """Return an allocated code for reuse"""
+        self._pools[len(code) - self._pools[0].length].put_back(code)
+
+    def __len__(self) -> int:
+        """Return the number of codes in use"""
+        return sum(pool.size - pool.free for pool in self._pools)
@@ -0,0 +1,65 @@
+"""Background eviction of expired data"""
+
+import logging
+import threading
+from typing import (
+    Callable,
+    Optional,
+    Sequence,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Reaper:
+    """Run pruning tasks periodically in a background thread.
+
+    This takes the cost of evicting expired data off the request threads.
+    """
+
+    def __init__(self, tasks: Sequence[Callable[[], None]], interval_seconds: float):
+        """Inits the reaper
+
+        Parameters:
+            tasks: Callables that evict expired data
+            interval_seconds: Pause between two runs of all tasks
+        """
+        if interval_seconds <= 0:
+            raise ValueError("Reaper interval must be positive")
+        self.tasks = tasks
+        self.interval_seconds = interval_seconds
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start reaping in a background thread"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="booklink-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop reaping and wait for the background thread to finish"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        """Check if the background thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self):
+        """Run all tasks once. A failing task does not stop the others."""
+        for task in self.tasks:
+            try:
+                task()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Reaper task failed")
+
+    def _run(self):
+        """Run all tasks until stopped"""
+        while not self._stop_event.wait(self.interval_seconds):
+            self.run_once()
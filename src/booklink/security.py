@@ -1,26 +1,54 @@
 """Provides authentification for the service layer."""
 
+import threading
+from collections import OrderedDict
 from typing import Set
 
 import jwt
 
+from booklink.expiry import Clock
+from booklink.utils import now_unixutc
+
 
 class AuthenticationError(Exception):
     """Error raised when authentication fails"""
 
 
 class Authenticator:
-    """Handles client authentication for the service layer."""
+    """Handles client authentication for the service layer.
+
+    Successful validations are cached, so repeated validations of the same token and claim
+    skip decoding and verifying the JWT. The cache is bounded in size (least recently used
+    entries are evicted first) and entries expire after a time to live.
+    """
 
-    def __init__(self, jwt_secret: str, id_factors: Set[str]):
+    def __init__(
+        self,
+        jwt_secret: str,
+        id_factors: Set[str],
+        cache_size: int = 1024,
+        cache_ttl_seconds: float = 60,
+        clock: Clock = now_unixutc,
+    ):
         """Inits the authenticator
 
         Parameters:
             jwt_secret: The secret for the JWT
             id_factors: The names of factors that make up the ID
+            cache_size: Maximum number of cached validations, 0 disables the cache
+            cache_ttl_seconds: Time after which a cached validation is verified again
+            clock: Returns the current time in seconds
         """
         self.jwt_secret = jwt_secret
         self.id_factors = id_factors
+        self.cache_size = cache_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._clock = clock
+        self._validated: OrderedDict[tuple, float] = OrderedDict()  # Valid until timestamp
+        self.__cache_lock = threading.Lock()
 
     def decode(self, token):
         """Decode token and return payload"""
@@ -39,10 +67,40 @@ class Authenticator:
 
     def validate(self, token, **id_claim):
         """Raise exception if the claimed ID cannot be verified."""
+        cache_key = (token, frozenset(id_claim.items()))
+        if self._is_cached(cache_key):
+            return
+
         try:
             payload = self.decode(token)
         except jwt.DecodeError as exc:
             raise AuthenticationError("Invalid token") from exc
 
-        if not id_claim == {key: payload[key] for key in self.id_factors}:
+        if not id_claim == {key: payload.get(key) for key in self.id_factors}:
             raise AuthenticationError("Token does not match ID factors")
+
+        self._cache(cache_key)
+
+    def _is_cached(self, cache_key: tuple) -> bool:
+        """Check if the validation is cached and count hits and misses"""
+        with self.__cache_lock:
+            valid_until = self._validated.get(cache_key)
+            if valid_until is not None and valid_until > self._clock():
+                self._validated.move_to_end(cache_key)
+                self.cache_hits += 1
+                return True
+
+            if valid_until is not None:
+                del self._validated[cache_key]
+            self.cache_misses += 1
+            return False
+
+    def _cache(self, cache_key: tuple):
+        """Cache a successful validation, evict the least recently used if full"""
+        if self.cache_size <= 0:
+            return
+        with self.__cache_lock:
+            self._validated[cache_key] = self._clock() + self.cache_ttl_seconds
+            self._validated.move_to_end(cache_key)
+            while len(self._validated) > self.cache_size:
+                self._validated.popitem(last=False)
@@ -0,0 +1,159 @@
+"""Backends holding the state of the service layer.
+
+The registers either live in the current process or in a state server shared by several
+worker processes on the same machine. The service layer uses the same register API for both.
+"""
+
+import abc
+import threading
+from multiprocessing.managers import BaseManager
+from typing import Optional
+
+from booklink.pair_devices import PairingRegister
+from booklink.storage import FileRegister
+
+
+class StateBackend(abc.ABC):
+    """Interface for backends holding the registers"""
+
+    @property
+    @abc.abstractmethod
+    def pairing_register(self) -> PairingRegister:
+        """Return the register of clients and channels"""
+
+    @property
+    @abc.abstractmethod
+    def file_register(self) -> FileRegister:
+        """Return the register of files"""
+
+    @property
+    @abc.abstractmethod
+    def is_local(self) -> bool:
+        """Check if the registers live in the current process"""
+
+    def close(self):
+        """Release resources of the backend"""
+
+
+class LocalStateBackend(StateBackend):
+    """Keep the registers in the current process"""
+
+    def __init__(self, pairing_register: PairingRegister, file_register: FileRegister):
+        self._pairing_register = pairing_register
+        self._file_register = file_register
+
+    @property
+    def pairing_register(self) -> PairingRegister:
+        return self._pairing_register
+
+    @property
+    def file_register(self) -> FileRegister:
+        return self._file_register
+
+    @property
+    def is_local(self) -> bool:
+        return True
+
+
+class _StateManager(BaseManager):
+    """Manager for accessing registers served by a state server"""
+
+
+_StateManager.register("pairing_register")
+_StateManager.register("file_register")
+
+
+class SharedStateBackend(StateBackend):
+    """Access the registers served by a `StateServer` from another process.
+
+    Register calls are forwarded over the server's Unix socket, their arguments and results are
+    pickled. Listings and attachments of files are sent instead of files, so only downloads
+    copy the content of a file between processes. The connection is established on first use,
+    so the backend can be created before the server is up.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self._authkey = authkey
+        self._manager: Optional[_StateManager] = None
+        self._registers: dict[str, object] = {}
+        self.__connect_lock = threading.Lock()
+
+    def _register(self, typeid: str):
+        """Return the proxy of a register, connect to the server if needed"""
+        with self.__connect_lock:
+            if self._manager is None:
+                manager = _StateManager(address=self.address, authkey=self._authkey)
+                manager.connect()
+                self._manager = manager
+            if typeid not in self._registers:
+                self._registers[typeid] = getattr(self._manager, typeid)()
+            return self._registers[typeid]
+
+    @property
+    def pairing_register(self) -> PairingRegister:
+        return self._register("pairing_register")  # type: ignore[return-value]
+
+    @property
+    def file_register(self) -> FileRegister:
+        return self._register("file_register")  # type: ignore[return-value]
+
+    @property
+    def is_local(self) -> bool:
+        return False
+
+    def close(self):
+        with self.__connect_lock:
+            self._registers.clear()
+            self._manager = None
+
+
+class StateServer:
+    """Serve the registers of a local backend to other processes over a Unix socket"""
+
+    def __init__(self, backend: LocalStateBackend, address: str, authkey: bytes):
+        """Inits the state server
+
+        Parameters:
+            backend: Backend holding the registers to serve
+            address: Path of the Unix socket
+            authkey: Key that clients must present to connect
+        """
+
+        class ServingManager(BaseManager):
+            """Manager exposing the registers of the backend"""
+
+        ServingManager.register("pairing_register", callable=lambda: backend.pairing_register)
+        ServingManager.register("file_register", callable=lambda: backend.file_register)
+
+        self.address = address
+        self._server = ServingManager(address=address, authkey=authkey).get_server()
+        self._thread: Optional[threading.Thread] = None
+
+    def serve_forever(self):
+        """Serve requests until stopped (blocking)"""
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(
+            target=self._serve_in_background, name="booklink-state-server", daemon=True
+        )
+        self._thread.start()
+
+    def _serve_in_background(self):
+        """Serve requests without ending the process when stopped"""
+        try:
+            self.serve_forever()
+        except SystemExit:
+            pass  # The manager server exits when stopped
+
+    def stop(self):
+        """Stop serving requests in the background thread"""
+        self._server.listener.close()
+        while self._thread is not None and self._thread.is_alive():
+            stop_event = getattr(self._server, "stop_event", None)  # Set when serving starts
+            if stop_event is not None:
+                stop_event.set()
+            self._thread.join(timeout=0.1)
+        self._thread = None
@@ -1,9 +1,23 @@
 """Defines resources for sending files"""
 
 import abc
+import itertools
 import threading
-from dataclasses import dataclass
+import time
+from dataclasses import (
+    dataclass,
+    field,
+    replace,
+)
+from typing import (
+    Iterator,
+    Optional,
+)
 
+from booklink.expiry import (
+    Clock,
+    ExpiryQueue,
+)
 from booklink.utils import (
     now_unixutc,
     url_friendly_code,
@@ -24,12 +38,78 @@ class RegisteredFile(abc.ABC):
     def size_bytes(self) -> int:
         """Return the size of the file in bytes"""
 
+    def content_key(self) -> Optional[str]:
+        """Return a key identifying the content, files with equal keys share their content"""
+        return None
+
+    def with_content_of(self, other: "RegisteredFile") -> "RegisteredFile":
+        """Return this file using the content of another file with the same content key"""
+        return self
+
+    def listing(self) -> "RegisteredFile":
+        """Return the file without its content, for listing it.
+
+        Listings are sent instead of files when the register is accessed from another process.
+        They keep the size and creation time of the file.
+        """
+        return self
+
+    def attachment(self, name: str) -> Optional["FileAttachment"]:
+        """Return the named attachment of the file, None if the file has none"""
+        return None
+
+
+@dataclass(frozen=True)
+class FileAttachment:
+    """Small data derived from the content of a file, e.g. a preview image"""
+
+    data: bytes
+    media_type: str
+    etag: str  # Changes whenever the data changes
+
+
+@dataclass
+class _StoredContent:
+    """Content shared by the files with the same content key"""
+
+    file: RegisteredFile  # First file stored with the content
+    references: int = 1
+
+
+@dataclass
+class _Shard:
+    """Files of the channels hashed to one shard, guarded by the shard's own lock"""
+
+    files_per_channel: dict[str, "FilesPerChannel"] = field(default_factory=dict)  # channel_id key
+    expiry_queue: ExpiryQueue[tuple[str, RegisteredFile]] = field(default_factory=ExpiryQueue)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    changed: threading.Condition = field(init=False)  # Notified on every change of a channel
+
+    def __post_init__(self):
+        self.changed = threading.Condition(self.lock)
+
 
 class FileRegister:
     """Manage files available in a channel.
 
     To make polling for files per channel fast, the files are stored in a dictionary instead of a
     flat list. This requires extra house keeping to ensure no empty channel storage is orphaned.
+
+    Channels are hashed to shards with independent locks, so requests for different channels do
+    not queue behind each other. The file ID index and the byte accounting are global and guarded
+    by a separate lock. Locks are always taken in the order shard lock, then global lock.
+
+    Expired files are pruned inline when adding or reading files. Without inline pruning, a
+    background task must call `prune_expired_files` and reads only skip expired files.
+
+    Snapshot versions are drawn from one counter for all channels, so a version is never reused,
+    even if a channel is dropped and filled again. Readers can wait for the next version.
+
+    Files with the same content key share one copy of the content, across channels. The content
+    is reference counted and only unique content counts against the total capacity.
+
+    Listings of the files without their content are published along with the snapshots, so
+    listing and waiting for changes never copies content between processes.
     """
 
     def __init__(
@@ -38,117 +118,409 @@ class FileRegister:
         file_expiration_seconds: int = 300,
         max_total_file_size_bytes: int = 100 * 1024 * 1024,  # 100 MB
         max_random_draws: int = 10,
+        clock: Clock = now_unixutc,
+        inline_pruning: bool = True,
+        shards: int = 1,
+        max_file_size_bytes: Optional[int] = None,
     ):
+        if shards < 1:
+            raise ValueError("At least one shard is required")
         self.max_files_in_channel = max_files_in_channel
         self.file_expiration_seconds = file_expiration_seconds
         self.max_total_size_bytes = max_total_file_size_bytes
+        self.max_file_size_bytes = max_file_size_bytes
         self.max_random_draws_file_id = max_random_draws
+        self.inline_pruning = inline_pruning
+
+        self._shards = [_Shard() for _ in range(shards)]
+        self._file_index: dict[str, tuple[str, RegisteredFile]] = {}  # file_id key
+        self._contents: dict[str, _StoredContent] = {}  # content key
+        self._total_size_bytes = 0  # Size of unique content
+        self._reserved_bytes = 0
+        # Start from the current time, so versions are not reused after a restart
+        self._versions = itertools.count(time.time_ns() // 1000)
+        self._clock = clock
+        self.__global_lock = threading.Lock()  # Guards file index, contents and byte accounting
+
+    def _shard(self, channel_id: str) -> _Shard:
+        """Return the shard holding the channel"""
+        return self._shards[hash(channel_id) % len(self._shards)]
+
+    def add_file(self, channel_id: str, file: RegisteredFile, reserved_bytes: int = 0) -> str:
+        """Add a file to the channel.
+
+        Capacity reserved in advance with `reserve_bytes` is used for the file. The reservation
+        is consumed if the file is added and left to the caller otherwise. A file whose content
+        is already stored shares it and uses no capacity.
+        """
+
+        size_bytes = file.size_bytes()
+        if self.max_file_size_bytes is not None and size_bytes > self.max_file_size_bytes:
+            raise FileRegisterError("File size exceeds limit")
+
+        content_key = file.content_key()
+        extra_bytes = 0
+        if content_key not in self._contents:
+            extra_bytes = max(0, size_bytes - reserved_bytes)
+            if extra_bytes:
+                self.reserve_bytes(extra_bytes)
+
+        shard = self._shard(channel_id)
+        try:
+            with shard.lock:
+                # Perform pruning when adding a new file, or to free slots held by expired files
+                if self.inline_pruning or self._is_channel_full(shard, channel_id):
+                    self._prune_expired_files(shard)
+                if self._is_channel_full(shard, channel_id):
+                    raise FileRegisterError("Cannot add file to channel (max files reached)")
+
+                files_per_channel = shard.files_per_channel.get(channel_id) or FilesPerChannel(
+                    self._versions
+                )
+
+                with self.__global_lock:
+                    file_id = self._generate_unique_file_id()
+                    file = self._reference_content(file, reserved_bytes + extra_bytes)
+                    self._file_index[file_id] = (channel_id, file)
+                    self._reserved_bytes -= reserved_bytes + extra_bytes
+                files_per_channel.add_file(file_id, file)
+                shard.files_per_channel[channel_id] = files_per_channel
+                shard.expiry_queue.push(file.created_at_unixutc, (file_id, file))
+                shard.changed.notify_all()
+        except Exception:
+            if extra_bytes:
+                self.release_bytes(extra_bytes)
+            raise
 
-        self._files_per_channel: dict[str, FilesPerChannel] = {}  # channel_id key
-        self.__files_per_channel_lock = threading.Lock()
-
-    def add_file(self, channel_id: str, file: RegisteredFile) -> str:
-        """Add a file to the channel (slow method)."""
-
-        # Perform pruning when adding a new file
-        self.prune_expired_files()
+        return file_id
 
-        if self.total_size_bytes() + file.size_bytes() > self.max_total_size_bytes:
+    def _is_channel_full(self, shard: _Shard, channel_id: str) -> bool:
+        """Check if the channel holds the maximum number of files, expired ones included"""
+        files_per_channel = shard.files_per_channel.get(channel_id)
+        return (
+            files_per_channel is not None
+            and files_per_channel.number_of_files() >= self.max_files_in_channel
+        )
+
+    def _reference_content(self, file: RegisteredFile, reserved_bytes: int) -> RegisteredFile:
+        """Count a reference to the content of a file, charge the capacity for new content.
+
+        Return the file sharing the stored content (requires the global lock).
+        """
+        content_key = file.content_key()
+        stored = self._contents.get(content_key) if content_key is not None else None
+        if stored is not None:
+            stored.references += 1
+            return file.with_content_of(stored.file)
+
+        size_bytes = file.size_bytes()
+        unreserved_bytes = max(0, size_bytes - reserved_bytes)
+        if (
+            unreserved_bytes  # The content was removed after the check in `add_file`
+            and self._total_size_bytes + self._reserved_bytes + unreserved_bytes
+            > self.max_total_size_bytes
+        ):
             raise FileRegisterError("Total file size exceeds limit")
+        if content_key is not None:
+            self._contents[content_key] = _StoredContent(file)
+        self._total_size_bytes += size_bytes
+        return file
+
+    def _release_content(self, file: RegisteredFile):
+        """Drop a reference to the content of a file, free the capacity of unused content.
+
+        Requires the global lock.
+        """
+        content_key = file.content_key()
+        if content_key is not None:
+            stored = self._contents[content_key]
+            stored.references -= 1
+            if stored.references:
+                return
+            del self._contents[content_key]
+        self._total_size_bytes -= file.size_bytes()
+
+    def reserve_bytes(self, size_bytes: int) -> None:
+        """Reserve capacity for a file that is not complete yet, e.g. while it is uploaded.
+
+        Raises if the total capacity would be exceeded. The reservation must be passed on to
+        `add_file` or returned with `release_bytes`.
+        """
+        if not self._try_reserve_bytes(size_bytes):
+            self.prune_expired_files()  # Free capacity held by expired files
+            if not self._try_reserve_bytes(size_bytes):
+                raise FileRegisterError("Total file size exceeds limit")
+
+    def _try_reserve_bytes(self, size_bytes: int) -> bool:
+        """Reserve capacity. Return False if the total capacity would be exceeded."""
+        with self.__global_lock:
+            if (
+                self._total_size_bytes + self._reserved_bytes + size_bytes
+                > self.max_total_size_bytes
+            ):
+                return False
+            self._reserved_bytes += size_bytes
+            return True
+
+    def release_bytes(self, size_bytes: int):
+        """Release capacity reserved with `reserve_bytes`"""
+        with self.__global_lock:
+            self._reserved_bytes -= size_bytes
+
+    def remaining_capacity_bytes(self) -> int:
+        """Get the capacity that is neither used by files nor reserved"""
+        return max(0, self.max_total_size_bytes - self._total_size_bytes - self._reserved_bytes)
 
-        with self.__files_per_channel_lock:
-            if channel_id not in self._files_per_channel:
-                self._files_per_channel[channel_id] = FilesPerChannel()
-
-            if self._files_per_channel[channel_id].number_of_files() >= self.max_files_in_channel:
-                raise FileRegisterError("Cannot add file to channel (max files reached)")
+    def remove_file(self, file_id: str) -> None:
+        """Remove a file from the channel"""
+        with self.__global_lock:
+            channel_id, _ = self._file_index.get(file_id, (None, None))
+        if channel_id is None:
+            raise FileRegisterError("File ID not found")
 
-            file_id = self._generate_unique_file_id()
-            self._files_per_channel[channel_id].add_file(file_id, file)
+        shard = self._shard(channel_id)
+        with shard.lock:
+            if file_id not in self._file_index:
+                raise FileRegisterError("File ID not found")  # Removed concurrently
+            self._remove_indexed_file(shard, file_id)
 
-        return file_id
+    def update_file(self, file_id: str, /, **changes):
+        """Replace a file by a copy with changed fields and publish a new version of its channel.
 
-    def remove_file(self, file_id: str) -> None:
-        """Remove a file from the channel"""
-        with self.__files_per_channel_lock:
-            for channel in self._files_per_channel.values():
-                if file_id in channel.file_ids():
-                    channel.remove_file(file_id)
-                    return
+        Published snapshots keep the previous file. The content of the file must not change.
+        """
+        with self.__global_lock:
+            channel_id, _ = self._file_index.get(file_id, (None, None))
+        if channel_id is None:
+            raise FileRegisterError("File ID not found")
 
-        raise FileRegisterError("File ID not found")
+        shard = self._shard(channel_id)
+        with shard.lock:
+            if file_id not in self._file_index:
+                raise FileRegisterError("File ID not found")  # Removed concurrently
+            _, file = self._file_index[file_id]
+            updated_file = replace(file, **changes)
+            if (updated_file.size_bytes(), updated_file.content_key()) != (
+                file.size_bytes(),
+                file.content_key(),
+            ):
+                raise FileRegisterError("File updates must not change the content")
+
+            with self.__global_lock:
+                self._file_index[file_id] = (channel_id, updated_file)
+            shard.files_per_channel[channel_id].replace_file(file_id, updated_file)
+            # The entry of the previous file is skipped when it is popped
+            shard.expiry_queue.push(updated_file.created_at_unixutc, (file_id, updated_file))
+            shard.changed.notify_all()
 
     def _generate_unique_file_id(self):
-        """Generate a unique file ID"""
+        """Generate a unique file ID (requires the global lock)"""
         for _ in range(self.max_random_draws_file_id):
             file_id = url_friendly_code(n_chars=16)
-            if file_id in self._all_file_ids():
+            if file_id in self._file_index:
                 continue
             return file_id
         raise FileRegisterError("Failed to generate a unique file ID")
 
-    def _all_file_ids(self):
-        """Get all file IDs in the register"""
-        all_file_ids = []
-        for file_list in self._files_per_channel.values():
-            all_file_ids.extend(file_list.file_ids())
-        return all_file_ids
-
     def prune_expired_files(self):
-        """Check all files and remove expired ones. Leave no orphaned channels."""
-        with self.__files_per_channel_lock:
-            for channel_id in self._files_per_channel:
-                self._prune_expired_files_for_channel(channel_id)
-            self._prune_orphan_channels()
-
-    def _prune_orphan_channels(self):
-        """Remove channels with no files"""
-        for channel_id in list(self._files_per_channel.keys()):
-            if not self._files_per_channel[channel_id].get_files():
-                self._files_per_channel.pop(channel_id)
-
-    def _prune_expired_files_for_channel(self, channel_id):
-        """Prune a list of files for a given channel"""
-        if channel_id not in self._files_per_channel:
-            return
-        for file_id in list(self._files_per_channel[channel_id].file_ids()):
-            if self._is_expired(self._files_per_channel[channel_id].get_file(file_id)):
-                self._files_per_channel[channel_id].remove_file(file_id)
-
-    def _is_expired(self, file: RegisteredFile):
-        """Check if a file is expired"""
-        return file.created_at_unixutc + self.file_expiration_seconds < now_unixutc()
+        """Remove expired files. Leave no orphaned channels."""
+        for shard in self._shards:
+            with shard.lock:
+                self._prune_expired_files(shard)
+
+    def _prune_expired_files(self, shard: _Shard):
+        """Remove files of the shard in order of expiry until the first one that is still valid"""
+        for file_id, file in shard.expiry_queue.pop_older_than(self._expiry_threshold()):
+            if self._file_index.get(file_id, (None, None))[1] is not file:
+                continue  # Removed before expiring
+            self._remove_indexed_file(shard, file_id)
+
+    def _remove_indexed_file(self, shard: _Shard, file_id: str):
+        """Remove a file known to the index. Leave no orphaned channels."""
+        with self.__global_lock:
+            channel_id, file = self._file_index.pop(file_id)
+            self._release_content(file)
+        shard.files_per_channel[channel_id].remove_file(file_id)
+        if not shard.files_per_channel[channel_id].number_of_files():
+            shard.files_per_channel.pop(channel_id)
+        shard.changed.notify_all()
+
+    def _expiry_threshold(self) -> float:
+        """Return the creation time before which files are expired"""
+        return self._clock() - self.file_expiration_seconds
+
+    def snapshot_for_channel(self, channel_id: str) -> "ChannelSnapshot":
+        """Get an immutable snapshot of the valid files in the channel without locking.
+
+        Writers publish a new snapshot on every change, so readers never wait for the lock.
+        The lock is only taken to prune the channel's shard if an expired file is seen.
+        """
+        return self._valid_snapshot(channel_id, listing=False)
+
+    def listing_for_channel(self, channel_id: str) -> "ChannelSnapshot":
+        """Get a snapshot of the listings of the valid files in the channel, see snapshots"""
+        return self._valid_snapshot(channel_id, listing=True)
+
+    def listings_for_channels(self, channel_ids: list[str]) -> list["ChannelSnapshot"]:
+        """Get listings of several channels in one call, in the order of the channel IDs"""
+        return [self.listing_for_channel(channel_id) for channel_id in channel_ids]
+
+    def listing_version_for_channel(self, channel_id: str) -> tuple[int, int]:
+        """Get the version of the channel and its number of valid files, without the files"""
+        snapshot = self.listing_for_channel(channel_id)
+        return snapshot.version, len(snapshot.files)
+
+    def _valid_snapshot(self, channel_id: str, listing: bool) -> "ChannelSnapshot":
+        """Get the snapshot of the files or their listings, without expired files"""
+        shard = self._shard(channel_id)
+        files_per_channel = shard.files_per_channel.get(channel_id)
+        if files_per_channel is None:
+            return ChannelSnapshot.empty()
+
+        snapshot = files_per_channel.listing() if listing else files_per_channel.snapshot()
+        threshold = self._expiry_threshold()
+        if all(file.created_at_unixutc >= threshold for _, file in snapshot.files):
+            return snapshot
+
+        if self.inline_pruning:
+            with shard.lock:
+                self._prune_expired_files(shard)
+        return ChannelSnapshot(
+            version=snapshot.version,
+            files=tuple((i, f) for i, f in snapshot.files if f.created_at_unixutc >= threshold),
+        )
+
+    def snapshots_for_channels(self, channel_ids: list[str]) -> list["ChannelSnapshot"]:
+        """Get snapshots of several channels in one call, in the order of the channel IDs"""
+        return [self.snapshot_for_channel(channel_id) for channel_id in channel_ids]
+
+    def wait_for_channel_change(
+        self, channel_id: str, version: int, timeout_seconds: float
+    ) -> "ChannelSnapshot":
+        """Wait until the channel's version differs from `version` or the timeout passes.
+
+        Return the snapshot of the channel at that point. Callers pass the version of the last
+        snapshot they have seen, so changes between two calls are not missed.
+        """
+        self._wait_for_version_change(channel_id, version, timeout_seconds)
+        return self.snapshot_for_channel(channel_id)
+
+    def wait_for_listing_change(
+        self, channel_id: str, version: int, timeout_seconds: float
+    ) -> "ChannelSnapshot":
+        """Wait like `wait_for_channel_change`, return the listing of the channel"""
+        self._wait_for_version_change(channel_id, version, timeout_seconds)
+        return self.listing_for_channel(channel_id)
+
+    def _wait_for_version_change(self, channel_id: str, version: int, timeout_seconds: float):
+        """Wait until the channel's version differs from `version` or the timeout passes"""
+        shard = self._shard(channel_id)
+        with shard.changed:
+            shard.changed.wait_for(
+                lambda: self._channel_version(shard, channel_id) != version, timeout_seconds
+            )
+
+    @staticmethod
+    def _channel_version(shard: _Shard, channel_id: str) -> int:
+        """Return the version of the channel's latest snapshot, 0 for an empty channel"""
+        files_per_channel = shard.files_per_channel.get(channel_id)
+        return files_per_channel.snapshot().version if files_per_channel else 0
 
     def get_files_for_channel(self, channel_id: str):
         """Get all files in the channel"""
-        with self.__files_per_channel_lock:
-            self._prune_expired_files_for_channel(channel_id)
-            files_per_channel = self._files_per_channel.get(channel_id, FilesPerChannel())
-            return files_per_channel.get_files()
+        return [file for _, file in self.snapshot_for_channel(channel_id).files]
 
     def get_file_ids_for_channel(self, channel_id: str):
         """Get all file IDs in the channel"""
-        with self.__files_per_channel_lock:
-            self._prune_expired_files_for_channel(channel_id)
-            files_per_channel = self._files_per_channel.get(channel_id, FilesPerChannel())
-            return files_per_channel.file_ids()
+        return [file_id for file_id, _ in self.snapshot_for_channel(channel_id).files]
 
     def get_file_for_channel(self, channel_id: str, file_id: str):
-        """Get a file from the channel"""
-        with self.__files_per_channel_lock:
-            self._prune_expired_files_for_channel(channel_id)
-            return self._files_per_channel[channel_id].get_file(file_id)
+        """Get a file from the channel without locking"""
+        indexed_channel_id, file = self._file_index.get(file_id, (None, None))
+        if file is None or indexed_channel_id != channel_id:
+            raise FileRegisterError("File ID not found")
+        if file.created_at_unixutc < self._expiry_threshold():
+            raise FileRegisterError("File ID not found")
+        return file
+
+    def get_attachment_for_channel(
+        self, channel_id: str, file_id: str, name: str
+    ) -> FileAttachment:
+        """Get an attachment of a file from the channel, without the content of the file"""
+        attachment = self.get_file_for_channel(channel_id, file_id).attachment(name)
+        if attachment is None:
+            raise FileRegisterError(f"File has no {name}")
+        return attachment
+
+    def channel_ids(self) -> list[str]:
+        """Get the IDs of all channels holding files"""
+        channel_ids: list[str] = []
+        for shard in self._shards:
+            with shard.lock:
+                channel_ids.extend(shard.files_per_channel.keys())
+        return channel_ids
+
+    def total_size_bytes(self) -> int:
+        """Get the total size of all files in all channels, shared content counts once"""
+        return self._total_size_bytes
+
+    def total_size_bytes_for_channel(self, channel_id: str) -> int:
+        """Get the total size of all files in the channel"""
+        files_per_channel = self._shard(channel_id).files_per_channel.get(
+            channel_id, FilesPerChannel()
+        )
+        return files_per_channel.total_size_bytes()
+
+
+@dataclass(frozen=True)
+class ChannelSnapshot:
+    """Immutable view of the files in a channel.
+
+    The version increases with every change of the channel. Empty channels have version 0.
+    """
+
+    version: int
+    files: tuple[tuple[str, RegisteredFile], ...]  # (file_id, file) in order of addition
 
-    def total_size_bytes(self):
-        """Get the total size of all files in all channels"""
-        return sum(fpc.total_size_bytes() for fpc in self._files_per_channel.values())
+    @classmethod
+    def empty(cls) -> "ChannelSnapshot":
+        """Create a snapshot without files"""
+        return cls(version=0, files=())
 
 
 class FilesPerChannel:
-    """List of files per channel with access by file ID"""
+    """List of files per channel with access by file ID.
 
-    def __init__(self) -> None:
+    Every change publishes a new immutable snapshot (copy-on-write), which can be read without
+    holding the lock that guards the changes.
+    """
+
+    def __init__(self, versions: Optional[Iterator[int]] = None) -> None:
+        """Inits the list of files
+
+        Parameters:
+            versions: Source of increasing snapshot versions, may be shared between lists
+        """
         self._files: dict[str, RegisteredFile] = {}  # file_id key
+        self._listings: dict[str, RegisteredFile] = {}  # file_id key
+        self._total_size_bytes = 0
+        self._versions = versions or itertools.count(1)
+        self._snapshot = ChannelSnapshot.empty()
+        self._listing = ChannelSnapshot.empty()
+
+    def snapshot(self) -> ChannelSnapshot:
+        """Get the latest published snapshot"""
+        return self._snapshot
+
+    def listing(self) -> ChannelSnapshot:
+        """Get the listings of the files of the latest published snapshot"""
+        return self._listing
+
+    def _publish_snapshot(self):
+        """Publish the current files and their listings as a new snapshot"""
+        version = next(self._versions)
+        self._snapshot = ChannelSnapshot(version=version, files=tuple(self._files.items()))
+        self._listing = ChannelSnapshot(version=version, files=tuple(self._listings.items()))
 
     def number_of_files(self) -> int:
         """Get the number of files in the list"""
@@ -159,12 +531,28 @@ class FilesPerChannel:
         if file_id in self._files:
             raise FileRegisterError("File ID already exists")
         self._files.update({file_id: file})
+        self._listings[file_id] = file.listing()
+        self._total_size_bytes += file.size_bytes()
+        self._publish_snapshot()
 
     def remove_file(self, file_id: str):
         """Remove a file from the list"""
         if file_id not in self._files:
             raise FileRegisterError("File ID not found")
-        self._files.pop(file_id)
+        removed_file = self._files.pop(file_id)
+        del self._listings[file_id]
+        self._total_size_bytes -= removed_file.size_bytes()
+        self._publish_snapshot()
+
+    def replace_file(self, file_id: str, file: RegisteredFile):
+        """Replace a file in the list, keeping its position"""
+        if file_id not in self._files:
+            raise FileRegisterError("File ID not found")
+        replaced_file = self._files[file_id]
+        self._files[file_id] = file
+        self._listings[file_id] = file.listing()
+        self._total_size_bytes += file.size_bytes() - replaced_file.size_bytes()
+        self._publish_snapshot()
 
     def get_file(self, file_id: str):
         """Get a file from the list"""
@@ -180,6 +568,6 @@ class FilesPerChannel:
         """Get all file IDs in the list"""
         return self._files.keys()
 
-    def total_size_bytes(self):
+    def total_size_bytes(self) -> int:
         """Get the total size of all files in the list"""
-        return sum(file.size_bytes() for file in self.get_files())
+        return self._total_size_bytes
@@ -1,9 +1,7 @@
 """Utility functions"""
 
 import datetime
-import random
 import secrets
-import string
 
 
 def now_unixutc() -> float:
@@ -11,11 +9,6 @@ def now_unixutc() -> float:
     return datetime.datetime.now(tz=datetime.timezone.utc).timestamp()
 
 
-def human_friendly_pairing_code(n_chars: int = 4) -> str:
-    """Generate a human-friendly pairing code"""
-    return "".join(random.choices(string.digits + string.ascii_lowercase, k=n_chars))
-
-
 def url_friendly_code(n_chars: int = 16) -> str:
     """Generate a URL-friendly code"""
     return secrets.token_urlsafe(n_chars)
@@ -2,8 +2,13 @@
 Test routes of the api backend
 """
 
+import hashlib
 import io
-from dataclasses import dataclass
+import tracemalloc
+from dataclasses import (
+    dataclass,
+    replace,
+)
 from typing import (
     Generator,
     Literal,
@@ -30,6 +35,7 @@ class TestClientHandling:
         """Return the flask app"""
         app = booklink.flask_app.create_app(TestConfig=TestConfig)
         yield app
+        app.service.close()  # type: ignore[attr-defined]
 
     def test_new_client(self, app: flask.Flask):
         """Test new client generation"""
@@ -100,7 +106,7 @@ class TestChannelHandling:
 
         channel_id = channel_res_a["channel_id"]
 
-        return self.AppWithPairedUsersFixture(
+        yield self.AppWithPairedUsersFixture(
             app,
             user_a["client_id"],
             user_a["token"],
@@ -110,6 +116,7 @@ class TestChannelHandling:
             channel_res_a["token"],
             channel_res_b["token"],
         )
+        app.service.close()  # type: ignore[attr-defined]
 
     def test_pair_response(self, app_with_paired_users: AppWithPairedUsersFixture):
         """Test pairing of two clients"""
@@ -202,3 +209,373 @@ class TestChannelHandling:
             assert data[0]["name"] == "test.epub"
             assert data[0]["size"] == 17
             assert data[0]["id"] is not None
+
+    def test_upload_hashed_while_received(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test that the hash computed during the upload is stored with the file"""
+        fixture = app_with_paired_users
+        service = fixture.app.service  # type: ignore[attr-defined]
+
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+            assert upload_res.status_code == 200
+
+        file = service.file_register.get_file_for_channel(
+            fixture.channel_id, upload_res.get_json()["id"]
+        )
+        assert file.content_hash == hashlib.sha256(b"test_file_content").hexdigest()
+
+    def test_download_conditional_and_partial(
+        self, app_with_paired_users: AppWithPairedUsersFixture
+    ):
+        """Test ETag, Range and conditional requests for downloads"""
+        fixture = app_with_paired_users
+
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+            file_id = upload_res.get_json()["id"]
+
+        download_url = (
+            f"/test.epub?channel_id={fixture.channel_id}&client_id={fixture.client_id_b}"
+            f"&token={fixture.channel_token_b}&file_id={file_id}"
+        )
+
+        with fixture.app.test_client() as client:
+            full_res = client.get(download_url)
+            assert full_res.status_code == 200
+            assert full_res.content_length == 17
+            assert full_res.headers["Accept-Ranges"] == "bytes"
+            etag, is_weak = full_res.get_etag()
+            assert etag and not is_weak
+
+            partial_res = client.get(download_url, headers={"Range": "bytes=5-"})
+            assert partial_res.status_code == 206
+            assert partial_res.data == b"file_content"
+            assert partial_res.content_length == 12
+
+            not_modified_res = client.get(download_url, headers={"If-None-Match": f'"{etag}"'})
+            assert not_modified_res.status_code == 304
+            assert not_modified_res.data == b""
+
+            resumed_res = client.get(
+                download_url, headers={"Range": "bytes=5-", "If-Range": f'"{etag}"'}
+            )
+            assert resumed_res.status_code == 206
+            assert resumed_res.data == b"file_content"
+
+            changed_res = client.get(
+                download_url, headers={"Range": "bytes=5-", "If-Range": '"other-etag"'}
+            )
+            assert changed_res.status_code == 200
+            assert changed_res.data == b"test_file_content"
+
+    def test_download_does_not_copy_content(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Given a stored file of several megabytes
+        When it is downloaded in full or in part
+        Then the response streams the stored content without allocating a copy of it
+        """
+        fixture = app_with_paired_users
+        data = bytes(range(256)) * (16 * 1024)
+
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(data), "test.epub")},
+            )
+            file_id = upload_res.get_json()["id"]
+
+        download_url = (
+            f"/test.epub?channel_id={fixture.channel_id}&client_id={fixture.client_id_b}"
+            f"&token={fixture.channel_token_b}&file_id={file_id}"
+        )
+
+        for headers, status_code, expected in [
+            ({}, 200, data),
+            ({"Range": "bytes=1024-"}, 206, data[1024:]),
+        ]:
+            with fixture.app.test_client() as client:
+                tracemalloc.start()
+                try:
+                    res = client.get(download_url, headers=headers, buffered=False)
+                    digest = hashlib.sha256()
+                    for chunk in res.response:
+                        digest.update(chunk)
+                    res.close()
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+
+            assert res.status_code == status_code
+            assert digest.hexdigest() == hashlib.sha256(expected).hexdigest()
+            assert peak < len(data) // 4
+
+    def test_cover(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test that covers are listed and served with long-lived conditional caching"""
+        fixture = app_with_paired_users
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            data = f.read()
+
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(data), "book.epub")},
+            )
+            file_id = upload_res.get_json()["id"]
+        # Wait for the metadata and cover extracted after the upload
+        fixture.app.service.metadata_extractor.shutdown()  # type: ignore[attr-defined]
+
+        cover_url = (
+            f"/api/cover/{fixture.channel_id}/{fixture.client_id_b}/{file_id}"
+            f"?token={fixture.channel_token_b}"
+        )
+        with fixture.app.test_client() as client:
+            files = client.get(
+                f"/api/files/{fixture.channel_id}/{fixture.client_id_b}"
+                f"?token={fixture.channel_token_b}"
+            ).get_json()
+            assert files[0]["has_cover"]
+
+            cover_res = client.get(cover_url)
+            assert cover_res.status_code == 200
+            assert cover_res.mimetype == "image/png"
+            assert cover_res.data.startswith(b"\x89PNG")
+            assert "immutable" in cover_res.headers["Cache-Control"]
+            etag, _ = cover_res.get_etag()
+
+            not_modified_res = client.get(cover_url, headers={"If-None-Match": f'"{etag}"'})
+            assert not_modified_res.status_code == 304
+            assert not_modified_res.data == b""
+
+            missing_res = client.get(cover_url.replace(file_id, "missing"))
+            assert missing_res.status_code == 404
+
+            invalid_token_res = client.get(cover_url.replace(fixture.channel_token_b, "invalid"))
+            assert invalid_token_res.status_code == 401
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            "/api/files/{channel_id}/{client_id}?token=invalid",
+            "/api/wait/files/{channel_id}/{client_id}?token=invalid&timeout=0",
+            "/api/wait/channels_for/{client_id}?token=invalid&timeout=0",
+            "/api/inbox/{client_id}?channel={channel_id}:{token}&channel={channel_id}:invalid",
+            "/api/events/{channel_id}/{client_id}?token=invalid",
+            "/api/files/{channel_id}/{client_id}?token={client_token}",
+        ],
+    )
+    def test_invalid_token(self, app_with_paired_users: AppWithPairedUsersFixture, url: str):
+        """Test that requests with invalid tokens are answered with 401 instead of 500"""
+        fixture = app_with_paired_users
+
+        with fixture.app.test_client() as client:
+            res = client.get(
+                url.format(
+                    channel_id=fixture.channel_id,
+                    client_id=fixture.client_id_b,
+                    token=fixture.channel_token_b,
+                    client_token=fixture.client_token_b,
+                )
+            )
+            assert res.status_code == 401
+
+    @pytest.mark.parametrize(
+        "query",
+        ["", "?token={token}&version=latest", "?token={token}&timeout=soon"],
+        ids=["missing-token", "malformed-version", "malformed-timeout"],
+    )
+    def test_bad_request(self, app_with_paired_users: AppWithPairedUsersFixture, query: str):
+        """Test that long polls with missing or malformed arguments are answered with 400"""
+        fixture = app_with_paired_users
+
+        with fixture.app.test_client() as client:
+            res = client.get(
+                f"/api/wait/files/{fixture.channel_id}/{fixture.client_id_b}"
+                + query.format(token=fixture.channel_token_b)
+            )
+            assert res.status_code == 400
+
+    def test_upload_exceeding_file_size_limit(
+        self, app_with_paired_users: AppWithPairedUsersFixture
+    ):
+        """Test that oversized uploads are rejected and their reservation is released"""
+        fixture = app_with_paired_users
+        service = fixture.app.service  # type: ignore[attr-defined]
+        service.config = replace(service.config, max_file_size_bytes=8)
+        capacity = service.remaining_file_capacity()
+
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+            assert upload_res.status_code == 413
+
+        assert service.remaining_file_capacity() == capacity
+
+    def test_upload_exceeding_capacity(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test that uploads are rejected before they are received if capacity is exhausted"""
+        fixture = app_with_paired_users
+        service = fixture.app.service  # type: ignore[attr-defined]
+        capacity = service.remaining_file_capacity()
+        service.file_register.reserve_bytes(capacity - 10)
+
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+            assert upload_res.status_code == 413
+            assert upload_res.get_json()["error"] == "Not enough capacity for file"
+
+        service.release_file_capacity(capacity - 10)
+        with fixture.app.test_client() as client:
+            upload_res = client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+            assert upload_res.status_code == 200
+
+        assert service.remaining_file_capacity() == capacity - 17
+
+    def test_long_poll_files(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test waiting for files with a version cursor"""
+        fixture = app_with_paired_users
+        wait_url = (
+            f"/api/wait/files/{fixture.channel_id}/{fixture.client_id_b}"
+            f"?token={fixture.channel_token_b}"
+        )
+
+        with fixture.app.test_client() as client:
+            empty_res = client.get(f"{wait_url}&version=0&timeout=0.01")
+            assert empty_res.status_code == 200
+            assert empty_res.get_json() == {"version": 0, "files": []}
+
+            client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+
+            update_res = client.get(f"{wait_url}&version=0&timeout=5")
+            update = update_res.get_json()
+            assert update["version"] != 0
+            assert [f["name"] for f in update["files"]] == ["test.epub"]
+
+    def test_long_poll_channels(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test waiting for channels with a version cursor"""
+        fixture = app_with_paired_users
+
+        with fixture.app.test_client() as client:
+            res = client.get(
+                f"/api/wait/channels_for/{fixture.client_id_b}"
+                f"?token={fixture.client_token_b}&version=0&timeout=5"
+            )
+            assert res.status_code == 200
+            update = res.get_json()
+            assert update["version"] != 0
+            assert update["channels"] == [
+                {"channel_id": fixture.channel_id, "token": fixture.channel_token_b}
+            ]
+
+    def test_channel_events(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test the event stream of a channel"""
+        fixture = app_with_paired_users
+        service = fixture.app.service  # type: ignore[attr-defined]
+        service.channel_subscribers.max_subscribers_per_channel = 1
+        events_url = (
+            f"/api/events/{fixture.channel_id}/{fixture.client_id_b}"
+            f"?token={fixture.channel_token_b}"
+        )
+
+        with fixture.app.test_client() as client:
+            res = client.get(events_url, buffered=False)
+            assert res.status_code == 200
+            assert res.mimetype == "text/event-stream"
+            first_event = next(res.response)
+            assert first_event.startswith(b"id: 0\nevent: snapshot\n")
+            assert b'"files": []' in first_event
+
+            rejected_res = fixture.app.test_client().get(events_url, buffered=False)
+            assert rejected_res.status_code == 429
+
+            res.close()
+            reconnected_res = fixture.app.test_client().get(events_url, buffered=False)
+            assert reconnected_res.status_code == 200
+            reconnected_res.close()
+
+    def test_conditional_polling(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test ETag and 304 Not Modified on the polling endpoints"""
+        fixture = app_with_paired_users
+        files_url = (
+            f"/api/files/{fixture.channel_id}/{fixture.client_id_b}?token={fixture.channel_token_b}"
+        )
+        channels_url = f"/api/channels_for/{fixture.client_id_b}?token={fixture.client_token_b}"
+
+        with fixture.app.test_client() as client:
+            for url in (files_url, channels_url):
+                res = client.get(url)
+                assert res.status_code == 200
+                etag, _ = res.get_etag()
+                assert etag
+
+                not_modified_res = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+                assert not_modified_res.status_code == 304
+                assert not_modified_res.data == b""
+
+            files_etag, _ = client.get(files_url).get_etag()
+            client.post(
+                f"/api/upload/{fixture.channel_id}/{fixture.client_id_a}"
+                f"?token={fixture.channel_token_a}",
+                data={"file": (io.BytesIO(b"test_file_content"), "test.epub")},
+            )
+            changed_res = client.get(files_url, headers={"If-None-Match": f'"{files_etag}"'})
+            assert changed_res.status_code == 200
+            assert len(changed_res.get_json()) == 1
+
+    def test_inbox(self, app_with_paired_users: AppWithPairedUsersFixture):
+        """Test getting the files of several channels of an e-reader at once"""
+        fixture = app_with_paired_users
+        service = fixture.app.service  # type: ignore[attr-defined]
+        pairing_code_b = next(
+            code
+            for code, client in service.pairing_register.all_clients_in_pairing.items()
+            if client.id == fixture.client_id_b
+        )
+        sender = service.new_client("Sender")
+        service.new_channel_using_code(sender.id, sender.token, pairing_code_b)
+        channels = service.channels_for_client(fixture.client_id_b, fixture.client_token_b)
+        for channel in channels:
+            service.store_file_for_channel(
+                channel.id, fixture.client_id_b, channel.token, f"{channel.id}.epub", b"content"
+            )
+
+        inbox_url = f"/api/inbox/{fixture.client_id_b}?" + "&".join(
+            f"channel={c.id}:{c.token}" for c in channels
+        )
+        with fixture.app.test_client() as client:
+            res = client.get(inbox_url)
+            assert res.status_code == 200
+            assert [(f["channel_id"], f["name"]) for f in res.get_json()] == [
+                (c.id, f"{c.id}.epub") for c in channels
+            ]
+
+            etag, _ = res.get_etag()
+            not_modified_res = client.get(inbox_url, headers={"If-None-Match": f'"{etag}"'})
+            assert not_modified_res.status_code == 304
+
+            assert client.get(f"/api/inbox/{fixture.client_id_b}").status_code == 400
+            assert (
+                client.get(f"/api/inbox/{fixture.client_id_b}?channel=no-token").status_code == 400
+            )
@@ -13,6 +13,7 @@ class TestClientHandling:
         """Return the flask app"""
         app = booklink.flask_app.create_app()
         yield app
+        app.service.close()
 
     def test_landing_page(self, app):
         """Test getting the landing page"""
@@ -29,6 +30,7 @@ class TestClientHandling:
             assert res.status_code == 200
             assert res.content_type == "text/html; charset=utf-8"
             assert b"Enter Pairing Code" in res.data
+            assert b"maxlength" not in res.data  # Codes grow longer as more are in use
 
     def test_pair_ereader(self, app):
         """Test getting the pairing page for e-reader"""
@@ -0,0 +1,55 @@
+"""
+Test receiving uploaded files
+"""
+
+import hashlib
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from booklink.ebookfile import InMemoryEbookFile
+from booklink.flask_app.uploads import BoundedUploadBuffer
+
+
+class TestBoundedUploadBuffer:
+    """Test the BoundedUploadBuffer class"""
+
+    def test_hashed_while_written(self):
+        """Content written chunk by chunk is hashed on the way"""
+        buffer = BoundedUploadBuffer(max_size_bytes=16)
+        buffer.write(b"test_")
+        buffer.write(b"content")
+
+        assert buffer.content_hash() == hashlib.sha256(b"test_content").hexdigest()
+
+    def test_no_hash_for_unordered_writes(self):
+        """Content that is not written in order has no hash"""
+        buffer = BoundedUploadBuffer()
+        buffer.write(b"content")
+        buffer.seek(0)
+        buffer.write(b"C")
+
+        assert buffer.content_hash() == ""
+
+    def test_size_limit(self):
+        """Writing beyond the size limit is rejected"""
+        buffer = BoundedUploadBuffer(max_size_bytes=4)
+        with pytest.raises(RequestEntityTooLarge):
+            buffer.write(b"content")
+
+    def test_content_shared_with_stored_file(self):
+        """Given an upload written chunk by chunk into a buffer with spare capacity
+        When a file is made from the buffer after hashing it
+        Then the file holds the buffer's own bytes instead of a copy
+        """
+        buffer = BoundedUploadBuffer()
+        for _ in range(100):
+            buffer.write(b"x" * 1000)
+        content_hash = buffer.content_hash()
+
+        file = InMemoryEbookFile.make(
+            name="book.txt", data=buffer, extract_metadata=False, content_hash=content_hash
+        )
+
+        assert file.size_bytes() == 100_000
+        assert buffer.getvalue() is file.data
@@ -1,4 +1,7 @@
+import dataclasses
+import hashlib
 import io
+import time
 from typing import Generator
 
 import pytest
@@ -6,9 +9,13 @@ import pytest
 from booklink.application_service import (
     ApplicationService,
     ApplicationServiceConfig,
+    ChannelCredentials,
     ChannelResponse,
     ClientResponse,
 )
+from booklink.channel_events import TooManySubscribersError
+from booklink.security import AuthenticationError
+from booklink.storage import FileRegisterError
 
 
 class TestApplicationService:
@@ -90,6 +97,136 @@ class TestApplicationService:
             channel.id, client_a.id, channel.token, "test.epub", io.BytesIO(b"test_file_content")
         )
 
+    def test_metadata_extracted_after_upload(self, app_config: ApplicationServiceConfig):
+        """Given a service extracting metadata in a worker pool
+        When an epub is uploaded
+        Then the file is listed at once and its title is filled in later
+        """
+        app = ApplicationService(dataclasses.replace(app_config, metadata_workers=1))
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            data = f.read()
+
+        app.store_file_for_channel(channel.id, client_a.id, channel.token, "book.epub", data)
+        listed = app.wait_for_files_for_channel(channel.id, client_a.id, channel.token, 0, 0)
+        assert [f.name for f in listed.files] == ["book.epub"]
+
+        deadline = time.monotonic() + 30
+        while not listed.files[0].title and time.monotonic() < deadline:
+            listed = app.wait_for_files_for_channel(
+                channel.id, client_a.id, channel.token, listed.version, 1
+            )
+        assert listed.files[0].title.startswith("Frankenstein")
+        assert app.metadata_stats().completed == 1
+        app.close()
+
+    def test_metadata_pool_started_on_first_store(self, app_config: ApplicationServiceConfig):
+        """Given a service configured to extract metadata in a worker pool
+        When no file was stored yet
+        Then no pool is started and closing the service does not start one
+        """
+        app = ApplicationService(dataclasses.replace(app_config, metadata_workers=1))
+        app.new_client("Alice")
+
+        app.close()
+
+        assert app._metadata_extractor is None  # pylint: disable=protected-access
+
+    def test_store_with_shut_down_extractor(self, app_config: ApplicationServiceConfig):
+        """Given a metadata pool that rejects work
+        When an epub is stored
+        Then it is stored with its metadata and consumes its reservation once
+        """
+        app = ApplicationService(dataclasses.replace(app_config, metadata_workers=1))
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            data = f.read()
+        app.metadata_extractor.shutdown()
+        app.reserve_file_capacity(channel.id, client_a.id, channel.token, len(data))
+
+        app.store_file_for_channel(
+            channel.id, client_a.id, channel.token, "book.epub", data, reserved_bytes=len(data)
+        )
+
+        files = app.get_files_for_channel(channel.id, client_a.id, channel.token)
+        assert files[0].title.startswith("Frankenstein")
+        assert app.remaining_file_capacity() == app_config.total_file_capacity_bytes - len(data)
+        app.close()
+
+    def test_store_same_content_twice(self, app: ApplicationService):
+        """Given an epub stored in one channel
+        When the same content is stored in another channel
+        Then it is stored once and its metadata is not extracted again
+        """
+        client_a = app.new_client("Alice")
+        channels = [
+            app.new_channel_using_code(
+                client_a.id, client_a.token, app.new_client("E-Reader").pairing_code
+            )
+            for _ in range(2)
+        ]
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            data = f.read()
+
+        for channel in channels:
+            app.store_file_for_channel(channel.id, client_a.id, channel.token, "book.epub", data)
+
+        assert app.file_register.total_size_bytes() == len(data)
+        assert (app.metadata_cache.hits, len(app.metadata_cache)) == (1, 1)
+        for channel in channels:
+            files = app.get_files_for_channel(channel.id, client_a.id, channel.token)
+            assert files[0].title.startswith("Frankenstein")
+
+    def test_get_cover(self, app: ApplicationService):
+        """Given an epub with a cover image
+        When it is stored
+        Then its listing shows the cover and the cover is served from the extracted metadata
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            data = f.read()
+
+        file_id = app.store_file_for_channel(
+            channel.id, client_a.id, channel.token, "book.epub", data
+        )
+        text_id = app.store_file_for_channel(
+            channel.id, client_a.id, channel.token, "notes.txt", b"notes"
+        )
+
+        files = app.get_files_for_channel(channel.id, client_a.id, channel.token)
+        assert {f.name: f.has_cover for f in files} == {"book.epub": True, "notes.txt": False}
+        cover = app.get_cover(channel.id, client_a.id, channel.token, file_id)
+        assert cover.data.startswith(b"\x89PNG")
+        assert cover.media_type == "image/png"
+        assert cover.etag == f"{hashlib.sha256(data).hexdigest()}-cover"
+        with pytest.raises(FileRegisterError):
+            app.get_cover(channel.id, client_a.id, channel.token, text_id)
+
+    def test_channel_tokens_minted_once(self, app: ApplicationService, monkeypatch):
+        """Given a channel created for an e-reader
+        When the e-reader polls its channels repeatedly
+        Then the token minted at creation is returned without signing again
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+
+        def fail_minting(*args, **kwargs):
+            raise AssertionError("Channel token minted again")
+
+        monkeypatch.setattr(app.channel_auth, "token", fail_minting)
+        first_poll = app.channels_for_client(client_b.id, client_b.token)
+        second_poll = app.channels_for_client(client_b.id, client_b.token)
+
+        assert first_poll == second_poll
+        app.verify_channel_claim(first_poll[0].id, client_b.id, first_poll[0].token)
+
     def test_get_files_for_channel(self, app: ApplicationService):
         """Test retrieving files for a channel"""
         client_a = app.new_client("Alice")
@@ -112,6 +249,163 @@ class TestApplicationService:
         files = app.get_files_for_channel(channel_for_b.id, client_b.id, channel_for_b.token)
         assert len(files) == 3
 
+    def test_get_files_for_channel_single_pass(self, app: ApplicationService):
+        """Given a channel with several files
+        When listing the files
+        Then the token is verified once and no file content is attached
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+        for i in range(3):
+            app.store_file_for_channel(
+                channel.id, client_a.id, channel.token, f"test_{i}.epub", b"test_file_content"
+            )
+
+        validations_before = app.channel_auth.cache_hits + app.channel_auth.cache_misses
+        files = app.get_files_for_channel(channel.id, client_a.id, channel.token)
+        validations = app.channel_auth.cache_hits + app.channel_auth.cache_misses
+
+        assert validations - validations_before == 1
+        assert [f.name for f in files] == [f"test_{i}.epub" for i in range(3)]
+        assert all(f.data is None for f in files)
+        assert all(f.size == len(b"test_file_content") for f in files)
+
+    def test_wait_for_files_for_channel(self, app: ApplicationService):
+        """Given the version of the files last seen
+        When waiting for files of a channel
+        Then changes since that version are returned without waiting
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+
+        empty = app.wait_for_files_for_channel(channel.id, client_a.id, channel.token, 0, 0)
+        assert empty.files == []
+
+        app.store_file_for_channel(channel.id, client_a.id, channel.token, "a.epub", b"content")
+        update = app.wait_for_files_for_channel(
+            channel.id, client_a.id, channel.token, empty.version, 5
+        )
+        assert update.version != empty.version
+        assert [f.name for f in update.files] == ["a.epub"]
+
+    def test_wait_for_channels_for_client(self, app: ApplicationService):
+        """Given an e-reader that has not seen any channel
+        When a sender pairs with it
+        Then waiting returns the new channel with a usable token
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+
+        update = app.wait_for_channels_for_client(client_b.id, client_b.token, 0, 5)
+        assert update.version != 0
+        assert len(update.channels) == 1
+        app.verify_channel_claim(update.channels[0].id, client_b.id, update.channels[0].token)
+
+    def test_channel_events(self, app: ApplicationService):
+        """Given a subscriber of a channel
+        When files are added and removed
+        Then a snapshot followed by the changes is streamed
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+        app.store_file_for_channel(channel.id, client_a.id, channel.token, "a.epub", b"content")
+
+        stream = app.channel_events(channel.id, client_a.id, channel.token, heartbeat_seconds=0)
+        events = iter(stream)
+        snapshot = next(events)
+        assert snapshot is not None
+        assert (snapshot.kind, [f.name for f in snapshot.files]) == ("snapshot", ["a.epub"])
+        assert next(events) is None  # Heartbeat
+
+        file_id = app.store_file_for_channel(
+            channel.id, client_a.id, channel.token, "b.epub", b"content"
+        )
+        added = next(events)
+        assert added is not None
+        assert (added.kind, [f.id for f in added.files]) == ("add", [file_id])
+
+        app.remove_file(channel.id, client_a.id, channel.token, file_id)
+        removed = next(events)
+        assert removed is not None
+        assert (removed.kind, [f.id for f in removed.files]) == ("remove", [file_id])
+
+        stream.close()
+        assert app.channel_subscribers.subscribers(channel.id) == 0
+
+    def test_channel_events_subscriber_limit(self, app_config: ApplicationServiceConfig):
+        """Given a channel with the maximum number of subscribers
+        When another client subscribes
+        Then it is rejected
+        """
+        app = ApplicationService(dataclasses.replace(app_config, max_subscribers_per_channel=1))
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+
+        stream = app.channel_events(channel.id, client_a.id, channel.token, heartbeat_seconds=0)
+        with pytest.raises(TooManySubscribersError):
+            app.channel_events(channel.id, client_a.id, channel.token, heartbeat_seconds=0)
+
+        stream.close()
+        app.channel_events(channel.id, client_a.id, channel.token, heartbeat_seconds=0).close()
+
+    def test_files_version_changes_on_expiry(self, app_config: ApplicationServiceConfig):
+        """Given a file that expired but was not pruned yet
+        When getting the version of the channel's files
+        Then the version differs from the one before the file expired
+        """
+        app = ApplicationService(dataclasses.replace(app_config, reaper_interval=60))
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+        app.store_file_for_channel(channel.id, client_a.id, channel.token, "a.epub", b"content")
+
+        version = app.files_version_for_channel(channel.id, client_a.id, channel.token)
+        app.file_register.file_expiration_seconds = -1
+        assert app.files_version_for_channel(channel.id, client_a.id, channel.token) != version
+        app.close()
+
+    def test_get_inbox(self, app: ApplicationService):
+        """Given an e-reader paired with two senders
+        When getting the inbox with the credentials of both channels
+        Then the files of both channels are merged in order of expiry
+        """
+        ereader = app.new_client("E-Reader")
+        senders = [app.new_client("Alice"), app.new_client("Bob")]
+        for sender in senders:
+            app.new_channel_using_code(sender.id, sender.token, ereader.pairing_code)
+        channels = app.channels_for_client(ereader.id, ereader.token)
+        for i, channel in enumerate(channels * 2):
+            app.store_file_for_channel(
+                channel.id, ereader.id, channel.token, f"test_{i}.epub", b"content"
+            )
+
+        credentials = [ChannelCredentials(c.id, c.token) for c in channels]
+        inbox = app.get_inbox(ereader.id, credentials)
+
+        assert [f.file.name for f in inbox.files] == [f"test_{i}.epub" for i in range(4)]
+        assert [f.channel_id for f in inbox.files] == [c.id for c in channels * 2]
+        assert app.get_inbox(ereader.id, credentials).version == inbox.version
+
+        app.remove_file(channels[1].id, ereader.id, channels[1].token, inbox.files[1].file.id)
+        assert app.get_inbox(ereader.id, credentials).version != inbox.version
+
+    def test_get_inbox_invalid_credentials(self, app: ApplicationService):
+        """Given credentials of a channel of another client
+        When getting the inbox
+        Then access is denied
+        """
+        client_a = app.new_client("Alice")
+        client_b = app.new_client("Bob")
+        channel = app.new_channel_using_code(client_a.id, client_a.token, client_b.pairing_code)
+
+        with pytest.raises(AuthenticationError):
+            app.get_inbox(client_b.id, [ChannelCredentials(channel.id, channel.token)])
+
     def test_get_file(self, app: ApplicationService):
         """Test retrieving a file"""
         client_a = app.new_client("Alice")
@@ -132,4 +426,18 @@ class TestApplicationService:
 
         file = app.get_file(channel_for_b.id, client_b.id, channel_for_b.token, file_id)
         assert file.name == "test.epub"
+        assert file.data is not None
         assert file.data.read() == b"test_file_content"
+
+    def test_background_reaper(self, app_config: ApplicationServiceConfig):
+        """Given a reaper interval
+        When the service is created
+        Then expired data is evicted in the background until the service is closed
+        """
+        app = ApplicationService(dataclasses.replace(app_config, reaper_interval=60))
+        assert app.reaper is not None
+        assert app.reaper.is_running()
+        assert not app.file_register.inline_pruning
+
+        app.close()
+        assert not app.reaper.is_running()
@@ -0,0 +1,96 @@
+"""Test events about the files of a channel"""
+
+from dataclasses import dataclass
+
+import pytest
+
+from booklink.channel_events import (
+    SubscriberLimit,
+    TooManySubscribersError,
+    file_events,
+)
+from booklink.storage import (
+    ChannelSnapshot,
+    RegisteredFile,
+)
+
+
+@dataclass
+class DummyFile(RegisteredFile):
+    """Dummy file class for testing"""
+
+    def size_bytes(self) -> int:
+        """Return the size of the file in bytes"""
+        return 1
+
+
+class TestFileEvents:
+    """Test deriving file events from snapshots"""
+
+    def test_added_removed_and_expired_files(self):
+        """Given two snapshots of a channel
+        When comparing them
+        Then new files are added and missing ones are removed or expired
+        """
+        kept, removed, expired, added = (DummyFile(created_at_unixutc=t) for t in (5, 5, 1, 6))
+        old = ChannelSnapshot(version=1, files=(("k", kept), ("r", removed), ("e", expired)))
+        new = ChannelSnapshot(version=3, files=(("k", kept), ("a", added)))
+
+        events = file_events(old, new, expiry_threshold=2)
+
+        assert [(e.kind, e.file_id, e.version) for e in events] == [
+            ("remove", "r", 3),
+            ("expire", "e", 3),
+            ("add", "a", 3),
+        ]
+
+    def test_no_events_for_equal_snapshots(self):
+        """Given the same snapshot twice
+        When comparing them
+        Then there are no events
+        """
+        snapshot = ChannelSnapshot(version=1, files=(("k", DummyFile(created_at_unixutc=5)),))
+        assert file_events(snapshot, snapshot, expiry_threshold=0) == []
+
+    def test_updated_files(self):
+        """Given a file that was replaced by a changed copy
+        When comparing the snapshots
+        Then the file is updated
+        """
+        old = ChannelSnapshot(version=1, files=(("k", DummyFile(created_at_unixutc=5)),))
+        new = ChannelSnapshot(version=2, files=(("k", DummyFile(created_at_unixutc=6)),))
+
+        events = file_events(old, new, expiry_threshold=0)
+
+        assert [(e.kind, e.file_id, e.version) for e in events] == [("update", "k", 2)]
+
+
+class TestSubscriberLimit:
+    """Test limiting the subscribers per channel"""
+
+    def test_limit_per_channel(self):
+        """Given a channel with the maximum number of subscribers
+        When another subscriber comes
+        Then it is rejected until a subscriber leaves
+        """
+        limit = SubscriberLimit(max_subscribers_per_channel=2)
+        limit.acquire("channel")
+        limit.acquire("channel")
+        limit.acquire("other-channel")
+
+        with pytest.raises(TooManySubscribersError):
+            limit.acquire("channel")
+
+        limit.release("channel")
+        limit.acquire("channel")
+        assert limit.subscribers("channel") == 2
+
+    def test_release_all(self):
+        """Given subscribers of a channel
+        When all leave
+        Then the channel is no longer tracked
+        """
+        limit = SubscriberLimit(max_subscribers_per_channel=2)
+        limit.acquire("channel")
+        limit.release("channel")
+        assert limit.subscribers("channel") == 0
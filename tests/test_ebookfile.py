@@ -2,7 +2,10 @@ import io
 
 import pytest
 
-from booklink.ebookfile import InMemoryEbookFile
+from booklink.ebookfile import (
+    InMemoryEbookFile,
+    MetaDataFactory,
+)
 
 
 class TestInMemoryEbookFile:
@@ -21,3 +24,80 @@ class TestInMemoryEbookFile:
         assert epub.metadata.title.startswith("Frankenstein")
         assert epub.metadata.author == "Mary Wollstonecraft Shelley"
         assert epub.size_bytes() > 0
+
+    def test_independent_readers(self, epub):
+        """Readers do not share their read position"""
+        reader_a = epub.open()
+        reader_b = epub.open()
+
+        assert reader_a.read(4) == b"PK\x03\x04"
+        assert reader_b.read() == epub.data
+        assert reader_a.read() == epub.data[4:]
+
+    def test_reader_seek(self, epub):
+        """Readers seek like files and read nothing past the end"""
+        reader = epub.open()
+
+        assert reader.seek(-4, io.SEEK_END) == epub.size_bytes() - 4
+        assert reader.read(10) == epub.data[-4:]
+        assert reader.read(10) == b""
+        assert reader.seek(2) == 2
+        assert reader.read(2) == epub.data[2:4]
+
+    def test_make_from_bytes(self):
+        """Files can be created from immutable bytes"""
+        file = InMemoryEbookFile.make(name="book.txt", data=b"content")
+
+        assert file.data == b"content"
+        assert file.size_bytes() == 7
+        assert file.metadata is None
+
+    def test_shared_content(self):
+        """Files with the same content hash share their data"""
+        first = InMemoryEbookFile.make(name="a.txt", data=b"content")
+        second = InMemoryEbookFile.make(name="b.txt", data=bytes(bytearray(b"content")))
+        other = InMemoryEbookFile.make(name="c.txt", data=b"other")
+
+        assert second.content_key() == first.content_key()
+        assert second.with_content_of(first).data is first.data
+        assert second.with_content_of(first).name == "b.txt"
+        assert other.with_content_of(first) is other
+
+    def test_make_with_content_hash(self):
+        """A content hash computed in advance is kept"""
+        file = InMemoryEbookFile.make(name="book.txt", data=b"content", content_hash="abc")
+        assert file.content_hash == "abc"
+
+    def test_read_kepub_metadata(self):
+        """KEPUB files are read like EPUB files"""
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            file = InMemoryEbookFile.make(name="frankenstein.kepub", data=f.read())
+
+        assert file.metadata.title.startswith("Frankenstein")
+
+    def test_unreadable_metadata(self):
+        """Files of supported formats with unreadable headers have no metadata"""
+        for name in ("book.mobi", "book.azw", "book.pdf", "book.epub"):
+            assert MetaDataFactory.supports(name)
+            assert InMemoryEbookFile.make(name=name, data=b"content").metadata is None
+        assert not MetaDataFactory.supports("book.txt")
+
+    def test_listing(self, epub):
+        """Listings keep size and metadata, but neither the content nor the cover"""
+        listing = epub.listing()
+
+        assert listing.size_bytes() == epub.size_bytes()
+        assert listing.metadata.title == epub.metadata.title
+        assert listing.metadata.cover == b""
+        assert listing.has_cover
+        assert listing.created_at_unixutc == epub.created_at_unixutc
+
+    def test_cover_attachment(self, epub):
+        """The cover is attached with an ETag derived from the content hash"""
+        cover = epub.attachment("cover")
+
+        assert cover.data == epub.metadata.cover
+        assert cover.media_type == "image/png"
+        assert cover.etag == f"{epub.content_hash}-cover"
+        assert epub.attachment("thumbnail") is None
+        assert InMemoryEbookFile.make(name="book.txt", data=b"content").attachment("cover") is None
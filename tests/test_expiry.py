@@ -0,0 +1,33 @@
+"""Test deadline-ordered expiry"""
+
+from booklink.expiry import ExpiryQueue
+
+
+class TestExpiryQueue:
+    """Test the ExpiryQueue class"""
+
+    def test_pop_in_timestamp_order(self):
+        """Keys are popped in order of their timestamps"""
+        queue = ExpiryQueue()
+        for timestamp, key in [(3, "c"), (1, "a"), (2, "b")]:
+            queue.push(timestamp, key)
+
+        assert list(queue.pop_older_than(10)) == ["a", "b", "c"]
+        assert len(queue) == 0
+
+    def test_pop_only_due_keys(self):
+        """Keys at or after the threshold remain in the queue"""
+        queue = ExpiryQueue()
+        for timestamp in range(5):
+            queue.push(timestamp, timestamp)
+
+        assert list(queue.pop_older_than(2)) == [0, 1]
+        assert len(queue) == 3
+
+    def test_equal_timestamps_keep_insertion_order(self):
+        """Keys with equal timestamps need not be comparable"""
+        queue = ExpiryQueue()
+        queue.push(0, {"first": 1})
+        queue.push(0, {"second": 2})
+
+        assert list(queue.pop_older_than(1)) == [{"first": 1}, {"second": 2}]
@@ -0,0 +1,134 @@
+"""Test extracting metadata in a pool of workers"""
+
+import threading
+
+import pytest
+
+from booklink.ebookfile import BookMetadata
+from booklink.metadata_extraction import (
+    MetadataCache,
+    MetadataExtractor,
+)
+
+
+@pytest.fixture(scope="module")
+def epub_data() -> bytes:
+    """Return the content of a test epub file"""
+    with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+        return f.read()
+
+
+class TestMetadataExtractor:
+    """Test the MetadataExtractor class"""
+
+    @pytest.mark.parametrize("executor", ["thread", "process"])
+    def test_extract(self, epub_data, executor):
+        """Given an extractor with a pool of workers
+        When extracting the metadata of an epub
+        Then the callback receives the metadata and the timings are recorded
+        """
+        extractor = MetadataExtractor(workers=1, executor=executor)
+        results = []
+        done = threading.Event()
+
+        def on_done(metadata):
+            results.append(metadata)
+            done.set()
+
+        extractor.extract("frankenstein.epub", epub_data, on_done)
+        assert done.wait(30)
+        extractor.shutdown()
+
+        assert results[0].title.startswith("Frankenstein")
+        stats = extractor.stats()
+        assert (stats.submitted, stats.completed, stats.failed, stats.pending) == (1, 1, 0, 0)
+        assert stats.total_extraction_seconds > 0
+        assert stats.max_extraction_seconds == stats.total_extraction_seconds
+
+    def test_extract_inline_when_saturated(self, epub_data):
+        """Given an extractor whose pending extractions are at the limit
+        When extracting another file
+        Then it is extracted on the calling thread
+        """
+        extractor = MetadataExtractor(workers=1, max_pending=1)
+        handling, unblock = threading.Event(), threading.Event()
+        results = []
+
+        def on_blocking_done(_):
+            handling.set()
+            unblock.wait(30)
+
+        threading.Thread(
+            target=extractor.extract, args=("blocking.epub", epub_data, on_blocking_done)
+        ).start()
+        assert handling.wait(30)
+        extractor.extract("frankenstein.epub", epub_data, results.append)
+
+        assert results[0].title.startswith("Frankenstein")  # Done before returning
+        assert extractor.stats().inline == 1
+        assert extractor.stats().pending == 1
+
+        unblock.set()
+        extractor.shutdown()
+        assert extractor.stats().pending == 0
+
+    def test_extract_inline_when_shut_down(self, epub_data):
+        """Given a pool that rejects work
+        When extracting metadata
+        Then it is extracted on the calling thread instead of raising
+        """
+        extractor = MetadataExtractor(workers=1)
+        extractor.shutdown()
+        results = []
+
+        extractor.extract("frankenstein.epub", epub_data, results.append)
+
+        assert results[0].title.startswith("Frankenstein")
+        stats = extractor.stats()
+        assert (stats.failed, stats.inline, stats.pending) == (1, 1, 0)
+
+    def test_invalid_configuration(self):
+        """An extractor needs workers and room for pending extractions"""
+        with pytest.raises(ValueError):
+            MetadataExtractor(workers=0)
+        with pytest.raises(ValueError):
+            MetadataExtractor(workers=1, max_pending=0)
+        with pytest.raises(ValueError):
+            MetadataExtractor(workers=1, executor="fiber")  # type: ignore[arg-type]
+
+
+class TestMetadataCache:
+    """Test the MetadataCache class"""
+
+    def test_least_recently_used_evicted(self):
+        """Given a full cache
+        When caching more metadata
+        Then the least recently used metadata is evicted
+        """
+        cache = MetadataCache(max_entries=2)
+        cache.put("a", BookMetadata.empty())
+        cache.put("b", BookMetadata.empty())
+        assert cache.get("a") is not None
+
+        cache.put("c", BookMetadata.empty())
+
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_cover_bytes_bounded(self):
+        """Metadata is evicted when the cached cover images exceed their size limit"""
+        cache = MetadataCache(max_entries=10, max_cover_bytes=100)
+        cache.put("a", BookMetadata("A", "", "", "", "", cover=b"x" * 60))
+        cache.put("b", BookMetadata("B", "", "", "", "", cover=b"x" * 60))
+
+        assert cache.get("a") is None
+        assert cache.get("b") is not None
+        assert cache.cover_bytes == 60
+
+    def test_disabled(self):
+        """A cache without entries caches nothing"""
+        cache = MetadataCache(max_entries=0)
+        cache.put("a", BookMetadata.empty())
+        assert cache.get("a") is None
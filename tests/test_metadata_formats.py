@@ -0,0 +1,407 @@
+"""Test reading metadata from the headers of ebook formats"""
+
+import io
+import struct
+import zipfile
+import zlib
+from typing import Optional
+
+import pytest
+
+from booklink.metadata_formats import (
+    EpubLimits,
+    MetadataFormatError,
+    read_epub_metadata,
+    read_mobi_metadata,
+    read_pdf_metadata,
+)
+
+CONTAINER = b"""<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+
+def make_opf(
+    metadata: bytes, doctype: bytes = b"", padding: int = 0, manifest: bytes = b""
+) -> bytes:
+    """Generate a package document with the given metadata, manifest and guide elements"""
+    return (
+        b'<?xml version="1.0"?>\n'
+        + doctype
+        + b'<package xmlns="http://www.idpf.org/2007/opf" version="2.0">'
+        + b'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        + metadata
+        + b"</metadata>"
+        + manifest
+        + b"<!--"
+        + b" " * padding
+        + b"-->"
+        + b"</package>"
+    )
+
+
+def make_epub(
+    opf: bytes,
+    chapters: int = 0,
+    chapter_bytes: int = 0,
+    members: Optional[dict[str, bytes]] = None,
+) -> bytes:
+    """Generate an EPUB file with the given package document, stored chapters and members"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", CONTAINER)
+        archive.writestr("OEBPS/content.opf", opf)
+        for chapter in range(chapters):
+            archive.writestr(
+                f"OEBPS/chapter{chapter}.xhtml",
+                b"x" * chapter_bytes,
+                compress_type=zipfile.ZIP_STORED,
+            )
+        for path, content in (members or {}).items():
+            archive.writestr(path, content)
+    return buffer.getvalue()
+
+
+def make_mobi(
+    full_name: bytes, exth: dict[int, bytes], text: bytes = b"", encoding: int = 65001
+) -> bytes:
+    """Generate a MOBI file with the given full name, EXTH records and text record"""
+    exth_records = b"".join(
+        struct.pack(">II", record_type, 8 + len(value)) + value
+        for record_type, value in exth.items()
+    )
+    exth_header = b"EXTH" + struct.pack(">II", 12 + len(exth_records), len(exth)) + exth_records
+    mobi_header_length = 232
+    name_offset = 16 + mobi_header_length + len(exth_header)
+
+    mobi_header = bytearray(mobi_header_length)
+    mobi_header[0:4] = b"MOBI"
+    struct.pack_into(">III", mobi_header, 4, mobi_header_length, 2, encoding)
+    struct.pack_into(">II", mobi_header, 84 - 16, name_offset, len(full_name))
+    struct.pack_into(">I", mobi_header, 128 - 16, 0x40 if exth else 0)
+    palmdoc_header = struct.pack(">HHIHHHH", 1, 0, len(text), 1, 4096, 0, 0)
+    record0 = palmdoc_header + bytes(mobi_header) + exth_header + full_name + b"\0\0"
+
+    pdb_header = bytearray(78)
+    pdb_header[0:32] = b"Database_Name".ljust(32, b"\0")
+    pdb_header[60:68] = b"BOOKMOBI"
+    struct.pack_into(">H", pdb_header, 76, 2)
+    record0_offset = 78 + 2 * 8 + 2
+    records = struct.pack(">II", record0_offset, 0) + struct.pack(
+        ">II", record0_offset + len(record0), 1
+    )
+    return bytes(pdb_header) + records + b"\0\0" + record0 + text
+
+
+def make_pdf(info: bytes, padding: int = 0, xref_stream: bool = False) -> bytes:
+    """Generate a PDF file with the given Info dictionary and padding in a content stream"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [] /Count 0 >>",
+        b"<< /Length %d >>\nstream\n" % padding + b"\0" * padding + b"\nendstream",
+        info,
+    ]
+    content = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+    xref_offset = len(content)
+    size = len(objects) + 1
+    if xref_stream:
+        rows = [struct.pack(">BIH", 0, 0, 65535)] + [
+            struct.pack(">BIH", 1, offset, 0) for offset in offsets + [xref_offset]
+        ]
+        # Rows with the PNG Up predictor applied
+        encoded = bytearray()
+        for previous, row in zip([bytes(7)] + rows, rows):
+            encoded += b"\x02" + bytes((a - b) & 0xFF for a, b in zip(row, previous))
+        stream = zlib.compress(bytes(encoded))
+        content += (
+            b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Info 4 0 R"
+            b" /Filter /FlateDecode /DecodeParms << /Columns 7 /Predictor 12 >>"
+            b" /Length %d >>\nstream\n"
+            % (size, size + 1, len(stream))
+            + stream
+            + b"\nendstream\nendobj\n"
+        )
+    else:
+        content += b"xref\n0 %d\n0000000000 65535 f \n" % size
+        content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        content += b"trailer\n<< /Size %d /Root 1 0 R /Info 4 0 R >>\n" % size
+    content += b"startxref\n%d\n%%%%EOF\n" % xref_offset
+    return bytes(content)
+
+
+class TestMobiMetadata:
+    """Test reading the metadata of MOBI files"""
+
+    def test_exth_metadata(self):
+        """Given a MOBI file with EXTH records
+        When reading the metadata
+        Then the EXTH title is preferred over the full name
+        """
+        data = make_mobi(
+            "Full Name".encode(),
+            {100: "Jane Doe".encode(), 503: "Ünïcode Title".encode(), 524: b"en"},
+        )
+        assert read_mobi_metadata(data) == {
+            "title": "Ünïcode Title",
+            "author": "Jane Doe",
+            "language": "en",
+        }
+
+    def test_full_name_without_exth(self):
+        """Without EXTH header, the title is the full name in the text encoding"""
+        data = make_mobi("Fülle".encode("cp1252"), {}, encoding=1252)
+        assert read_mobi_metadata(data) == {"title": "Fülle"}
+
+    def test_large_text_not_read(self):
+        """The metadata of a file with a large text is read from the header only"""
+        data = make_mobi(b"Title", {100: b"Author"}, text=b"\xff" * (8 * 1024 * 1024))
+        assert read_mobi_metadata(data) == {"title": "Title", "author": "Author"}
+
+    def test_not_a_mobi_file(self):
+        """Files without MOBI signature are rejected"""
+        with pytest.raises(MetadataFormatError):
+            read_mobi_metadata(b"\0" * 1024)
+
+
+class TestPdfMetadata:
+    """Test reading the metadata of PDF files"""
+
+    INFO = (
+        rb"<< /Title (Escaped \(Title\) \351t\351) /Author <FEFF004A0061006E0065>"
+        rb" /CreationDate (D:20230102030405Z) /Producer (Test) >>"
+    )
+
+    @pytest.mark.parametrize("xref_stream", [False, True], ids=["xref-table", "xref-stream"])
+    def test_info_dictionary(self, xref_stream):
+        """Given a PDF file with an Info dictionary
+        When reading the metadata
+        Then title, author and date are decoded
+        """
+        data = make_pdf(self.INFO, xref_stream=xref_stream)
+        assert read_pdf_metadata(data) == {
+            "title": "Escaped (Title) été",
+            "author": "Jane",
+            "date": "2023-01-02",
+        }
+
+    def test_large_content_not_read(self):
+        """The metadata of a large file is read from the trailer and the Info dictionary only"""
+        data = make_pdf(self.INFO, padding=8 * 1024 * 1024)
+        assert read_pdf_metadata(data)["author"] == "Jane"
+
+    def test_without_info(self):
+        """A PDF file without Info dictionary has no metadata"""
+        data = make_pdf(b"<< >>").replace(b" /Info 4 0 R", b"")
+        assert read_pdf_metadata(data) == {}
+
+    def test_not_a_pdf_file(self):
+        """Files without trailer are rejected"""
+        with pytest.raises(MetadataFormatError):
+            read_pdf_metadata(b"%PDF-1.7\n" + b"\0" * 1024)
+
+
+class TestEpubMetadata:
+    """Test reading the metadata of EPUB files"""
+
+    METADATA = (
+        b"<dc:title> Title </dc:title><dc:creator>Jane Doe</dc:creator>"
+        b"<dc:language>en</dc:language>"
+    )
+
+    def test_package_metadata(self):
+        """Given an EPUB file with a package document
+        When reading the metadata
+        Then the fields found in the package document are returned
+        """
+        data = make_epub(make_opf(self.METADATA), chapters=4, chapter_bytes=1024 * 1024)
+        assert read_epub_metadata(data) == {
+            "title": "Title",
+            "author": "Jane Doe",
+            "language": "en",
+        }
+
+    def test_real_epub(self):
+        """The metadata of a real EPUB file is read"""
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            metadata = read_epub_metadata(f.read())
+        assert metadata["title"].startswith("Frankenstein")
+        assert metadata["author"] == "Mary Wollstonecraft Shelley"
+
+    def test_entities_not_expanded(self):
+        """Given a package document defining an entity
+        When reading the metadata
+        Then the entity is not expanded
+        """
+        doctype = b'<!DOCTYPE package [<!ENTITY t "Expanded">]>'
+        opf = make_opf(b"<dc:title>&t;</dc:title><dc:creator>Jane Doe</dc:creator>", doctype)
+
+        assert read_epub_metadata(make_epub(opf)) == {"author": "Jane Doe"}
+
+    def test_entity_amplification(self):
+        """Package documents with exponentially nested entities are rejected"""
+        doctype = (
+            b'<!DOCTYPE package [<!ENTITY a "aaaaaaaaaa">'
+            + b"".join(
+                b'<!ENTITY %c "%s">' % (ord("b") + level, (b"&%c;" % (ord("a") + level)) * 10)
+                for level in range(8)
+            )
+            + b"]>"
+        )
+        opf = make_opf(b"<dc:title>&i;</dc:title>", doctype)
+
+        with pytest.raises(MetadataFormatError):
+            read_epub_metadata(make_epub(opf))
+
+    def test_external_entities_not_loaded(self, tmp_path):
+        """External entities are neither loaded from files nor from the network"""
+        secret = tmp_path / "secret.txt"
+        secret.write_text("secret")
+        doctype = b'<!DOCTYPE package [<!ENTITY s SYSTEM "%s">]>' % secret.as_uri().encode()
+        opf = make_opf(b"<dc:title>&s;</dc:title>", doctype)
+
+        assert "secret" not in read_epub_metadata(make_epub(opf)).values()
+
+    def test_large_package_document(self):
+        """Package documents beyond the size limit are rejected"""
+        data = make_epub(make_opf(self.METADATA, padding=2 * 1024 * 1024))
+        with pytest.raises(MetadataFormatError):
+            read_epub_metadata(data)
+
+    def test_highly_compressed_package_document(self):
+        """Package documents with a suspicious compression ratio are rejected"""
+        data = make_epub(make_opf(self.METADATA, padding=512 * 1024))
+        with pytest.raises(MetadataFormatError):
+            read_epub_metadata(data)
+        assert read_epub_metadata(data, EpubLimits(max_compression_ratio=10_000))["title"]
+
+    def test_too_many_entries(self):
+        """Archives with too many entries are rejected before they are read"""
+        data = make_epub(make_opf(self.METADATA), chapters=10)
+        with pytest.raises(MetadataFormatError):
+            read_epub_metadata(data, EpubLimits(max_entries=5))
+
+    def test_time_budget(self):
+        """Reading stops when the time budget is exhausted"""
+        data = make_epub(make_opf(self.METADATA))
+        with pytest.raises(MetadataFormatError):
+            read_epub_metadata(data, EpubLimits(time_budget_seconds=0))
+        assert read_epub_metadata(data)["title"] == "Title"  # The parser can be used again
+
+
+class TestEpubCover:
+    """Test locating and reading the cover image of EPUB files"""
+
+    METADATA = b"<dc:title>Title</dc:title>"
+    IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+    def test_cover_image_property(self):
+        """Given an EPUB 3 manifest item with the cover-image property
+        When reading the metadata
+        Then the image is returned as cover with its media type
+        """
+        manifest = (
+            b'<manifest><item id="c" href="images/c%20over.png" media-type="image/png"'
+            b' properties="cover-image"/></manifest>'
+        )
+        data = make_epub(
+            make_opf(self.METADATA, manifest=manifest),
+            members={"OEBPS/images/c over.png": self.IMAGE},
+        )
+
+        metadata = read_epub_metadata(data)
+        assert metadata["cover"] == self.IMAGE
+        assert metadata["cover_media_type"] == "image/png"
+        assert metadata["title"] == "Title"
+
+    def test_cover_meta_element(self):
+        """The EPUB 2 cover meta element names the manifest item of the cover"""
+        manifest = (
+            b'<manifest><item id="img" href="../cover.jpg" media-type="image/jpeg"/></manifest>'
+        )
+        opf = make_opf(self.METADATA + b'<meta name="cover" content="img"/>', manifest=manifest)
+        data = make_epub(opf, members={"cover.jpg": self.IMAGE})
+
+        assert read_epub_metadata(data)["cover_media_type"] == "image/jpeg"
+
+    def test_guide_cover_page(self):
+        """Given a guide referencing a cover page
+        When reading the metadata
+        Then the image shown on the cover page is the cover
+        """
+        manifest = (
+            b'<manifest><item id="p" href="text/cover.xhtml" media-type="application/xhtml+xml"/>'
+            b'<item id="i" href="images/front.png" media-type="image/png"/></manifest>'
+            b'<guide><reference type="cover" href="text/cover.xhtml#top"/></guide>'
+        )
+        page = (
+            b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+            b'<img src="../images/front.png"/></body></html>'
+        )
+        data = make_epub(
+            make_opf(self.METADATA, manifest=manifest),
+            members={"OEBPS/text/cover.xhtml": page, "OEBPS/images/front.png": self.IMAGE},
+        )
+
+        assert read_epub_metadata(data)["cover"] == self.IMAGE
+
+    @pytest.mark.parametrize("guide_href", [b"front.svg", b"page.xhtml"], ids=["image", "page"])
+    def test_unsupported_guide_cover(self, guide_href):
+        """Given a guide referencing an unsupported image or a page showing one
+        When reading the metadata
+        Then an image item called cover is the cover
+        """
+        manifest = (
+            b'<manifest><item id="f" href="front.svg" media-type="image/svg+xml"/>'
+            b'<item id="p" href="page.xhtml" media-type="application/xhtml+xml"/>'
+            b'<item id="c" href="cover.png" media-type="image/png"/></manifest>'
+            b'<guide><reference type="cover" href="' + guide_href + b'"/></guide>'
+        )
+        page = (
+            b'<html xmlns="http://www.w3.org/1999/xhtml"><body><img src="front.svg"/></body></html>'
+        )
+        data = make_epub(
+            make_opf(self.METADATA, manifest=manifest),
+            members={
+                "OEBPS/page.xhtml": page,
+                "OEBPS/front.svg": b"<svg/>",
+                "OEBPS/cover.png": self.IMAGE,
+            },
+        )
+
+        assert read_epub_metadata(data)["cover"] == self.IMAGE
+
+    def test_unsupported_or_missing_cover(self):
+        """SVG and missing images are not returned as cover, the other metadata is kept"""
+        manifest = (
+            b'<manifest><item id="s" href="cover.svg" media-type="image/svg+xml"'
+            b' properties="cover-image"/>'
+            b'<item id="m" href="cover.png" media-type="image/png"/></manifest>'
+        )
+        data = make_epub(
+            make_opf(self.METADATA, manifest=manifest),
+            members={"OEBPS/cover.svg": b"<svg/>"},
+        )
+
+        assert read_epub_metadata(data) == {"title": "Title"}
+
+    def test_large_cover(self):
+        """Covers beyond the size limit are left out"""
+        manifest = (
+            b'<manifest><item id="c" href="cover.png" media-type="image/png"'
+            b' properties="cover-image"/></manifest>'
+        )
+        data = make_epub(
+            make_opf(self.METADATA, manifest=manifest),
+            members={"OEBPS/cover.png": self.IMAGE},
+        )
+
+        assert read_epub_metadata(data, EpubLimits(max_cover_bytes=256)) == {"title": "Title"}
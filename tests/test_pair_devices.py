@@ -1,10 +1,14 @@
+import threading
+
 import pytest
 
 from booklink.pair_devices import (
+    ChannelNotFoundError,
     Client,
     ClientNotFoundError,
     PairingRegister,
 )
+from booklink.utils import now_unixutc
 
 
 class TestPairingRegister:
@@ -72,6 +76,17 @@ class TestPairingRegister:
         assert len(res) == 2
         assert res == [channel_a, channel_b]
 
+    def test_set_channel_token(self, register):
+        """Test storing a token with the channel of a client"""
+        for _ in range(2):
+            register.new_client()
+        code_a, code_b = register.all_clients_in_pairing.keys()
+        id_a, id_b = [client.id for client in register.all_clients_in_pairing.values()]
+        channel = register.new_channel(id_a, code_b)
+
+        register.set_channel_token(id_b, channel.channel_id, "token")
+        assert register.channels_for(id_b)[0].tokens == {id_b: "token"}
+
     def test_channels_for_invalid(self, register):
         """Test getting channels invalid code"""
         res = register.channels_for("invalid-code")
@@ -106,3 +121,133 @@ class TestPairingRegister:
 
         assert register.client_is_in_pairing(pairing_code)
         assert not register.client_is_in_pairing(pairing_code + "invalid")
+
+    def test_injected_clock(self):
+        """Clients expire once the injected clock passes their expiration"""
+        now = [now_unixutc()]
+        register = PairingRegister(client_expiration_seconds=300, clock=lambda: now[0])
+        pairing_code, _ = register.new_client()
+
+        register.prune_data()
+        assert register.client_is_in_pairing(pairing_code)
+
+        now[0] += 301
+        register.prune_data()
+        assert not register.client_is_in_pairing(pairing_code)
+
+    @pytest.mark.parametrize("inline_pruning", [True, False])
+    def test_full_of_expired_clients(self, inline_pruning):
+        """Given a register full of expired clients
+        When a new client is added
+        Then the expired clients are pruned to make room
+        """
+        now = [now_unixutc()]
+        register = PairingRegister(
+            client_expiration_seconds=300,
+            max_clients_in_pairing=3,
+            clock=lambda: now[0],
+            inline_pruning=inline_pruning,
+        )
+        expired_codes = [register.new_client()[0] for _ in range(3)]
+
+        now[0] += 301
+        register.new_client()
+
+        assert not set(expired_codes) & set(register.all_clients_in_pairing)
+
+    def test_without_inline_pruning(self):
+        """Lookups skip expired clients, which stay stored until pruned"""
+        now = [now_unixutc()]
+        register = PairingRegister(
+            client_expiration_seconds=300, clock=lambda: now[0], inline_pruning=False
+        )
+        pairing_code, _ = register.new_client()
+
+        now[0] += 301
+        register.new_client()
+        assert not register.client_is_in_pairing(pairing_code)
+        assert len(register.all_clients_in_pairing) == 2
+
+        register.prune_data()
+        assert len(register.all_clients_in_pairing) == 0
+
+    def test_wait_for_channels(self, register):
+        """Waiting returns once a channel is registered for the client"""
+        for _ in range(2):
+            register.new_client()
+        code_a, code_b = register.all_clients_in_pairing.keys()
+        id_a, id_b = [client.id for client in register.all_clients_in_pairing.values()]
+        assert register.wait_for_channels(id_b, 0, timeout_seconds=0.01) == (0, [])
+
+        pairing = threading.Timer(0.05, register.new_channel, args=(id_a, code_b))
+        pairing.start()
+        version, channels = register.wait_for_channels(id_b, 0, timeout_seconds=5)
+        pairing.join()
+
+        assert version == register.channels_version(id_b) != 0
+        assert [c.channel_id for c in channels] == [
+            c.channel_id for c in register.channels_for(id_b)
+        ]
+
+    def test_get_client_by_id(self):
+        """Test client retrieval by id until the client is pruned"""
+        now = [now_unixutc()]
+        register = PairingRegister(client_expiration_seconds=300, clock=lambda: now[0])
+        _, client = register.new_client()
+        register.new_client()
+
+        assert register.get_client_by_id(client.id) is client
+        with pytest.raises(ClientNotFoundError):
+            register.get_client_by_id("invalid-id")
+
+        now[0] += 301
+        register.prune_data()
+        with pytest.raises(ClientNotFoundError):
+            register.get_client_by_id(client.id)
+        assert register._clients_by_id == {}  # pylint: disable=protected-access
+
+    def test_channel_expiration(self):
+        """Channels expire on their own and are pruned from the channel index"""
+        now = [now_unixutc()]
+        register = PairingRegister(
+            client_expiration_seconds=300,
+            channel_expiration_seconds=60,
+            clock=lambda: now[0],
+        )
+        _, sender = register.new_client()
+        pairing_code, ereader = register.new_client()
+        channel = register.new_channel(sender.id, pairing_code)
+        assert register.get_channel(channel.channel_id) is channel
+
+        now[0] += 61
+        assert register.channels_for(ereader.id) == []  # Skipped before pruning
+        register.prune_data()
+        with pytest.raises(ChannelNotFoundError):
+            register.get_channel(channel.channel_id)
+        assert register.channels_version(ereader.id) == 0
+        assert register.get_client_by_id(ereader.id) is ereader
+
+    def test_max_channels_per_client(self):
+        """Repeated pairings keep only the newest channels of a client"""
+        register = PairingRegister(max_channels_per_client=2)
+        _, sender = register.new_client()
+        pairing_code, ereader = register.new_client()
+        channels = [register.new_channel(sender.id, pairing_code) for _ in range(5)]
+
+        assert register.channels_for(ereader.id) == channels[-2:]
+        with pytest.raises(ChannelNotFoundError):
+            register.get_channel(channels[0].channel_id)
+
+    def test_channels_pruned_with_client(self):
+        """Channels of an expired client leave the channel index"""
+        now = [now_unixutc()]
+        register = PairingRegister(client_expiration_seconds=300, clock=lambda: now[0])
+        _, sender = register.new_client()
+        pairing_code, ereader = register.new_client()
+        channel = register.new_channel(sender.id, pairing_code)
+
+        now[0] += 301
+        register.prune_data()
+        assert register.channels_for(ereader.id) == []
+        with pytest.raises(ChannelNotFoundError):
+            register.get_channel(channel.channel_id)
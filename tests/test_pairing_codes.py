@@ -0,0 +1,59 @@
+"""Test the allocation of pairing codes"""
+
+import pytest
+
+from booklink.pairing_codes import (
+    PAIRING_CODE_ALPHABET,
+    PairingCodeAllocator,
+)
+
+
+class TestPairingCodeAllocator:
+    """Test the PairingCodeAllocator class"""
+
+    def test_codes_unique_until_space_exhausted(self):
+        """Given an allocator allowing full occupancy
+        When all codes of the shortest length are allocated
+        Then every code is unique and valid, and longer codes follow
+        """
+        allocator = PairingCodeAllocator(min_length=2, max_occupancy=1)
+        n_codes = len(PAIRING_CODE_ALPHABET) ** 2
+        codes = [allocator.allocate() for _ in range(n_codes)]
+
+        assert len(set(codes)) == n_codes
+        assert all(len(code) == 2 for code in codes)
+        assert all(char in PAIRING_CODE_ALPHABET for code in codes for char in code)
+        assert len(allocator.allocate()) == 3
+        assert len(allocator) == n_codes + 1
+
+    def test_released_codes_are_reused(self):
+        """Given a fully occupied code length
+        When codes are released
+        Then exactly those codes are allocated again
+        """
+        allocator = PairingCodeAllocator(min_length=1, max_occupancy=1)
+        codes = [allocator.allocate() for _ in range(len(PAIRING_CODE_ALPHABET))]
+        released = set(codes[::3])
+        for code in released:
+            allocator.release(code)
+
+        assert {allocator.allocate() for _ in released} == released
+
+    def test_length_grows_with_occupancy(self):
+        """Given a maximum occupancy
+        When more codes are in use than allowed for the shortest length
+        Then longer codes are allocated until short ones are released
+        """
+        allocator = PairingCodeAllocator(min_length=1, max_occupancy=0.5)
+        short_codes = [allocator.allocate() for _ in range(len(PAIRING_CODE_ALPHABET) // 2)]
+        assert all(len(code) == 1 for code in short_codes)
+
+        assert len(allocator.allocate()) == 2
+
+        allocator.release(short_codes[0])
+        assert len(allocator.allocate()) == 1
+
+    def test_invalid_occupancy(self):
+        """The maximum occupancy must be a share"""
+        with pytest.raises(ValueError):
+            PairingCodeAllocator(max_occupancy=0)
@@ -0,0 +1,41 @@
+"""Test background eviction of expired data"""
+
+import threading
+
+import pytest
+
+from booklink.reaper import Reaper
+
+
+class TestReaper:
+    """Test the Reaper class"""
+
+    def test_run_once(self):
+        """All tasks are run, even if one of them fails"""
+        calls = []
+
+        def failing_task():
+            calls.append("failing")
+            raise RuntimeError("Task failed")
+
+        reaper = Reaper(tasks=[failing_task, lambda: calls.append("ok")], interval_seconds=1)
+        reaper.run_once()
+
+        assert calls == ["failing", "ok"]
+
+    def test_start_and_stop(self):
+        """Tasks run periodically until the reaper is stopped"""
+        ran = threading.Event()
+        reaper = Reaper(tasks=[ran.set], interval_seconds=0.01)
+
+        reaper.start()
+        assert reaper.is_running()
+        assert ran.wait(timeout=1)
+
+        reaper.stop(timeout=1)
+        assert not reaper.is_running()
+
+    def test_invalid_interval(self):
+        """The interval must be positive"""
+        with pytest.raises(ValueError):
+            Reaper(tasks=[], interval_seconds=0)
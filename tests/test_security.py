@@ -99,3 +99,68 @@ class TestAuthenticator:
             multi_id_authenticator.validate(token, id="Bob")  # Missing role
         with pytest.raises(AuthenticationError):
             multi_id_authenticator.validate(token, role="admin")  # Missing id
+
+    def test_token_of_other_authenticator_denied(self, id_authenticator, multi_id_authenticator):
+        """Given a token signed with the same secret for other ID factors
+        When validating it
+        Then an authentication error is raised instead of a key error
+        """
+        token = id_authenticator.token(0, id="Bob")
+        with pytest.raises(AuthenticationError):
+            multi_id_authenticator.validate(token, id="Bob", role="admin")
+
+    def test_repeated_validation_is_cached(self, id_authenticator):
+        """Given a token that was validated
+        When validating the same token and claim again
+        Then the cached validation is used
+        """
+        token = id_authenticator.token(0, id="Bob")
+        id_authenticator.validate(token, id="Bob")
+        id_authenticator.validate(token, id="Bob")
+
+        assert id_authenticator.cache_misses == 1
+        assert id_authenticator.cache_hits == 1
+
+    def test_cached_token_with_other_claim_is_denied(self, id_authenticator):
+        """Given a token that was validated
+        When validating the token with a wrong ID claim
+        Then an exception is raised
+        """
+        token = id_authenticator.token(0, id="Bob")
+        id_authenticator.validate(token, id="Bob")
+        with pytest.raises(AuthenticationError):
+            id_authenticator.validate(token, id="Alice")
+
+    def test_cached_validation_expires(self):
+        """Given a cached validation
+        When its time to live has passed
+        Then the token is verified again
+        """
+        now = [0.0]
+        authenticator = Authenticator(
+            jwt_secret="testing", id_factors={"id"}, cache_ttl_seconds=10, clock=lambda: now[0]
+        )
+        token = authenticator.token(0, id="Bob")
+        authenticator.validate(token, id="Bob")
+        now[0] = 11
+        authenticator.validate(token, id="Bob")
+
+        assert authenticator.cache_hits == 0
+        assert authenticator.cache_misses == 2
+
+    def test_cache_evicts_least_recently_used(self):
+        """Given a full cache
+        When another token is validated
+        Then the least recently used validation is evicted
+        """
+        authenticator = Authenticator(jwt_secret="testing", id_factors={"id"}, cache_size=2)
+        tokens = {name: authenticator.token(0, id=name) for name in ("Alice", "Bob", "Carol")}
+        authenticator.validate(tokens["Alice"], id="Alice")
+        authenticator.validate(tokens["Bob"], id="Bob")
+        authenticator.validate(tokens["Alice"], id="Alice")  # Bob is least recently used
+        authenticator.validate(tokens["Carol"], id="Carol")
+
+        authenticator.validate(tokens["Alice"], id="Alice")
+        authenticator.validate(tokens["Bob"], id="Bob")
+        assert authenticator.cache_hits == 2
+        assert authenticator.cache_misses == 4
@@ -0,0 +1,122 @@
+"""Test sharing the service state between processes"""
+
+import io
+import multiprocessing
+from typing import Generator
+
+import pytest
+
+from booklink.application_service import (
+    ApplicationService,
+    ApplicationServiceConfig,
+)
+from booklink.ebookfile import EbookFileListing
+from booklink.state_backend import SharedStateBackend
+
+
+def new_client_in_worker(config: ApplicationServiceConfig, results: multiprocessing.Queue):
+    """Create a client in a worker process"""
+    service = ApplicationService(config)
+    client = service.new_client("E-Reader")
+    results.put((client.id, client.token, client.pairing_code))
+
+
+def list_files_in_worker(
+    config: ApplicationServiceConfig,
+    client_id: str,
+    token: str,
+    results: multiprocessing.Queue,
+):
+    """List the files of the channels of a client in a worker process"""
+    service = ApplicationService(config)
+    channel = service.channels_for_client(client_id, token)[0]
+    files = service.get_files_for_channel(channel.id, client_id, channel.token)
+    results.put([f.name for f in files])
+
+
+def run_in_worker(target, *args):
+    """Run the target in a separate process and return the result it puts in the queue"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    worker = context.Process(target=target, args=(*args, results))
+    worker.start()
+    result = results.get(timeout=30)
+    worker.join(timeout=30)
+    assert worker.exitcode == 0
+    return result
+
+
+class TestSharedState:
+    """Test services in several processes sharing one state server"""
+
+    @pytest.fixture
+    def config(self, tmp_path) -> Generator[ApplicationServiceConfig, None, None]:
+        """Return the configuration of services connecting to a running state server"""
+        config = ApplicationServiceConfig(
+            client_jwt_secret="test_secret",
+            channel_jwt_secret="test_secret",
+            state_server_address=str(tmp_path / "state.sock"),
+        )
+        server_service = ApplicationService(
+            ApplicationServiceConfig(
+                client_jwt_secret=config.client_jwt_secret,
+                channel_jwt_secret=config.channel_jwt_secret,
+            )
+        )
+        server = server_service.state_server(config.state_server_address)
+        server.start()
+        yield config
+        server.stop()
+
+    def test_shared_backend_from_config(self, config: ApplicationServiceConfig):
+        """Given a state server address
+        When a service is created
+        Then it uses the shared registers
+        """
+        service = ApplicationService(config)
+        assert isinstance(service.backend, SharedStateBackend)
+        assert service.reaper is None
+
+    def test_state_shared_across_processes(self, config: ApplicationServiceConfig):
+        """Given an e-reader client created in one worker process
+        When another process pairs with it and uploads a file
+        Then a third process sees the channel and the file
+        """
+        ereader_id, ereader_token, pairing_code = run_in_worker(new_client_in_worker, config)
+
+        sender_service = ApplicationService(config)
+        sender = sender_service.new_client("Sender")
+        channel = sender_service.new_channel_using_code(sender.id, sender.token, pairing_code)
+        sender_service.store_file_for_channel(
+            channel.id, sender.id, channel.token, "book.epub", io.BytesIO(b"content")
+        )
+
+        file_names = run_in_worker(list_files_in_worker, config, ereader_id, ereader_token)
+        assert file_names == ["book.epub"]
+
+    def test_listings_without_content(self, config: ApplicationServiceConfig):
+        """Given an epub stored through the shared registers
+        When its channel is listed, polled and its cover is fetched
+        Then only listings and the cover are sent, the content only for downloads
+        """
+        service = ApplicationService(config)
+        sender = service.new_client("Sender")
+        ereader = service.new_client("E-Reader")
+        channel = service.new_channel_using_code(sender.id, sender.token, ereader.pairing_code)
+        with open("tests/test_ebooks/frankenstein.epub", "rb") as f:
+            data = f.read()
+        file_id = service.store_file_for_channel(
+            channel.id, sender.id, channel.token, "book.epub", data
+        )
+
+        _, listing = service.file_register.listing_for_channel(channel.id).files[0]
+        assert isinstance(listing, EbookFileListing)
+        assert (listing.size, listing.has_cover) == (len(data), True)
+        assert service.file_register.listing_version_for_channel(channel.id)[1] == 1
+
+        update = service.wait_for_files_for_channel(channel.id, sender.id, channel.token, 0, 0)
+        assert update.files[0].title.startswith("Frankenstein")
+        cover = service.get_cover(channel.id, sender.id, channel.token, file_id)
+        assert cover.data.startswith(b"\x89PNG")
+        download = service.get_file(channel.id, sender.id, channel.token, file_id)
+        assert download.data.read() == data
@@ -1,8 +1,10 @@
+import threading
 from dataclasses import dataclass
 
 import pytest
 
 from booklink.storage import (
+    ChannelSnapshot,
     FileRegister,
     FileRegisterError,
     RegisteredFile,
@@ -23,17 +25,38 @@ class DummyFile(RegisteredFile):
         return DUMMY_FILE_SIZE_BYTES
 
 
+@dataclass
+class SharedContentFile(DummyFile):
+    """Dummy file class with the same content as all other instances"""
+
+    def content_key(self) -> str:
+        """Return the key of the shared content"""
+        return "shared"
+
+
+@dataclass
+class ListedFile(DummyFile):
+    """Dummy file class with a listing that differs from the file"""
+
+    def listing(self) -> DummyFile:
+        """Return the file as a plain dummy file"""
+        return DummyFile(
+            file_id=f"{self.file_id}-listing", created_at_unixutc=self.created_at_unixutc
+        )
+
+
 class TestFileRegister:
     """Test the FileRegister class"""
 
-    @pytest.fixture
-    def register(self):
+    @pytest.fixture(params=[1, 4], ids=["single-shard", "sharded"])
+    def register(self, request):
         """Return a FileRegister instance"""
         yield FileRegister(
             max_files_in_channel=5,
             file_expiration_seconds=100,
             max_total_file_size_bytes=100,
             max_random_draws=10,
+            shards=request.param,
         )
 
     def test_add_file(self, register):
@@ -85,7 +108,7 @@ class TestFileRegister:
         assert res == []
 
         # Test that also channel did not become orphan (no content)
-        assert "channel" not in register._files_per_channel
+        assert "channel" not in register.channel_ids()
 
     def test_get_files_expired(self, register):
         """Expired files should not be returned"""
@@ -113,3 +136,330 @@ class TestFileRegister:
 
         res = register.total_size_bytes()
         assert res == n_files * DUMMY_FILE_SIZE_BYTES
+
+    def test_total_size_bytes_after_remove_and_expiry(self, register):
+        """Removed and expired files no longer count towards the total size"""
+        file_id = register.add_file("a", DummyFile(file_id="a", created_at_unixutc=now_unixutc()))
+        register.add_file("b", DummyFile(file_id="b", created_at_unixutc=now_unixutc()))
+        register.add_file("b", DummyFile(file_id="expired", created_at_unixutc=0))
+        assert register.total_size_bytes() == 3 * DUMMY_FILE_SIZE_BYTES
+        assert register.total_size_bytes_for_channel("b") == 2 * DUMMY_FILE_SIZE_BYTES
+
+        register.remove_file(file_id)
+        register.prune_expired_files()
+        assert register.total_size_bytes() == DUMMY_FILE_SIZE_BYTES
+        assert register.total_size_bytes_for_channel("a") == 0
+        assert register.total_size_bytes_for_channel("b") == DUMMY_FILE_SIZE_BYTES
+
+    def test_reserve_bytes(self, register):
+        """Reserved capacity is not available to other files until it is released"""
+        register.reserve_bytes(95)
+        assert register.remaining_capacity_bytes() == 5
+        with pytest.raises(FileRegisterError):
+            register.add_file("channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc()))
+        with pytest.raises(FileRegisterError):
+            register.reserve_bytes(10)
+
+        register.release_bytes(95)
+        assert register.remaining_capacity_bytes() == 100
+
+    def test_add_file_consumes_reservation(self, register):
+        """Adding a file uses its reservation and returns the surplus"""
+        register.reserve_bytes(25)
+        register.add_file(
+            "channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc()), reserved_bytes=25
+        )
+        assert register.total_size_bytes() == DUMMY_FILE_SIZE_BYTES
+        assert register.remaining_capacity_bytes() == 100 - DUMMY_FILE_SIZE_BYTES
+
+    def test_failed_add_keeps_reservation(self, register):
+        """The caller keeps the reservation if the file cannot be added"""
+        register.max_file_size_bytes = DUMMY_FILE_SIZE_BYTES - 1
+        register.reserve_bytes(20)
+        with pytest.raises(FileRegisterError):
+            register.add_file(
+                "channel",
+                DummyFile(file_id="a", created_at_unixutc=now_unixutc()),
+                reserved_bytes=20,
+            )
+        assert register.remaining_capacity_bytes() == 80
+
+    def test_concurrent_uploads_respect_capacity(self):
+        """Concurrent uploads to different shards never exceed the total capacity"""
+        register = FileRegister(
+            max_files_in_channel=100, max_total_file_size_bytes=10 * DUMMY_FILE_SIZE_BYTES, shards=4
+        )
+
+        def upload(channel_id):
+            for i in range(5):
+                try:
+                    register.add_file(
+                        channel_id, DummyFile(file_id=str(i), created_at_unixutc=now_unixutc())
+                    )
+                except FileRegisterError:
+                    pass
+
+        threads = [threading.Thread(target=upload, args=(f"c{i}",)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert register.total_size_bytes() == 10 * DUMMY_FILE_SIZE_BYTES
+
+    def test_remove_file_from_other_channel(self, register):
+        """Removing a file only affects the channel holding it"""
+        file_id_a = register.add_file("a", DummyFile(file_id="a", created_at_unixutc=now_unixutc()))
+        file_id_b = register.add_file("b", DummyFile(file_id="b", created_at_unixutc=now_unixutc()))
+
+        register.remove_file(file_id_b)
+        assert len(register.get_files_for_channel("a")) == 1
+        assert len(register.get_files_for_channel("b")) == 0
+
+        with pytest.raises(FileRegisterError):
+            register.remove_file(file_id_b)
+        register.remove_file(file_id_a)
+
+    def test_pruned_files_leave_index(self, register):
+        """Expired files can no longer be removed by ID"""
+        file_id = register.add_file("channel", DummyFile(file_id="id", created_at_unixutc=0))
+        register.prune_expired_files()
+
+        with pytest.raises(FileRegisterError):
+            register.remove_file(file_id)
+
+    def test_injected_clock(self):
+        """Files expire once the injected clock passes their expiration"""
+        now = [1000.0]
+        register = FileRegister(file_expiration_seconds=100, clock=lambda: now[0])
+        register.add_file("channel", DummyFile(file_id="old", created_at_unixutc=1000))
+        register.add_file("channel", DummyFile(file_id="new", created_at_unixutc=1050))
+
+        now[0] = 1120
+        assert [f.file_id for f in register.get_files_for_channel("channel")] == ["new"]
+
+        now[0] = 1200
+        assert register.get_files_for_channel("channel") == []
+        assert "channel" not in register.channel_ids()
+
+    def test_without_inline_pruning(self):
+        """Reads skip expired files, which stay stored until pruned"""
+        now = [1000.0]
+        register = FileRegister(
+            file_expiration_seconds=100, clock=lambda: now[0], inline_pruning=False
+        )
+        file_id = register.add_file("channel", DummyFile(file_id="a", created_at_unixutc=1000))
+
+        now[0] = 1200
+        assert register.get_files_for_channel("channel") == []
+        assert register.get_file_ids_for_channel("channel") == []
+        with pytest.raises(FileRegisterError):
+            register.get_file_for_channel("channel", file_id)
+        assert register.total_size_bytes() == DUMMY_FILE_SIZE_BYTES
+
+        register.prune_expired_files()
+        assert register.total_size_bytes() == 0
+
+    def test_full_channel_of_expired_files_without_inline_pruning(self):
+        """Given a channel full of expired files that were not pruned yet
+        When a file is added
+        Then the expired files are pruned to make room
+        """
+        now = [1000.0]
+        register = FileRegister(
+            max_files_in_channel=2,
+            file_expiration_seconds=100,
+            clock=lambda: now[0],
+            inline_pruning=False,
+        )
+        for file_id in ("a", "b"):
+            register.add_file("channel", DummyFile(file_id=file_id, created_at_unixutc=1000))
+
+        now[0] = 1200
+        register.add_file("channel", DummyFile(file_id="c", created_at_unixutc=1200))
+
+        assert [f.file_id for f in register.get_files_for_channel("channel")] == ["c"]
+        assert register.total_size_bytes() == DUMMY_FILE_SIZE_BYTES
+
+    def test_listing_for_channel(self, register):
+        """Given files with listings
+        When the channel is listed
+        Then the listings are returned with the version of the channel's snapshot
+        """
+        file = ListedFile(file_id="a", created_at_unixutc=now_unixutc())
+        file_id = register.add_file("channel", file)
+        register.update_file(file_id, file_id="b")
+
+        listing = register.listing_for_channel("channel")
+        assert [f.file_id for _, f in listing.files] == ["b-listing"]
+        assert listing.version == register.snapshot_for_channel("channel").version
+        assert register.listing_version_for_channel("channel") == (listing.version, 1)
+        assert register.listings_for_channels(["channel", "other"])[1] == ChannelSnapshot.empty()
+        assert register.wait_for_listing_change("channel", 0, 0) == listing
+
+        register.remove_file(file_id)
+        assert register.listing_version_for_channel("channel") == (0, 0)
+
+    def test_get_attachment_for_channel(self, register):
+        """Files without the requested attachment raise"""
+        file_id = register.add_file(
+            "channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc())
+        )
+        with pytest.raises(FileRegisterError):
+            register.get_attachment_for_channel("channel", file_id, "cover")
+
+    def test_file_ids_unique_across_shards(self):
+        """File IDs are unique across all shards and can be removed without the channel"""
+        register = FileRegister(max_total_file_size_bytes=1000, shards=8)
+        file_ids = [
+            register.add_file(f"c{i}", DummyFile(file_id=str(i), created_at_unixutc=now_unixutc()))
+            for i in range(50)
+        ]
+        assert len(set(file_ids)) == len(file_ids)
+        assert len(register.channel_ids()) == 50
+
+        for file_id in file_ids:
+            register.remove_file(file_id)
+        assert register.channel_ids() == []
+        assert register.total_size_bytes() == 0
+
+    def test_invalid_shard_count(self):
+        """At least one shard is required"""
+        with pytest.raises(ValueError):
+            FileRegister(shards=0)
+
+    def test_snapshot_for_channel(self, register):
+        """Snapshots are immutable and their version increases with every change"""
+        assert register.snapshot_for_channel("channel") == ChannelSnapshot.empty()
+
+        file = DummyFile(file_id="a", created_at_unixutc=now_unixutc())
+        file_id = register.add_file("channel", file)
+        snapshot = register.snapshot_for_channel("channel")
+        assert snapshot.files == ((file_id, file),)
+
+        register.add_file("channel", DummyFile(file_id="b", created_at_unixutc=now_unixutc()))
+        newer_snapshot = register.snapshot_for_channel("channel")
+        assert newer_snapshot.version > snapshot.version
+        assert len(newer_snapshot.files) == 2
+        assert snapshot.files == ((file_id, file),)  # Published snapshots do not change
+
+    def test_snapshot_skips_expired_files(self, register):
+        """Expired files are not part of a snapshot"""
+        register.add_file("channel", DummyFile(file_id="expired", created_at_unixutc=0))
+        register.file_expiration_seconds = 0
+
+        assert register.snapshot_for_channel("channel").files == ()
+        assert "channel" not in register.channel_ids()  # Pruned inline
+
+    def test_wait_for_channel_change(self, register):
+        """Waiting returns once a file is added from another thread"""
+        version = register.snapshot_for_channel("channel").version
+        adder = threading.Timer(
+            0.05,
+            register.add_file,
+            args=("channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc())),
+        )
+        adder.start()
+
+        snapshot = register.wait_for_channel_change("channel", version, timeout_seconds=5)
+        adder.join()
+        assert snapshot.version != version
+        assert len(snapshot.files) == 1
+
+    def test_wait_for_channel_change_timeout(self, register):
+        """Waiting on the current version returns the unchanged snapshot after the timeout"""
+        register.add_file("channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc()))
+        snapshot = register.snapshot_for_channel("channel")
+
+        assert register.wait_for_channel_change("channel", snapshot.version, 0.01) == snapshot
+        assert register.wait_for_channel_change("channel", 0, 0) == snapshot  # Already changed
+
+    def test_versions_not_reused(self, register):
+        """A channel that is dropped and filled again gets a new version"""
+        file_id = register.add_file(
+            "channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc())
+        )
+        first_version = register.snapshot_for_channel("channel").version
+        register.remove_file(file_id)
+        assert register.snapshot_for_channel("channel").version == 0
+
+        register.add_file("channel", DummyFile(file_id="b", created_at_unixutc=now_unixutc()))
+        assert register.snapshot_for_channel("channel").version > first_version
+
+    def test_update_file(self, register):
+        """An updated file replaces the stored one in place under a new version"""
+        first_id = register.add_file(
+            "channel", DummyFile(file_id="a", created_at_unixutc=now_unixutc())
+        )
+        register.add_file("channel", DummyFile(file_id="b", created_at_unixutc=now_unixutc()))
+        before = register.snapshot_for_channel("channel")
+
+        register.update_file(first_id, file_id="c")
+
+        after = register.snapshot_for_channel("channel")
+        assert after.version > before.version
+        assert [f.file_id for _, f in after.files] == ["c", "b"]
+        assert [f.file_id for _, f in before.files] == ["a", "b"]  # Published copy is kept
+        assert register.get_file_for_channel("channel", first_id).file_id == "c"
+        assert register.total_size_bytes() == 2 * DUMMY_FILE_SIZE_BYTES
+
+    def test_update_file_expires(self):
+        """An updated file still expires with its creation time"""
+        time = 0.0
+        register = FileRegister(file_expiration_seconds=10, clock=lambda: time)
+        file_id = register.add_file("channel", DummyFile(file_id="a", created_at_unixutc=0))
+        register.update_file(file_id, file_id="b")
+
+        time = 11
+        register.prune_expired_files()
+        assert register.get_files_for_channel("channel") == []
+        assert register.total_size_bytes() == 0
+
+    def test_update_missing_file(self, register):
+        """Updating a file that is not stored fails"""
+        with pytest.raises(FileRegisterError):
+            register.update_file("missing", file_id="b")
+
+    def test_shared_content_counts_once(self, register):
+        """Files with the same content share it and are charged against the capacity once"""
+        first_id = register.add_file(
+            "channel-a", SharedContentFile(file_id="a", created_at_unixutc=now_unixutc())
+        )
+        second_id = register.add_file(
+            "channel-b", SharedContentFile(file_id="b", created_at_unixutc=now_unixutc())
+        )
+        assert register.total_size_bytes() == DUMMY_FILE_SIZE_BYTES
+        assert register.total_size_bytes_for_channel("channel-b") == DUMMY_FILE_SIZE_BYTES
+
+        register.remove_file(first_id)
+        assert register.total_size_bytes() == DUMMY_FILE_SIZE_BYTES
+        register.remove_file(second_id)
+        assert register.total_size_bytes() == 0
+
+    def test_shared_content_at_capacity(self, register):
+        """Content that is already stored can be added when the capacity is exhausted"""
+        register.add_file(
+            "channel", SharedContentFile(file_id="a", created_at_unixutc=now_unixutc())
+        )
+        register.reserve_bytes(register.remaining_capacity_bytes())
+
+        register.add_file(
+            "channel", SharedContentFile(file_id="b", created_at_unixutc=now_unixutc())
+        )
+        with pytest.raises(FileRegisterError):
+            register.add_file("channel", DummyFile(file_id="c", created_at_unixutc=now_unixutc()))
+
+    def test_shared_content_consumes_reservation(self, register):
+        """The reservation for a file with stored content is returned to the capacity"""
+        register.add_file(
+            "channel", SharedContentFile(file_id="a", created_at_unixutc=now_unixutc())
+        )
+        capacity = register.remaining_capacity_bytes()
+
+        register.reserve_bytes(DUMMY_FILE_SIZE_BYTES)
+        register.add_file(
+            "channel",
+            SharedContentFile(file_id="b", created_at_unixutc=now_unixutc()),
+            reserved_bytes=DUMMY_FILE_SIZE_BYTES,
+        )
+        assert register.remaining_capacity_bytes() == capacity
@@ -3,7 +3,6 @@ import urllib.parse
 
 from booklink.utils import (
     file_size_string,
-    human_friendly_pairing_code,
     now_unixutc,
     url_friendly_code,
 )
@@ -20,15 +19,6 @@ def test_now_unixutc():
     assert dt.tzinfo == datetime.timezone.utc
 
 
-def test_human_friendly_pairing_code():
-    """Test human_friendly_pairing_code function"""
-    code = human_friendly_pairing_code()
-
-    assert isinstance(code, str)
-    assert len(code) == 4
-    assert code.isalnum()
-
-
 def test_url_friendly_code():
     """Test url_friendly_code function"""
     code = url_friendly_code()